@@ -2,8 +2,20 @@
 
 # Copyright (c) 2022 AnonymousDapper
 
-__all__ = ("macro",)
+__all__ = ("macro", "inline", "const_fold", "expand_source", "compile_source")
+
+__version__ = "0.1.0"
+
+from micro.pipeline import compile_source, expand_source
 
 
 def macro(fn):
     return fn
+
+
+def inline(fn):
+    return fn
+
+
+def const_fold(fn):
+    return fn
@@ -0,0 +1,124 @@
+# The MIT License (MIT)
+
+# Copyright (c) 2022 AnonymousDapper
+
+__all__ = ()
+
+import argparse
+import os
+import py_compile
+import sys
+import time
+from concurrent.futures import FIRST_EXCEPTION, Future, ProcessPoolExecutor, wait
+from importlib.util import source_hash
+from pathlib import Path
+from typing import Iterator
+
+from micro import cache, importer, parsing
+
+
+def find_modules(paths: list[Path]) -> Iterator[tuple[Path, str, Path]]:
+    # (sys.path root, module name, file) for every source file under `paths`
+    for path in paths:
+        if path.is_dir():
+            files = sorted(
+                file
+                for file in path.rglob("*.py")
+                if not any(part.startswith(".") or part == "__pycache__" for part in file.relative_to(path).parts)
+            )
+
+        else:
+            files = [path]
+
+        for file in files:
+            file = file.resolve()
+            root = file.parent
+
+            while (root / "__init__.py").is_file():
+                root = root.parent
+
+            parts = list(file.relative_to(root).with_suffix("").parts)
+            if parts[-1] == "__init__":
+                parts.pop()
+
+            yield root, ".".join(parts), file
+
+
+def compile_module(root: Path, fullname: str, file: Path, force: bool) -> tuple[str, float]:
+    # runs in a worker, dependencies are imported (and cached) through the hook as they would be at runtime
+    sys.dont_write_bytecode = False
+
+    if str(root) not in sys.path:
+        sys.path.insert(0, str(root))
+
+    start = time.perf_counter()
+    data = file.read_bytes()
+
+    if not parsing.has_macro_syntax(data):
+        py_compile.compile(str(file), doraise=True)
+        status = "plain"
+
+    elif not force and cache.load(file, source_hash(data)) is not None:
+        status = "cached"
+
+    else:
+        importer.MacroImporter(data).get_code(fullname, file, refresh=True)
+        status = "expanded"
+
+    return status, time.perf_counter() - start
+
+
+def run_compile(args: argparse.Namespace) -> int:
+    modules = list(find_modules([Path(p) for p in args.paths]))
+    counts = {"expanded": 0, "cached": 0, "plain": 0}
+
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(args.jobs) as pool:
+        futures: dict[Future, str] = {
+            pool.submit(compile_module, root, fullname, file, args.force): fullname for root, fullname, file in modules
+        }
+
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_EXCEPTION)
+
+            for future in done:
+                fullname = futures[future]
+
+                if (error := future.exception()) is not None:
+                    print(f"error: {fullname}: {type(error).__name__}: {error}", file=sys.stderr)
+                    pool.shutdown(wait=False, cancel_futures=True)
+
+                    return 1
+
+                status, elapsed = future.result()
+                counts[status] += 1
+
+                if not args.quiet:
+                    print(f"{elapsed * 1000:10.2f} ms  {status:<8}  {fullname}")
+
+    summary = ", ".join(f"{count} {status}" for status, count in counts.items())
+    print(f"{len(modules)} modules in {time.perf_counter() - start:.2f} s ({summary})")
+
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m micro")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    compile_parser = commands.add_parser("compile", help="expand and cache every module under the given paths")
+    compile_parser.add_argument("paths", nargs="+", help="source files or directories")
+    compile_parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="worker processes")
+    compile_parser.add_argument("-f", "--force", action="store_true", help="re-expand modules with a valid cache")
+    compile_parser.add_argument("-q", "--quiet", action="store_true", help="only print the summary and errors")
+    compile_parser.set_defaults(func=run_compile)
+
+    args = parser.parse_args(argv)
+
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
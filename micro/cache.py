@@ -0,0 +1,162 @@
+# The MIT License (MIT)
+
+# Copyright (c) 2022 AnonymousDapper
+
+__all__ = ("CacheEntry", "cache_path", "file_hash", "load", "store")
+
+import marshal
+import os
+import pickle
+import sys
+from dataclasses import dataclass, field
+from importlib.util import MAGIC_NUMBER, cache_from_source, source_hash
+from pathlib import Path
+from types import CodeType
+from typing import TYPE_CHECKING, Optional
+
+from micro import __version__, config, logger, tracing
+
+if TYPE_CHECKING:
+    from micro.walker import MacroTemplate
+
+log = logger.get_logger(__name__)
+trace = tracing.get("cache")
+
+CACHE_SUFFIX = ".micro.pyc"
+
+# bumped whenever the layout of a cache file or a pickled entry changes
+CACHE_FORMAT = 6
+
+# interpreter magic + micro version and cache format, followed by the 8 byte source hash and the 8 byte hash of
+# the build configuration the module was expanded under
+HEADER = MAGIC_NUMBER + f"micro-{__version__}-{CACHE_FORMAT}".encode() + b"\0"
+HASH_LEN = 16
+
+
+@dataclass
+class CacheEntry:
+    code: CodeType
+    macros: list[tuple[list[str], str, "MacroTemplate"]] = field(default_factory=list)
+
+    # source file -> hash, for every module whose macros went into this expansion (transitively)
+    dependencies: dict[str, bytes] = field(default_factory=dict)
+
+    # SymbolTree.add_import arguments of the module's imports of macros, which other modules can import them through
+    imports: list[tuple] = field(default_factory=list)
+
+    def is_fresh(self) -> bool:
+        return all(file_hash(path) == digest for path, digest in self.dependencies.items())
+
+
+# path -> (mtime, size, hash), so a dependency shared by many modules is only read once
+_file_hashes: dict[str, tuple[int, int, bytes]] = {}
+
+
+def file_hash(path: str) -> Optional[bytes]:
+    try:
+        stat = os.stat(path)
+
+    except OSError:
+        return None
+
+    if (cached := _file_hashes.get(path)) is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+
+    try:
+        digest = source_hash(Path(path).read_bytes())
+
+    except OSError:
+        return None
+
+    _file_hashes[path] = (stat.st_mtime_ns, stat.st_size, digest)
+
+    return digest
+
+
+def cache_path(source_path: Path) -> Path:
+    return Path(cache_from_source(str(source_path))).with_suffix(CACHE_SUFFIX)
+
+
+def load(source_path: Path, source_hash: bytes) -> Optional[CacheEntry]:
+    try:
+        data = cache_path(source_path).read_bytes()
+
+    except (OSError, NotImplementedError):
+        if trace.debug:
+            trace.emit(tracing.DEBUG, "miss", file=str(source_path), reason="missing")
+
+        return None
+
+    stamp = source_hash + config.fingerprint()
+
+    if data[: len(HEADER)] != HEADER or data[len(HEADER) : len(HEADER) + HASH_LEN] != stamp:
+        if trace.debug:
+            trace.emit(tracing.DEBUG, "miss", file=str(source_path), reason="outdated")
+
+        return None
+
+    try:
+        code, meta = marshal.loads(data[len(HEADER) + HASH_LEN :])
+        entry = CacheEntry(code, **pickle.loads(meta))
+
+    except Exception as e:
+        log.warning(f"Discarding corrupt cache for {source_path}: {e!r}")
+        return None
+
+    if not entry.is_fresh():
+        if trace.info:
+            trace.emit(tracing.INFO, "miss", file=str(source_path), reason="a macro dependency changed")
+
+        return None
+
+    if trace.debug:
+        trace.emit(tracing.DEBUG, "hit", file=str(source_path))
+
+    return entry
+
+
+def store(source_path: Path, source_hash: bytes, entry: CacheEntry):
+    if sys.dont_write_bytecode:
+        return
+
+    meta = {k: v for k, v in vars(entry).items() if k != "code"}
+
+    try:
+        path = cache_path(source_path)
+        data = HEADER + source_hash + config.fingerprint() + marshal.dumps((entry.code, pickle.dumps(meta)))
+
+        # like importlib, the cache is as readable as the source and writable by its owner
+        mode = (source_path.stat().st_mode | 0o200) & 0o666
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        _write_atomic(path, data, mode)
+
+    except (OSError, NotImplementedError) as e:
+        if trace.info:
+            trace.emit(tracing.INFO, "store failed", file=str(source_path), error=repr(e))
+
+    else:
+        if trace.debug:
+            trace.emit(tracing.DEBUG, "store", file=str(source_path), size=len(data))
+
+
+def _write_atomic(path: Path, data: bytes, mode: int = 0o666):
+    # readers only ever see a missing file or a complete one, so concurrent workers can share the cache;
+    # created with `mode` under the umask, which mkstemp's 0600 would ignore
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{id(data)}.tmp")
+    fd = os.open(tmp, os.O_EXCL | os.O_CREAT | os.O_WRONLY | getattr(os, "O_BINARY", 0), mode)
+
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+
+        os.replace(tmp, path)
+
+    except BaseException:
+        try:
+            os.unlink(tmp)
+
+        except OSError:
+            pass
+
+        raise
@@ -5,8 +5,9 @@
 __all__ = ()
 
 import ast
+from typing import AbstractSet
 
-from micro import consts, logger
+from micro import config, consts, folding, logger
 from micro.symbol import SymbolTree
 from micro.walker import EXPR_NODES
 
@@ -14,9 +15,10 @@ log = logger.get_logger(__name__)
 
 
 class CleanupTransformer(ast.NodeTransformer):
-    def __init__(self, file: str, module: str):
+    def __init__(self, file: str, module: str, shadowed: AbstractSet[str] = frozenset()):
         self.filename = file
         self.path = module.split(".")
+        self.shadowed = shadowed
 
         super().__init__()
 
@@ -31,17 +33,13 @@ class CleanupTransformer(ast.NodeTransformer):
         return node
 
     def visit_Import(self, node: ast.Import):
-        for idx, name in enumerate(node.names):
-            if SymbolTree.check_macro(self.path, name.name):
-                del node.names[idx]
+        node.names = [name for name in node.names if not SymbolTree.check_macro(self.path, name.name)]
 
         if len(node.names) > 0:
             return node
 
     def visit_ImportFrom(self, node: ast.ImportFrom):
-        for idx, name in enumerate(node.names):
-            if SymbolTree.check_macro(self.path, name.name):
-                del node.names[idx]
+        node.names = [name for name in node.names if not SymbolTree.check_macro(self.path, name.name)]
 
         if len(node.names) > 0:
             return node
@@ -55,14 +53,44 @@ class CleanupTransformer(ast.NodeTransformer):
 
                 return ast.Constant(value=ast.unparse(node)[consts.MACRO_QUOTE_LEN + 1 : -1])
 
+            case ast.Name(id=name) if name == consts.MACRO_CONST:
+                return folding.lower_const(node, self.filename, self.shadowed)
+
+            case ast.Name(id=name) if name == consts.MACRO_CFG:
+                # `if cfg!(...):` is resolved during expansion, anywhere else it's just a constant
+                return ast.copy_location(ast.Constant(value=config.check(node, self.filename)), node)
+
+        return node
+
+    def visit_block(self, node: ast.AST):
+        self.generic_visit(node)
+
+        # everything in the block was removed by `cfg!`, `debug_assert!` or `log!`
+        if not node.body:  # type: ignore
+            node.body = [ast.copy_location(ast.Pass(), node)]  # type: ignore
+
+        return node
+
+    def visit_Try(self, node: ast.Try):
+        self.visit_block(node)
+
+        # an emptied `finally:` is gone, and a `try` with nothing to handle or finish is just its statements
+        if not node.handlers and not node.finalbody:
+            return [*node.body, *node.orelse]
+
         return node
 
+    visit_FunctionDef = visit_AsyncFunctionDef = visit_ClassDef = visit_block
+    visit_If = visit_For = visit_AsyncFor = visit_While = visit_With = visit_AsyncWith = visit_block
+    visit_TryStar = visit_Try
+    visit_ExceptHandler = visit_match_case = visit_block
+
     def visit_Module(self, node: ast.Module):
         self.generic_visit(node)
 
         for idx, stmt in enumerate(node.body):
             if type(stmt) in EXPR_NODES:
-                node.body[idx] = ast.Expr(value=stmt)
+                node.body[idx] = ast.copy_location(ast.Expr(value=stmt), stmt)
 
         return node
 
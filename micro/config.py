@@ -0,0 +1,185 @@
+# The MIT License (MIT)
+
+# Copyright (c) 2022 AnonymousDapper
+
+__all__ = (
+    "ConfigError",
+    "configure",
+    "reset",
+    "get",
+    "fingerprint",
+    "evaluate",
+    "check",
+    "level",
+    "min_level",
+    "env_flag",
+)
+
+import ast
+import os
+from importlib.util import source_hash
+from typing import Any, Optional
+
+from micro import logger
+
+log = logger.get_logger(__name__)
+
+# `MICRO_CFG_FEATURE_X=1` sets the flag `feature_x`
+ENV_PREFIX = "MICRO_CFG_"
+
+# flags `debug_assert!` and `cfg!(debug)` check, on unless python runs with -O
+DEBUG = "debug"
+
+# flag holding the lowest level `log!` keeps, calls below it are removed
+LOG_LEVEL = "log_level"
+
+# `trace!` logs below DEBUG
+TRACE = 5
+LEVELS = {"trace": TRACE, "debug": 10, "info": 20, "warn": 30, "warning": 30, "error": 40, "critical": 50, "fatal": 50}
+
+_TRUE = frozenset(("1", "true", "yes", "on"))
+_FALSE = frozenset(("", "0", "false", "no", "off"))
+
+
+class ConfigError(ValueError):
+    pass
+
+
+# flag -> value of the active build configuration
+_config: dict[str, Any] = {}
+_fingerprint = b""
+
+
+def _parse(value: str) -> Any:
+    if (lowered := value.strip().lower()) in _TRUE:
+        return True
+
+    if lowered in _FALSE:
+        return False
+
+    return value
+
+
+def env_flag(name: str) -> bool:
+    # `MICRO_X=0` or `=off` is off like an unset variable, anything else turns it on
+    return os.environ.get(name, "").strip().lower() not in _FALSE
+
+
+def _update():
+    global _fingerprint
+
+    _fingerprint = source_hash(repr(sorted(_config.items())).encode())
+
+
+def reset(environ: Optional[dict[str, str]] = None):
+    # back to the defaults and whatever `MICRO_CFG_*` variables are set
+    environ = os.environ if environ is None else environ
+
+    _config.clear()
+    _config[DEBUG] = __debug__
+
+    for name, value in environ.items():
+        if name.startswith(ENV_PREFIX) and len(name) > len(ENV_PREFIX):
+            _config[name[len(ENV_PREFIX) :].lower()] = _parse(value)
+
+    _update()
+
+
+def configure(flags: Optional[dict[str, Any]] = None, **kwargs: Any):
+    # changes only affect modules expanded afterwards, cached expansions are keyed on the configuration
+    for name, value in {**(flags or {}), **kwargs}.items():
+        if not isinstance(value, (bool, int, float, str, type(None))):
+            raise ConfigError(f"flag `{name}` has to be a bool, number, string or None, not {type(value).__name__}")
+
+        _config[name] = value
+
+    _update()
+
+
+def get(flag: str, default: Any = None) -> Any:
+    return _config.get(flag, default)
+
+
+def fingerprint() -> bytes:
+    # 8 bytes, like the source hash it's stored next to
+    return _fingerprint
+
+
+def _value(node: ast.expr) -> Any:
+    match node:
+        case ast.Name(id=name):
+            return _config.get(name)
+
+        case ast.Constant(value=value):
+            return value
+
+    raise ConfigError(f"`{ast.unparse(node)}` is not a flag or a constant")
+
+
+def evaluate(node: ast.expr) -> bool:
+    # `flag`, `flag == value`, `not`, `and` and `or`, with unset flags being None
+    match node:
+        case ast.Name(id=name):
+            return bool(_config.get(name))
+
+        case ast.Constant(value=str(name)):
+            return bool(_config.get(name))
+
+        case ast.UnaryOp(op=ast.Not(), operand=operand):
+            return not evaluate(operand)
+
+        case ast.BoolOp(op=ast.And(), values=values):
+            return all(evaluate(value) for value in values)
+
+        case ast.BoolOp(op=ast.Or(), values=values):
+            return any(evaluate(value) for value in values)
+
+        case ast.Compare(left=left, ops=[ast.Eq() | ast.NotEq() as op], comparators=[right]):
+            return (_value(left) == _value(right)) == isinstance(op, ast.Eq)
+
+    raise ConfigError(f"`{ast.unparse(node)}` is not a configuration predicate")
+
+
+def check(node: ast.Call, filename: str) -> bool:
+    # `cfg!(predicate, flag=value, ...)`, enabled when all of them hold
+    if not node.args and not node.keywords:
+        raise ConfigError(f"{filename}:{node.lineno}: cfg! takes at least one predicate")
+
+    try:
+        return all(evaluate(arg) for arg in node.args) and all(
+            keyword.arg is not None and _config.get(keyword.arg) == _value(keyword.value) for keyword in node.keywords
+        )
+
+    except ConfigError as e:
+        raise ConfigError(f"{filename}:{node.lineno}: {ast.unparse(node)}: {e}") from None
+
+
+def level(value: Any) -> Optional[int]:
+    # a logging level by number or (case insensitive) name
+    match value:
+        case bool():
+            return None
+
+        case int():
+            return value
+
+        case str() if value.strip().isdigit():
+            return int(value)
+
+        case str():
+            return LEVELS.get(value.strip().lower())
+
+    return None
+
+
+def min_level() -> int:
+    if (value := _config.get(LOG_LEVEL)) is None:
+        return 0
+
+    if (found := level(value)) is None:
+        raise ConfigError(f"flag `{LOG_LEVEL}` is not a logging level: {value!r}")
+
+    return found
+
+
+reset()
@@ -17,6 +17,27 @@ MACRO_SAFE_SUBST_LEN = len(MACRO_SAFE_SUBST)
 MACRO_QUOTE = "quote" + MACRO_CALL
 MACRO_QUOTE_LEN = len(MACRO_QUOTE)
 
+MACRO_CONST = "const" + MACRO_CALL
+
+MACRO_CFG = "cfg" + MACRO_CALL
+MACRO_DEBUG_ASSERT = "debug_assert" + MACRO_CALL
+
+MACRO_LOG = "log" + MACRO_CALL
+MACRO_TRACE = "trace" + MACRO_CALL
+
+# module global the default logger of `log!` and `trace!` is bound to, without a leading `__` so it isn't mangled
+# when the call is in a method
+MACRO_LOGGER = "_micro_log"
+
+# prefix of the temporaries an inlined function's parameters and locals are renamed to
+MACRO_INLINE = "__inline_"
+
+# prefix of the name a module is imported as where a function it defines is inlined
+MACRO_MODULE = "_micro_module_"
+
+# call macros handled by MacroTransformer and CleanupTransformer instead of being looked up
+BUILTIN_CALLS = frozenset((MACRO_QUOTE, MACRO_CONST, MACRO_CFG, MACRO_DEBUG_ASSERT, MACRO_LOG, MACRO_TRACE))
+
 # MACRO_QUOTE = "?"
 # MACRO_QUOTE_LEN = len(MACRO_QUOTE)
 
@@ -0,0 +1,660 @@
+# The MIT License (MIT)
+
+# Copyright (c) 2022 AnonymousDapper
+
+__all__ = ("ConstError", "evaluate", "to_ast", "is_literal", "bound_names", "module_bindings", "const_fold")
+
+import ast
+import builtins
+import operator
+import re
+from typing import AbstractSet, Any, Optional
+
+from micro import logger
+from micro.symbol import MacroContext, SymbolTree
+
+log = logger.get_logger(__name__)
+
+# builtins that only compute something from their arguments; `hash` and anything set-like are left out because
+# their results (or iteration order) change between interpreter runs, and these values end up in cached bytecode
+PURE_BUILTINS = {
+    name: getattr(builtins, name)
+    for name in (
+        "abs",
+        "all",
+        "any",
+        "ascii",
+        "bin",
+        "bool",
+        "bytes",
+        "chr",
+        "dict",
+        "divmod",
+        "enumerate",
+        "float",
+        "format",
+        "hex",
+        "int",
+        "isinstance",
+        "len",
+        "list",
+        "max",
+        "min",
+        "oct",
+        "ord",
+        "pow",
+        "range",
+        "repr",
+        "reversed",
+        "round",
+        "sorted",
+        "str",
+        "sum",
+        "tuple",
+        "zip",
+    )
+}
+
+# methods that can be called on intermediate values; None means every public one
+PURE_METHODS: dict[type, Optional[frozenset[str]]] = {
+    str: None,
+    bytes: None,
+    int: None,
+    float: None,
+    complex: None,
+    bool: None,
+    tuple: None,
+    list: frozenset(("count", "index")),
+    dict: frozenset(("get", "keys", "values", "items")),
+}
+
+BINARY_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+    ast.LShift: operator.lshift,
+    ast.RShift: operator.rshift,
+    ast.BitOr: operator.or_,
+    ast.BitXor: operator.xor,
+    ast.BitAnd: operator.and_,
+}
+
+UNARY_OPS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+    ast.Not: operator.not_,
+    ast.Invert: operator.invert,
+}
+
+COMPARE_OPS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.Is: operator.is_,
+    ast.IsNot: operator.is_not,
+    ast.In: lambda a, b: a in b,
+    ast.NotIn: lambda a, b: a not in b,
+}
+
+# evaluation runs inside the import, so it gets a budget: nodes visited plus items iterated
+MAX_STEPS = 1_000_000
+
+# longest sequence (or widest int, in bits) an operation may build
+MAX_SIZE = 100_000
+
+# `@const_fold!` only replaces expressions whose value is at most this big, like CPython's own folding
+FOLD_SIZE = 4096
+
+
+class ConstError(ValueError):
+    pass
+
+
+# str and bytes methods that pad to a width given as their first argument
+_PADDING = frozenset(("ljust", "rjust", "center", "zfill"))
+
+
+def _argument(args: list, kwargs: dict, idx: int, name: str, default: Any = None) -> Any:
+    return args[idx] if len(args) > idx else kwargs.get(name, default)
+
+
+def _widest(spec: Any) -> int:
+    # the largest width or precision a format string could ask for, any number in it is taken as one
+    if isinstance(spec, bytes):
+        spec = spec.decode("latin-1")
+
+    if not isinstance(spec, str):
+        return 0
+
+    widths = [digits.lstrip("0") for digits in re.findall(r"\d+", spec)]
+
+    # past 18 digits it's too wide anyway, and converting it could hit the int conversion limit
+    return max((int(digits) if len(digits) <= 18 else 1 << 64 for digits in widths if digits), default=0)
+
+
+class _Evaluator:
+    def __init__(self, max_size: int, shadowed: AbstractSet[str] = frozenset()):
+        self.max_size = max_size
+        self.shadowed = shadowed
+        self.names: dict[str, Any] = {}
+        self.steps = 0
+
+    def step(self, count: int = 1):
+        self.steps += count
+
+        if self.steps > MAX_STEPS:
+            raise ConstError(f"took more than {MAX_STEPS} steps")
+
+    def check_size(self, value: Any) -> Any:
+        if isinstance(value, (str, bytes, tuple, list, dict, range)) and len(value) > self.max_size:
+            raise ConstError(f"builds a value of {len(value)} items")
+
+        if isinstance(value, int) and value.bit_length() > self.max_size:
+            raise ConstError(f"builds an int of {value.bit_length()} bits")
+
+        return value
+
+    def binary(self, op: ast.operator, left: Any, right: Any) -> Any:
+        if (fn := BINARY_OPS.get(op.__class__)) is None:
+            raise ConstError(f"`{op.__class__.__name__}` is not supported")
+
+        # refuse to build something huge before building it
+        match op, left, right:
+            case ast.Mult(), (str() | bytes() | tuple() | list()), int() if len(left) * right > self.max_size:
+                raise ConstError(f"builds a value of {len(left) * right} items")
+
+            case ast.Mult(), int(), (str() | bytes() | tuple() | list()) if left * len(right) > self.max_size:
+                raise ConstError(f"builds a value of {left * len(right)} items")
+
+            case ast.Pow(), int(), int() if right > 0 and left.bit_length() * right > self.max_size:
+                raise ConstError(f"builds an int of about {left.bit_length() * right} bits")
+
+            case ast.LShift(), int(), int() if right > self.max_size:
+                raise ConstError(f"builds an int of about {left.bit_length() + right} bits")
+
+            case ast.Mod(), (str() | bytes()), _ if _widest(left) > self.max_size:
+                raise ConstError(f"formats a field {_widest(left)} wide")
+
+        return self.check_size(fn(left, right))
+
+    def sequence(self, elts: list[ast.expr]) -> list:
+        items = []
+
+        for elt in elts:
+            if isinstance(elt, ast.Starred):
+                items.extend(self.iterate(self.eval(elt.value)))
+
+            else:
+                items.append(self.eval(elt))
+
+        return items
+
+    def iterate(self, value: Any):
+        for item in value:
+            self.step()
+            yield item
+
+    def bind(self, target: ast.expr, value: Any):
+        match target:
+            case ast.Name(id=name):
+                self.names[name] = value
+
+            case ast.Tuple(elts=elts) | ast.List(elts=elts):
+                values = list(value)
+                if len(values) != len(elts):
+                    raise ConstError(f"can't unpack {len(values)} values into {len(elts)} names")
+
+                for elt, item in zip(elts, values):
+                    self.bind(elt, item)
+
+            case _:
+                raise ConstError(f"can't assign to `{ast.unparse(target)}`")
+
+    def comprehension(self, generators: list[ast.comprehension], produce):
+        # nested generators as nested loops, names are restored afterwards like a real comprehension scope
+        saved = dict(self.names)
+
+        def loop(idx: int):
+            if idx == len(generators):
+                yield produce()
+                return
+
+            generator = generators[idx]
+            if generator.is_async:
+                raise ConstError("async comprehensions are not supported")
+
+            for item in self.iterate(self.eval(generator.iter)):
+                self.bind(generator.target, item)
+
+                if all(self.eval(test) for test in generator.ifs):
+                    yield from loop(idx + 1)
+
+        try:
+            return list(loop(0))
+
+        finally:
+            self.names = saved
+
+    def call_size(self, fn: Any, target: Any, args: list, kwargs: dict) -> int:
+        # how big the result of a call that grows with its arguments can get, before making it
+        name = getattr(fn, "__name__", "")
+
+        match target:
+            case str() | bytes() if name in _PADDING:
+                width = _argument(args, kwargs, 0, "width", 0)
+                return width if isinstance(width, int) else 0
+
+            case str() | bytes() if name == "expandtabs":
+                tabsize = _argument(args, kwargs, 0, "tabsize", 8)
+                tabs = target.count("\t" if isinstance(target, str) else b"\t")
+                return len(target) + tabs * tabsize if isinstance(tabsize, int) else 0
+
+            case str() | bytes() if name == "replace" and len(args) >= 2:
+                old, new = args[:2]
+                count = _argument(args, kwargs, 2, "count", -1)
+
+                if not isinstance(old, type(target)) or not isinstance(new, type(target)):
+                    return 0
+
+                found = target.count(old) if old else len(target) + 1
+                if isinstance(count, int) and count >= 0:
+                    found = min(found, count)
+
+                return len(target) + found * max(len(new) - len(old), 0)
+
+            case str() | bytes() if name == "join" and args and isinstance(args[0], (list, tuple)):
+                items = args[0]
+                return sum(len(item) for item in items if isinstance(item, (str, bytes))) + len(target) * len(items)
+
+            case str() if name in ("format", "format_map"):
+                return _widest(target)
+
+            case int() if name == "to_bytes":
+                length = _argument(args, kwargs, 0, "length", 1)
+                return length if isinstance(length, int) else 0
+
+            case None if fn is bytes and args and isinstance(args[0], int):
+                return args[0]
+
+            case None if fn is format:
+                return _widest(_argument(args, kwargs, 1, "format_spec"))
+
+        return 0
+
+    def call(self, node: ast.Call) -> Any:
+        target = None
+
+        match node.func:
+            case ast.Name(id=name) if name in PURE_BUILTINS and name in self.shadowed:
+                raise ConstError(f"`{name}` is rebound in the module, it isn't the builtin")
+
+            case ast.Name(id=name) if name in PURE_BUILTINS and name not in self.names:
+                fn = PURE_BUILTINS[name]
+
+            case ast.Attribute(value=value, attr=attr) if not attr.startswith("_"):
+                target = self.eval(value)
+                allowed = PURE_METHODS.get(type(target), frozenset())
+
+                if allowed is not None and attr not in allowed:
+                    raise ConstError(f"`{type(target).__name__}.{attr}` is not a pure method")
+
+                fn = getattr(target, attr)
+
+            case _:
+                raise ConstError(f"`{ast.unparse(node.func)}` is not an allowed function")
+
+        args = self.sequence(node.args)
+        kwargs = {}
+
+        for keyword in node.keywords:
+            if keyword.arg is None:
+                kwargs.update(self.eval(keyword.value))
+
+            else:
+                kwargs[keyword.arg] = self.eval(keyword.value)
+
+        if fn is pow and len(args) == 2 and not kwargs:
+            return self.binary(ast.Pow(), *args)
+
+        if (size := self.call_size(fn, target, args, kwargs)) > self.max_size:
+            raise ConstError(f"builds a value of about {size} items")
+
+        result = fn(*args, **kwargs)
+
+        if isinstance(result, range) and len(result) > self.max_size:
+            raise ConstError(f"builds a range of {len(result)} items")
+
+        return self.check_size(result)
+
+    def eval(self, node: ast.AST) -> Any:
+        self.step()
+
+        match node:
+            case ast.Constant(value=value):
+                return value
+
+            case ast.Name(id=name):
+                if name in self.names:
+                    return self.names[name]
+
+                raise ConstError(f"`{name}` is not a constant")
+
+            case ast.Tuple(elts=elts):
+                return self.check_size(tuple(self.sequence(elts)))
+
+            case ast.List(elts=elts):
+                return self.check_size(self.sequence(elts))
+
+            case ast.Dict(keys=keys, values=values):
+                result = {}
+                for key, value in zip(keys, values):
+                    if key is None:
+                        result.update(self.eval(value))
+
+                    else:
+                        result[self.eval(key)] = self.eval(value)
+
+                return self.check_size(result)
+
+            case ast.BinOp(left=left, op=op, right=right):
+                return self.binary(op, self.eval(left), self.eval(right))
+
+            case ast.UnaryOp(op=op, operand=operand):
+                return UNARY_OPS[op.__class__](self.eval(operand))
+
+            case ast.BoolOp(op=ast.And(), values=values):
+                result = True
+                for value in values:
+                    if not (result := self.eval(value)):
+                        break
+
+                return result
+
+            case ast.BoolOp(op=ast.Or(), values=values):
+                result = False
+                for value in values:
+                    if result := self.eval(value):
+                        break
+
+                return result
+
+            case ast.Compare(left=left, ops=ops, comparators=comparators):
+                current = self.eval(left)
+                for op, comparator in zip(ops, comparators):
+                    right = self.eval(comparator)
+                    if not COMPARE_OPS[op.__class__](current, right):
+                        return False
+
+                    current = right
+
+                return True
+
+            case ast.IfExp(test=test, body=body, orelse=orelse):
+                return self.eval(body) if self.eval(test) else self.eval(orelse)
+
+            case ast.Subscript(value=value, slice=index):
+                return self.eval(value)[self.eval(index)]
+
+            case ast.Slice(lower=lower, upper=upper, step=step):
+                return slice(*(part and self.eval(part) for part in (lower, upper, step)))
+
+            case ast.JoinedStr(values=values):
+                return self.check_size("".join(self.eval(value) for value in values))
+
+            case ast.FormattedValue(value=value, conversion=conversion, format_spec=spec):
+                result = self.eval(value)
+
+                match chr(conversion) if conversion > 0 else None:
+                    case "r":
+                        result = repr(result)
+
+                    case "s":
+                        result = str(result)
+
+                    case "a":
+                        result = ascii(result)
+
+                spec = self.eval(spec) if spec is not None else ""
+
+                if _widest(spec) > self.max_size:
+                    raise ConstError(f"formats a field {_widest(spec)} wide")
+
+                return format(result, spec)
+
+            case ast.Call():
+                return self.call(node)
+
+            case ast.ListComp(elt=elt, generators=generators):
+                return self.check_size(self.comprehension(generators, lambda: self.eval(elt)))
+
+            # only ever an argument, so it's fine to run it right away
+            case ast.GeneratorExp(elt=elt, generators=generators):
+                return iter(self.check_size(self.comprehension(generators, lambda: self.eval(elt))))
+
+            case ast.DictComp(key=key, value=value, generators=generators):
+                pairs = self.comprehension(generators, lambda: (self.eval(key), self.eval(value)))
+                return self.check_size(dict(pairs))
+
+        raise ConstError(f"`{node.__class__.__name__}` can't be evaluated at compile time")
+
+
+def evaluate(node: ast.expr, *, max_size: int = MAX_SIZE, shadowed: AbstractSet[str] = frozenset()) -> Any:
+    # `shadowed` names aren't the builtins they look like where the expression is
+    try:
+        return _Evaluator(max_size, shadowed).eval(node)
+
+    except ConstError:
+        raise
+
+    except Exception as e:
+        raise ConstError(f"raised {e.__class__.__name__}: {e}") from e
+
+
+def to_ast(value: Any) -> ast.expr:
+    match value:
+        case None | bool() | int() | float() | complex() | str() | bytes():
+            return ast.Constant(value=value)
+
+        case _ if value is Ellipsis:
+            return ast.Constant(value=value)
+
+        case tuple():
+            return ast.Tuple(elts=[to_ast(item) for item in value], ctx=ast.Load())
+
+        case list():
+            return ast.List(elts=[to_ast(item) for item in value], ctx=ast.Load())
+
+        case dict():
+            return ast.Dict(keys=[to_ast(key) for key in value], values=[to_ast(item) for item in value.values()])
+
+    raise ConstError(f"a {type(value).__name__} has no literal form")
+
+
+def lower_const(node: ast.Call, filename: str, shadowed: AbstractSet[str] = frozenset()) -> ast.expr:
+    # `const!(expr)`
+    if len(node.args) != 1 or node.keywords:
+        raise ConstError(f"{filename}:{node.lineno}: const! takes exactly one expression")
+
+    try:
+        return ast.copy_location(to_ast(evaluate(node.args[0], shadowed=shadowed)), node)
+
+    except ConstError as e:
+        raise ConstError(f"{filename}:{node.lineno}: const!({ast.unparse(node.args[0])}) {e}") from None
+
+
+def is_literal(node: Any) -> bool:
+    match node:
+        case ast.Constant():
+            return True
+
+        case ast.Tuple(elts=elts) | ast.List(elts=elts):
+            return all(is_literal(elt) for elt in elts)
+
+        case ast.Dict(keys=keys, values=values):
+            return all(key is not None and is_literal(key) for key in keys) and all(map(is_literal, values))
+
+    return False
+
+
+class ConstFolder(ast.NodeTransformer):
+    # bottom-up: once an expression's operands are literals, try it and keep the result if it's small enough
+    def __init__(self, bound: AbstractSet[str]):
+        # names the function or its module binds, which may shadow builtins
+        self.bound = bound
+        self.folded = 0
+
+        super().__init__()
+
+    def _foldable(self, node: ast.expr) -> bool:
+        match node:
+            case ast.BinOp(left=left, right=right):
+                return is_literal(left) and is_literal(right)
+
+            case ast.UnaryOp(operand=operand):
+                return is_literal(operand)
+
+            case ast.BoolOp(values=values):
+                return all(map(is_literal, values))
+
+            case ast.Compare(left=left, comparators=comparators):
+                return is_literal(left) and all(map(is_literal, comparators))
+
+            case ast.IfExp(test=test, body=body, orelse=orelse):
+                return is_literal(test) and is_literal(body) and is_literal(orelse)
+
+            case ast.Subscript(value=value, slice=ast.Slice() as index, ctx=ast.Load()):
+                return is_literal(value) and all(
+                    part is None or is_literal(part) for part in (index.lower, index.upper, index.step)
+                )
+
+            case ast.Subscript(value=value, slice=index, ctx=ast.Load()):
+                return is_literal(value) and is_literal(index)
+
+            # a format spec is a JoinedStr as well, only ones with something to format are worth folding
+            case ast.JoinedStr(values=values):
+                return any(isinstance(value, ast.FormattedValue) for value in values) and all(
+                    isinstance(value, ast.Constant)
+                    or is_literal(value.value)  # type: ignore
+                    and (value.format_spec is None or all(map(is_literal, value.format_spec.values)))  # type: ignore
+                    for value in values
+                )
+
+            case ast.Call(func=func, args=args, keywords=keywords):
+                match func:
+                    case ast.Name(id=name) if name in PURE_BUILTINS and name not in self.bound:
+                        pass
+
+                    case ast.Attribute(value=value) if is_literal(value):
+                        pass
+
+                    case _:
+                        return False
+
+                return all(map(is_literal, args)) and all(
+                    keyword.arg is not None and is_literal(keyword.value) for keyword in keywords
+                )
+
+        return False
+
+    def generic_visit(self, node: ast.AST):
+        super().generic_visit(node)
+
+        # only the branch that's taken survives
+        if isinstance(node, ast.IfExp) and is_literal(node.test):
+            try:
+                taken = node.body if evaluate(node.test) else node.orelse
+
+            except ConstError:
+                return node
+
+            self.folded += 1
+            return taken
+
+        if self._foldable(node):  # type: ignore
+            try:
+                result = to_ast(evaluate(node, max_size=FOLD_SIZE))  # type: ignore
+
+            except ConstError:
+                return node
+
+            self.folded += 1
+            return ast.copy_location(result, node)
+
+        return node
+
+
+def bound_names(node: ast.FunctionDef) -> set[str]:
+    names = {arg.arg for arg in ast.walk(node.args) if isinstance(arg, ast.arg)}
+
+    for child in ast.walk(node):
+        match child:
+            case ast.Name(id=name, ctx=ast.Store() | ast.Del()):
+                names.add(name)
+
+            case ast.FunctionDef(name=name) | ast.AsyncFunctionDef(name=name) | ast.ClassDef(name=name):
+                names.add(name)
+
+            case ast.alias(name=name, asname=asname):
+                names.add(asname or name.partition(".")[0])
+
+    return names
+
+
+def module_bindings(module: ast.Module) -> set[str]:
+    # Names the module binds at the top level, or from a function through `global`. `import name` is left out since
+    # it binds the module of that name, which is what checks like "is `math` the math module" expect.
+    names = {name for child in ast.walk(module) if isinstance(child, ast.Global) for name in child.names}
+    pending = list(module.body)
+
+    while pending:
+        node = pending.pop()
+
+        match node:
+            case ast.FunctionDef(name=name) | ast.AsyncFunctionDef(name=name) | ast.ClassDef(name=name):
+                names.add(name)
+                pending.extend(node.decorator_list)
+                continue
+
+            case ast.Lambda():
+                continue
+
+            case ast.Name(id=name, ctx=ast.Store() | ast.Del()):
+                names.add(name)
+
+            case ast.Import(names=aliases):
+                names.update(alias.asname for alias in aliases if alias.asname is not None)
+                continue
+
+            case ast.ImportFrom(names=aliases):
+                names.update(alias.asname or alias.name for alias in aliases)
+                continue
+
+            case ast.ExceptHandler(name=str(name)) | ast.MatchAs(name=str(name)) | ast.MatchStar(name=str(name)):
+                names.add(name)
+
+            case ast.MatchMapping(rest=str(name)):
+                names.add(name)
+
+        pending.extend(ast.iter_child_nodes(node))
+
+    return names
+
+
+# @const_fold!
+def const_fold(ctx: MacroContext, node: ast.FunctionDef):
+    folder = ConstFolder(bound_names(node) | ctx.shadowed)
+    node.body = [folder.visit(stmt) for stmt in node.body]
+
+    log.debug(f"Folded {folder.folded} expressions in {'.'.join(ctx.path)}.{node.name}")
+
+    return node
+
+
+SymbolTree.register_proc_macro("micro", "const_fold", const_fold)
@@ -0,0 +1,163 @@
+# The MIT License (MIT)
+
+# Copyright (c) 2022 AnonymousDapper
+
+__all__ = ("FusedTransformer",)
+
+import ast
+from typing import Optional
+
+from micro import cleanup, consts, logger, parsing, tree
+from micro.parsing import Markers
+
+log = logger.get_logger(__name__)
+
+
+def _local(node: ast.AST) -> ast.AST:
+    return node
+
+
+class FusedTransformer(ast.NodeTransformer):
+    # Runs MacroRewriter, MacroTransformer, CleanupTransformer and location fixing in a single walk.
+    # The stages keep their own visit_* methods, but the recursion is ours: each original node is renamed on the
+    # way down, expanded on the way up and cleaned right after, while nodes produced by an expansion get a
+    # cleanup and location pass over just their own subtree.
+
+    def __init__(self, file: str, module: str, markers: Optional[Markers] = None):
+        self.filename = file
+        self.module = module
+
+        self.markers = markers or {}
+        self.rewriter = parsing.MacroRewriter(markers) if markers else None
+        self.marker_lines = set(self.rewriter.lines.lines) if self.rewriter else set()
+
+        # every line any stage cares about; original subtrees spanning none of them are left exactly as parsed
+        self.lines = parsing.LineIndex(line for line, _ in self.markers) if markers is not None else None
+
+        self.expander = tree.MacroTransformer(file, module)
+        self.cleaner = cleanup.CleanupTransformer(file, module, self.expander.shadowed)
+
+        if self.rewriter is not None:
+            self.rewriter.generic_visit = _local  # type: ignore
+
+        self.cleaner.generic_visit = _local  # type: ignore
+
+        self.expander.visit = self.visit  # type: ignore
+        self.expander.generic_visit = self.descend  # type: ignore
+
+        # expansion output that has already been cleaned and located
+        self.finished: set[int] = set()
+
+        # inside a definition a proc macro will receive, which has to see it before cleanup does
+        self.deferred = 0
+
+        # node class -> (rewriter, expander, cleaner) visit methods, None where a stage has nothing to do,
+        # and whether it can carry decorators
+        self.dispatch: dict[type, tuple] = {}
+
+        super().__init__()
+
+    @property
+    def dependencies(self) -> set[str]:
+        return self.expander.dependencies
+
+    def descend(self, node: ast.AST) -> ast.AST:
+        return super().generic_visit(node)
+
+    def _methods(self, cls: type) -> tuple:
+        name = f"visit_{cls.__name__}"
+
+        methods = self.dispatch[cls] = (
+            getattr(self.rewriter, name, None),
+            getattr(self.expander, name, None),
+            getattr(self.cleaner, name, None),
+            "decorator_list" in cls._fields,
+        )
+
+        return methods
+
+    def _has_proc_macro(self, node: ast.AST) -> bool:
+        for decorator in node.decorator_list:  # type: ignore
+            target = decorator.func if isinstance(decorator, ast.Call) else decorator
+
+            if isinstance(target, ast.Name) and (
+                target.id.endswith(consts.MACRO_CALL)
+                or self.markers.get((target.lineno, target.col_offset), ("",))[0] == consts.MACRO_CALL
+            ):
+                return True
+
+        return False
+
+    def visit(self, node: ast.AST):
+        if self.lines is not None and not self.lines.covers(node):
+            return node
+
+        if (methods := self.dispatch.get(node.__class__)) is None:
+            methods = self._methods(node.__class__)
+
+        rename, expand, clean, decorated = methods
+
+        if rename is not None and getattr(node, "lineno", None) in self.marker_lines:
+            rename(node)
+
+        if defer := decorated and self._has_proc_macro(node):
+            self.deferred += 1
+
+        result = expand(node) if expand is not None else self.descend(node)
+
+        if defer:
+            self.deferred -= 1
+
+        if self.deferred:
+            return result
+
+        if defer:
+            # the whole definition skipped cleanup, so whatever the proc macro left gets the full pass
+            if result is None or isinstance(result, ast.AST):
+                return self.finish(result, node)
+
+            return self.finish_all(result, node)
+
+        if result is node:
+            if clean is None:
+                return node
+
+            result = clean(node)
+
+            if isinstance(result, ast.AST) and result is not node:
+                ast.fix_missing_locations(ast.copy_location(result, node))
+
+            return result
+
+        if result is None or isinstance(result, ast.AST):
+            return self.finish(result, node)
+
+        return self.finish_all(result, node)
+
+    def finish(self, new: Optional[ast.AST], origin: ast.AST):
+        if new is None or id(new) in self.finished:
+            return new
+
+        new = cleanup.CleanupTransformer(self.filename, self.module, self.expander.shadowed).visit(new)
+
+        # a block cleanup dissolved leaves its statements, which were cleaned with it
+        for item in new if isinstance(new, list) else [new] if new is not None else []:
+            if "lineno" in item._attributes and not hasattr(item, "lineno"):
+                ast.copy_location(item, origin)
+
+            ast.fix_missing_locations(item)
+            self.finished.add(id(item))
+
+        return new
+
+    def finish_all(self, items: list, origin: ast.AST) -> list:
+        finished = []
+
+        for item in items:
+            if isinstance(new := self.finish(item, origin), list):
+                finished.extend(new)
+
+            elif new is not None:
+                finished.append(new)
+
+        return finished
@@ -2,28 +2,218 @@
 
 # Copyright (c) 2022 AnonymousDapper
 
-__all__ = ()
+__all__ = ("register",)
 
 import ast
+import os
 import sys
-from importlib.machinery import ModuleSpec, PathFinder
+import time
+from importlib.machinery import ModuleSpec, PathFinder, SourceFileLoader
+from importlib.util import decode_source, resolve_name, source_hash
 from pathlib import Path
-from types import ModuleType
+from types import CodeType, ModuleType
+from typing import Iterable, Optional, Union
 
 import astpretty
 
-from micro import cleanup, logger, parsing, tree
+from micro import cache, logger, parsing, pipeline, timing
+from micro.symbol import SymbolTree
 
 log = logger.get_logger(__name__)
 
+# module -> (source file, source hash) for every module loaded through MacroImporter
+SOURCES: dict[str, tuple[str, bytes]] = {}
+
+# module -> {source file: source hash} of every module its expansion depends on
+DEPENDENCIES: dict[str, dict[str, bytes]] = {}
+
+# module -> whether it goes through MacroImporter, a module importing from one has to be expanded for its imports of
+# macros to be stripped, even without any macro syntax of its own
+MACRO_MODULES: dict[str, bool] = {}
+
+
+class ImportScope:
+    def __init__(self):
+        self.packages: set[str] = set()
+        self.paths: list[str] = []
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.packages or self.paths)
+
+    def add(self, packages: Iterable[str], paths: Iterable[Union[str, Path]]):
+        self.packages.update(packages)
+        self.paths.extend(os.path.join(os.path.abspath(p), "") for p in paths)
+
+    def match_name(self, fullname: str) -> bool:
+        name = fullname
+        while name:
+            if name in self.packages:
+                return True
+
+            name = name.rpartition(".")[0]
+
+        return False
+
+    def match_path(self, origin: str) -> bool:
+        origin = os.path.abspath(origin)
+
+        return any(origin.startswith(root) for root in self.paths)
+
+
+SCOPE = ImportScope()
+
+
+def register(*packages: str, paths: Iterable[Union[str, Path]] = ()):
+    # restrict MacroImporter to these packages (and their submodules) and to modules under these paths
+    SCOPE.add(packages, paths)
+
+
+def load_config(start: Optional[Path] = None):
+    try:
+        import tomllib
+
+    except ImportError:
+        try:
+            import tomli as tomllib  # type: ignore
+
+        except ImportError:
+            return
+
+    start = (start or Path.cwd()).resolve()
+
+    for directory in (start, *start.parents):
+        if (pyproject := directory / "pyproject.toml").is_file():
+            try:
+                config = tomllib.loads(pyproject.read_text()).get("tool", {}).get("micro", {})
+
+            except (OSError, ValueError) as e:
+                log.warning(f"Could not read {pyproject}: {e!r}")
+                return
+
+            SCOPE.add(config.get("packages", []), (directory / p for p in config.get("paths", [])))
+            return
+
+
+def get_dependencies(fullname: str) -> dict[str, bytes]:
+    return DEPENDENCIES.get(fullname, {})
+
+
+def collect_dependencies(fullname: str, modules: set[str]) -> dict[str, bytes]:
+    dependencies = {}
+
+    for name in modules:
+        # micro's own macros are covered by the version in the cache header
+        if name == fullname or name.partition(".")[0] == "micro":
+            continue
+
+        if name in SOURCES:
+            path, digest = SOURCES[name]
+
+        elif (path := getattr(sys.modules.get(name), "__file__", None)) is not None:
+            if (digest := cache.file_hash(path)) is None:
+                continue
+
+        else:
+            continue
+
+        dependencies[path] = digest
+        dependencies.update(DEPENDENCIES.get(name, {}))
+
+    return dependencies
+
+
+def _search_path(fullname: str) -> Optional[list[str]]:
+    # where a submodule would be found, without importing its parent packages early
+    parent = fullname.rpartition(".")[0]
+
+    if (module := sys.modules.get(parent)) is not None:
+        return getattr(module, "__path__", None)
+
+    if (spec := PathFinder.find_spec(parent, _search_path(parent) if "." in parent else None)) is None:
+        return None
+
+    return spec.submodule_search_locations
+
+
+def _is_macro_module(fullname: str) -> bool:
+    if (known := MACRO_MODULES.get(fullname)) is not None:
+        return known
+
+    # anything already imported registered its macros (or has none), and micro's own are real functions
+    if fullname in sys.modules or fullname.partition(".")[0] == "micro":
+        return False
+
+    MACRO_MODULES[fullname] = False  # import cycles
+
+    path = _search_path(fullname) if "." in fullname else None
+
+    if "." in fullname and path is None:
+        return False
+
+    spec = MacroImporter.find_spec(fullname, path)
+    MACRO_MODULES[fullname] = spec is not None and isinstance(spec.loader, MacroImporter)
+
+    return MACRO_MODULES[fullname]
+
+
+def imports_macros(data: bytes, package: str) -> bool:
+    for name in parsing.imported_modules(data):
+        try:
+            name = resolve_name(name, package)
+
+        except (ImportError, ValueError):
+            continue
+
+        if _is_macro_module(name):
+            return True
+
+    return False
+
 
 class MacroImporter:
+    def __init__(self, data: Optional[bytes] = None, read_time: float = 0.0):
+        # source already read by find_spec, consumed by the first get_code
+        self.data = data
+        self.read_time = read_time
+
     @classmethod
     def find_spec(cls, fullname: str, path, target=None):
+        # nothing configured keeps the old behaviour of hooking every import
+        in_scope = not SCOPE.configured or SCOPE.match_name(fullname)
+
+        if not (in_scope or SCOPE.paths):
+            return None
+
         source_spec = PathFinder.find_spec(fullname, path, target)
 
         if source_spec is not None:
-            source_spec.loader = cls()  # type: ignore
+            if not isinstance(source_spec.loader, SourceFileLoader) or source_spec.origin is None:
+                return source_spec
+
+            if not (in_scope or SCOPE.match_path(source_spec.origin)):
+                return None
+
+            start = time.perf_counter()
+
+            try:
+                data = Path(source_spec.origin).read_bytes()
+
+            except OSError:
+                return source_spec
+
+            read_time = time.perf_counter() - start
+
+            package = fullname if source_spec.submodule_search_locations is not None else fullname.rpartition(".")[0]
+
+            # no macro syntax at all and no macros imported, leave it to the regular loader (and __pycache__)
+            if not (parsing.has_macro_syntax(data) or imports_macros(data, package)):
+                MACRO_MODULES[fullname] = False
+                return source_spec
+
+            MACRO_MODULES[fullname] = True
+
+            source_spec.loader = cls(data, read_time)  # type: ignore
 
             return source_spec
 
@@ -34,25 +224,74 @@ class MacroImporter:
         if module.__file__ is None:
             raise ValueError(f"Module {module} has no __file__")
 
-        file_path = Path(module.__file__)
-        source_tree = parsing.parse_rename_safe(file_path)
+        with timing.module(module.__name__):
+            code = self.get_code(module.__name__, Path(module.__file__))
+
+            with timing.phase("exec"):
+                exec(code, module.__dict__, module.__dict__)
+
+    def get_code(self, fullname: str, file_path: Path, *, refresh: bool = False) -> CodeType:
+        data, self.data = self.data, None
+
+        if data is None:
+            with timing.phase("read"):
+                data = file_path.read_bytes()
+
+        else:
+            timing.add_phase("read", self.read_time)
+
+        key = source_hash(data)
+
+        SOURCES[fullname] = (str(file_path), key)
+
+        with timing.phase("cache"):
+            entry = None if refresh else cache.load(file_path, key)
+
+        if entry is not None:
+            # expansion is skipped entirely, so re-register the macros this module would have defined, and the
+            # imports of macros it re-exports
+            for path, name, node in entry.macros:
+                SymbolTree.register_macro(path, name, node, module=fullname)
+
+            for path, module, import_from, asname, package, level in entry.imports:
+                SymbolTree.add_import(
+                    path, module, import_from=import_from, asname=asname, package=package, level=level, importer=fullname
+                )
+
+            DEPENDENCIES[fullname] = entry.dependencies
+
+            return entry.code
+
+        code, modules = self.source_to_code(data, file_path, fullname)
+        dependencies = DEPENDENCIES[fullname] = collect_dependencies(fullname, modules)
+
+        macros = SymbolTree.get_module_macros(fullname)
+        imports = SymbolTree.get_module_imports(fullname)
+
+        cache.store(file_path, key, cache.CacheEntry(code, macros, dependencies, imports))
+
+        return code
+
+    def source_to_code(self, data: bytes, file_path: Path, fullname: str) -> tuple[CodeType, set[str]]:
+        text = decode_source(data)
+        source_tree, markers = pipeline.parse(text, file_path.name)
 
         #log.info(f"[[ Original AST {file_path.name}\n{astpretty.pformat(source_tree, show_offsets=False)}\n]]")
 
         #log.debug(f"<< Prepared source: {file_path.name}\n{ast.unparse(source_tree)}\n>>")
 
-        transformed_tree = tree.MacroTransformer(file_path.name, module.__name__).visit(source_tree)
-
-        cleaned_tree = ast.fix_missing_locations(
-            cleanup.CleanupTransformer(file_path.name, module.__name__).visit(transformed_tree)
-        )
+        cleaned_tree, dependencies = pipeline.expand_tree(source_tree, markers, text, file_path.name, fullname)
 
         #log.info(f"# [[ Transformed AST {file_path.name}\n{astpretty.pformat(cleaned_tree, show_offsets=False)}\n]]")
 
         #log.debug(f"<< Transformed source: {file_path.name}\n{ast.unparse(cleaned_tree)}\n>>")
 
-        code = compile(cleaned_tree, file_path.name, "exec")
-        exec(code, module.__dict__, module.__dict__)
+        with timing.phase("compile"):
+            code = compile(cleaned_tree, file_path.name, "exec")
+
+        return code, dependencies
+
 
+load_config()
 
 sys.meta_path.insert(0, MacroImporter)
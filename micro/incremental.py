@@ -0,0 +1,155 @@
+# The MIT License (MIT)
+
+# Copyright (c) 2022 AnonymousDapper
+
+__all__ = ("enable", "expand", "clear")
+
+import ast
+from dataclasses import dataclass, field
+from typing import Optional
+
+from micro import config, consts, folding, fused, logger, tracing, tree, walker
+from micro.parsing import Markers
+from micro.symbol import SymbolTree
+
+log = logger.get_logger(__name__)
+trace = tracing.get("expand")
+
+ENABLED = config.env_flag("MICRO_INCREMENTAL")
+
+
+@dataclass
+class StatementEntry:
+    start: int
+    nodes: list[ast.stmt]
+    dependencies: set[str]
+
+    # every macro the expansion invoked, including ones the source doesn't name, with its registry version
+    invoked: dict[tuple[tuple[str, ...], str], Optional[int]]
+
+    # names the expansion relies on the module binding, which are added to it once
+    prelude: dict[str, str] = field(default_factory=dict)
+
+    def is_current(self) -> bool:
+        return all(
+            SymbolTree.lookup_version(list(path), name) == version for (path, name), version in self.invoked.items()
+        )
+
+
+# module -> statement key -> expanded and cleaned statements, only holds what the last expansion used
+_statements: dict[str, dict[tuple, StatementEntry]] = {}
+
+
+def enable():
+    global ENABLED
+
+    ENABLED = True
+
+
+def clear(module: Optional[str] = None):
+    if module is None:
+        _statements.clear()
+
+    else:
+        _statements.pop(module, None)
+
+
+def _statement_key(
+    stmt: ast.stmt, start: int, lines: list[str], calls: dict[int, list[str]], path: list[str], shadowed: tuple
+) -> tuple:
+    # the exact source span, the build configuration, what the module binds at the top level (which decides whether
+    # a name is a builtin), and the current version of every macro it invokes
+    macros = tuple(
+        (name, SymbolTree.lookup_version(path, name))
+        for line in range(start, stmt.end_lineno + 1)  # type: ignore
+        for name in calls.get(line, ())
+    )
+
+    span = "".join(lines[start - 1 : stmt.end_lineno])
+
+    return span, stmt.col_offset, stmt.end_col_offset, config.fingerprint(), shadowed, macros
+
+
+def _shift(nodes: list[ast.stmt], delta: int):
+    # like ast.increment_lineno, but nodes shared with a macro template (or appearing twice) are left alone
+    seen: set[int] = set()
+    todo: list[ast.AST] = list(nodes)
+
+    while todo:
+        node = todo.pop()
+
+        if id(node) in seen or walker.is_template(node):
+            continue
+
+        seen.add(id(node))
+
+        if "lineno" in node._attributes:
+            node.lineno = getattr(node, "lineno", 0) + delta  # type: ignore
+
+        if "end_lineno" in node._attributes and (end := getattr(node, "end_lineno", None)) is not None:
+            node.end_lineno = end + delta  # type: ignore
+
+        todo.extend(ast.iter_child_nodes(node))
+
+
+def expand(
+    source_tree: ast.Module, markers: Markers, text: str, filename: str, module: str
+) -> tuple[ast.Module, set[str]]:
+    lines = text.splitlines(keepends=True)
+
+    calls: dict[int, list[str]] = {}
+    for (line, _), (kind, name) in markers.items():
+        if kind == consts.MACRO_CALL:
+            calls.setdefault(line, []).append(name)
+
+    previous = _statements.get(module, {})
+    current: dict[tuple, StatementEntry] = {}
+
+    transformer = fused.FusedTransformer(filename, module, markers)
+    transformer.expander.whole_module = False
+    transformer.expander.shadowed.update(folding.module_bindings(source_tree))
+    shadowed = tuple(sorted(transformer.expander.shadowed))
+
+    body: list[ast.stmt] = []
+    dependencies: set[str] = set()
+    reused = 0
+
+    for stmt in source_tree.body:
+        start = min([stmt.lineno, *(d.lineno for d in getattr(stmt, "decorator_list", ()))])
+        key = _statement_key(stmt, start, lines, calls, transformer.expander.path, shadowed)
+
+        if (entry := previous.get(key)) is not None and entry.is_current():
+            # unchanged statement, possibly moved by an edit above it
+            if (delta := start - entry.start) != 0:
+                _shift(entry.nodes, delta)
+
+                entry.start = start
+
+            reused += 1
+
+        else:
+            transformer.expander.dependencies = set()
+            transformer.expander.invoked = {}
+
+            # wrapped in a module so top-level expression results get their `Expr` like they would in the full tree
+            expanded = transformer.visit(ast.Module(body=[stmt], type_ignores=[]))
+            expander = transformer.expander
+            entry = StatementEntry(start, expanded.body, transformer.dependencies, expander.invoked, expander.prelude)
+
+        current[key] = entry
+        body.extend(entry.nodes)
+        dependencies |= entry.dependencies
+
+    if trace.info:
+        trace.emit(tracing.INFO, "incremental", module=module, reused=reused, statements=len(source_tree.body))
+
+    _statements[module] = current
+
+    expanded_tree = ast.Module(body=body, type_ignores=source_tree.type_ignores)
+
+    prelude = {name: source for entry in current.values() for name, source in entry.prelude.items()}
+
+    if prelude:
+        tree.insert_prelude(expanded_tree, prelude)
+
+    return expanded_tree, dependencies
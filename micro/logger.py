@@ -37,10 +37,17 @@ STREAM_HANDLER = logging.StreamHandler()
 
 STREAM_HANDLER.setFormatter(ConsoleFormatter())
 
+# the handler and level are set once, on the package logger every module's logger propagates to
+ROOT = logging.getLogger(__name__.partition(".")[0])
+
+ROOT.setLevel(LOG_LEVEL)
+ROOT.addHandler(STREAM_HANDLER)
+
 
 def get_logger(name: str):
     logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG)
-    logger.addHandler(STREAM_HANDLER)
+
+    if logger is not ROOT and not logger.name.startswith(ROOT.name + "."):
+        logger.addHandler(STREAM_HANDLER)
 
     return logger
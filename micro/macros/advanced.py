@@ -0,0 +1,1056 @@
+# The MIT License (MIT)
+
+# Copyright (c) 2022 AnonymousDapper
+
+__all__ = ("unroll", "record", "memo", "vectorize")
+
+import ast
+import textwrap
+from collections import Counter
+from copy import deepcopy
+from typing import Any, Callable, Optional, Union, cast
+
+from micro import logger
+from micro.folding import ConstError, bound_names, evaluate, to_ast
+from micro.symbol import MacroContext, SymbolTree
+
+log = logger.get_logger(__name__)
+
+# largest number of nodes a single loop may unroll into, past that the loop is left alone
+MAX_SIZE = 4096
+
+_SCOPES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)
+_LOOPS = (ast.For, ast.AsyncFor, ast.While)
+_COMPREHENSIONS = (ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)
+
+
+def _option(
+    ctx: MacroContext,
+    macro: str,
+    name: str,
+    position: Optional[int],
+    default: Any,
+    valid: Callable[[Any], bool],
+    expected: str,
+) -> Any:
+    # a decorator argument, by keyword or at `position`; they have to be constant
+    if name in ctx.kwargs:
+        node = ctx.kwargs[name]
+
+    elif position is not None and len(ctx.args) > position:
+        node = ctx.args[position]
+
+    else:
+        return default
+
+    try:
+        value = evaluate(node, shadowed=ctx.shadowed)
+
+    except ConstError as e:
+        raise ConstError(f"{ctx.file}:{node.lineno}: {macro}! {name}={ast.unparse(node)} {e}") from None
+
+    if not valid(value):
+        raise ConstError(f"{ctx.file}:{node.lineno}: {macro}! {name} must be {expected}, got {value!r}")
+
+    return value
+
+
+def _is_positive_int(value: Any) -> bool:
+    return type(value) is int and value > 0
+
+
+def _int_option(ctx: MacroContext, macro: str, name: str, position: Optional[int], default: Any) -> Any:
+    return _option(ctx, macro, name, position, default, _is_positive_int, "a positive int")
+
+
+def _bool_option(ctx: MacroContext, macro: str, name: str, default: bool) -> bool:
+    return _option(ctx, macro, name, None, default, lambda value: type(value) is bool, "True or False")
+
+
+def _immutable(value: Any) -> bool:
+    match value:
+        case None | bool() | int() | float() | complex() | str() | bytes():
+            return True
+
+        case tuple():
+            return all(map(_immutable, value))
+
+    return False
+
+
+def _target_names(target: ast.expr) -> Optional[list[str]]:
+    match target:
+        case ast.Name(id=name):
+            return [name]
+
+        case ast.Tuple(elts=elts) if all(isinstance(elt, ast.Name) for elt in elts):
+            return [elt.id for elt in elts]  # type: ignore
+
+    return None
+
+
+def _size(nodes: list[ast.stmt]) -> int:
+    return sum(1 for stmt in nodes for _ in ast.walk(stmt))
+
+
+def _escapes(nodes: list[ast.AST]) -> bool:
+    # `break`/`continue` belonging to this loop (not to a nested one)
+    for node in nodes:
+        match node:
+            case ast.Break() | ast.Continue():
+                return True
+
+            case _ if isinstance(node, _LOOPS):
+                # a nested loop's `else` still belongs to us
+                if _escapes(node.orelse):
+                    return True
+
+            case _ if isinstance(node, _SCOPES):
+                pass
+
+            case _ if _escapes(list(ast.iter_child_nodes(node))):
+                return True
+
+    return False
+
+
+def _rebinds(nodes: list[ast.stmt], names: set[str]) -> bool:
+    for stmt in nodes:
+        for node in ast.walk(stmt):
+            match node:
+                case ast.Name(id=name, ctx=ast.Store() | ast.Del()) if name in names:
+                    return True
+
+                # closures would see the substituted value instead of the variable
+                case _ if isinstance(node, _SCOPES):
+                    if any(isinstance(child, ast.Name) and child.id in names for child in ast.walk(node)):
+                        return True
+
+                case ast.Global(names=declared) | ast.Nonlocal(names=declared) if names.intersection(declared):
+                    return True
+
+    return False
+
+
+class _Substitute(ast.NodeTransformer):
+    def __init__(self, values: dict[str, ast.expr]):
+        self.values = values
+
+    def visit_Name(self, node: ast.Name):
+        if isinstance(node.ctx, ast.Load) and node.id in self.values:
+            return ast.copy_location(deepcopy(self.values[node.id]), node)
+
+        return node
+
+    def generic_visit(self, node: ast.AST):
+        # a comprehension that binds one of the names has its own variable, leave it untouched
+        if isinstance(node, _COMPREHENSIONS):
+            targets = (name for gen in node.generators for name in ast.walk(gen.target))
+
+            if any(isinstance(name, ast.Name) and name.id in self.values for name in targets):
+                return node
+
+        return super().generic_visit(node)
+
+
+class Unroller(ast.NodeTransformer):
+    def __init__(self, bound: set[str], factor: Optional[int], max_size: int):
+        self.bound = bound
+        self.factor = factor
+        self.max_size = max_size
+        self.unrolled = 0
+
+        # loop variables read after their loop (by loop id), they need the final value assigned
+        self.used: dict[int, set[str]] = {}
+
+    def _values(self, node: ast.For, names: list[str]) -> Optional[Union[range, list[tuple]]]:
+        match node.iter:
+            case ast.Call(func=ast.Name(id="range"), args=args, keywords=[]) if "range" not in self.bound:
+                if len(names) != 1 or not 1 <= len(args) <= 3:
+                    return None
+
+                try:
+                    bounds = [evaluate(arg, shadowed=self.bound) for arg in args]
+
+                except ConstError:
+                    return None
+
+                if not all(type(bound) is int for bound in bounds):
+                    return None
+
+                return range(*bounds)
+
+            case ast.Tuple(elts=elts) | ast.List(elts=elts):
+                try:
+                    items = [evaluate(elt, shadowed=self.bound) for elt in elts]
+
+                except ConstError:
+                    return None
+
+                if not all(map(_immutable, items)):
+                    return None
+
+                if len(names) == 1:
+                    return [(item,) for item in items]
+
+                if all(type(item) is tuple and len(item) == len(names) for item in items):
+                    return items
+
+        return None
+
+    def _copy(self, body: list[ast.stmt], values: dict[str, ast.expr]) -> list[ast.stmt]:
+        substitute = _Substitute(values)
+        return [substitute.visit(deepcopy(stmt)) for stmt in body]
+
+    def _finish(self, node: ast.For, names: list[str], last: Optional[tuple]) -> list[ast.stmt]:
+        # Python leaves the loop variable bound to the last item
+        if last is None or not self.used.get(id(node)):
+            return []
+
+        target = deepcopy(node.target)
+        for name in ast.walk(target):
+            if isinstance(name, ast.Name):
+                name.ctx = ast.Store()
+
+        value = to_ast(last if len(names) > 1 else last[0])
+        return [ast.copy_location(ast.Assign(targets=[target], value=value), node)]
+
+    def visit_For(self, node: ast.For):
+        # innermost loops first, so their copies are what gets repeated
+        self.generic_visit(node)
+
+        names = _target_names(node.target)
+        if names is None or _escapes(node.body) or _rebinds(node.body, set(names)):
+            return node
+
+        values = self._values(node, names)
+        if values is None:
+            return node
+
+        size = _size(node.body)
+        count = len(values)
+
+        if count * size <= self.max_size and (self.factor is None or count <= self.factor):
+            items = [(value,) for value in values] if isinstance(values, range) else values
+
+            body = []
+            for item in items:
+                body.extend(self._copy(node.body, {name: to_ast(value) for name, value in zip(names, item)}))
+
+            body.extend(node.orelse)
+            body.extend(self._finish(node, names, items[-1] if items else None))
+
+        elif self.factor is not None and self.factor > 1 and isinstance(values, range):
+            if self.factor * size > self.max_size:
+                return node
+
+            body = self._partial(node, names[0], values)
+
+        else:
+            log.debug(f"Not unrolling loop at line {node.lineno}: {count} iterations of {size} nodes")
+            return node
+
+        self.unrolled += 1
+        return [ast.fix_missing_locations(stmt) for stmt in body] or [ast.copy_location(ast.Pass(), node)]
+
+    def _partial(self, node: ast.For, name: str, values: range) -> list[ast.stmt]:
+        # groups of `factor` copies, each offset from the group's first value, then the leftovers as constants
+        factor = self.factor or 1
+        split = len(values) - len(values) % factor
+        head, tail = values[:split], values[split:]
+
+        group = []
+        for offset in range(factor):
+            value: ast.expr = ast.Name(id=name, ctx=ast.Load())
+            if offset:
+                value = ast.BinOp(left=value, op=ast.Add(), right=ast.Constant(value=offset * values.step))
+
+            group.extend(self._copy(node.body, {name: value}))
+
+        bounds = [ast.Constant(value=bound) for bound in (head.start, head.stop, head.step * factor)]
+        loop = ast.For(
+            target=ast.Name(id=name, ctx=ast.Store()),
+            iter=ast.Call(func=ast.Name(id="range", ctx=ast.Load()), args=bounds, keywords=[]),
+            body=group,
+            orelse=[],
+        )
+
+        body: list[ast.stmt] = [ast.copy_location(loop, node)]
+        for item in tail:
+            body.extend(self._copy(node.body, {name: ast.Constant(value=item)}))
+
+        body.extend(node.orelse)
+        body.extend(self._finish(node, [name], (values[-1],) if values else None))
+
+        return body
+
+
+def _loads(nodes: list[ast.AST]) -> Counter[str]:
+    return Counter(
+        child.id
+        for node in nodes
+        for child in ast.walk(node)
+        if isinstance(child, ast.Name) and isinstance(child.ctx, ast.Load)
+    )
+
+
+def _used_after(node: ast.FunctionDef) -> dict[int, set[str]]:
+    # loop variables that are read somewhere other than their loop's body, by loop
+    loads = _loads(node.body)
+    used = {}
+
+    for loop in ast.walk(node):
+        if isinstance(loop, ast.For) and (names := _target_names(loop.target)):
+            inside = _loads(loop.body)
+            used[id(loop)] = {name for name in names if loads[name] > inside[name]}
+
+    return used
+
+
+# @unroll! / @unroll!(factor, max_size=...)
+def unroll(ctx: MacroContext, node: ast.FunctionDef):
+    factor = _int_option(ctx, "unroll", "factor", 0, None)
+    max_size = _int_option(ctx, "unroll", "max_size", 1, MAX_SIZE)
+
+    # a builtin the module rebinds is as unknown as one the function does
+    unroller = Unroller(bound_names(node) | ctx.shadowed, factor, max_size or MAX_SIZE)
+    unroller.used = _used_after(node)
+    unroller.generic_visit(node)
+
+    log.debug(f"Unrolled {unroller.unrolled} loops in {'.'.join(ctx.path)}.{node.name}")
+
+    return node
+
+
+SymbolTree.register_proc_macro("micro macros advanced", "unroll", unroll)
+
+
+# `dataclasses` only get this far at runtime, through `exec`; records are plain AST cached with the module
+_MUTABLE = (ast.List, ast.Dict, ast.Set, ast.ListComp, ast.DictComp, ast.SetComp)
+
+
+def _is_classvar(annotation: ast.expr) -> bool:
+    match annotation:
+        case ast.Subscript(value=value):
+            return _is_classvar(value)
+
+        case ast.Name(id="ClassVar") | ast.Attribute(attr="ClassVar"):
+            return True
+
+        case ast.Constant(value=str() as text):
+            return text.startswith(("ClassVar", "typing.ClassVar"))
+
+    return False
+
+
+def _member(source: str, origin: ast.AST) -> ast.stmt:
+    stmt = ast.parse(source).body[0]
+
+    for child in ast.walk(stmt):
+        if "lineno" in child._attributes:
+            ast.copy_location(child, origin)
+
+    return stmt
+
+
+def _fields_tuple(owner: str, fields: list[str]) -> str:
+    return f"({''.join(f'{owner}.{field}, ' for field in fields)})"
+
+
+# @record! / @record!(eq=True, frozen=False, repr=True, slots=True, match_args=True)
+def record(ctx: MacroContext, node: ast.ClassDef):
+    if not isinstance(node, ast.ClassDef):
+        raise TypeError(f"{ctx.file}:{node.lineno}: record! only applies to classes")
+
+    eq = _bool_option(ctx, "record", "eq", True)
+    frozen = _bool_option(ctx, "record", "frozen", False)
+    use_repr = _bool_option(ctx, "record", "repr", True)
+    slots = _bool_option(ctx, "record", "slots", True)
+    match_args = _bool_option(ctx, "record", "match_args", True)
+
+    fields: list[str] = []
+    defaults: list[ast.expr] = []
+    defined: set[str] = set()
+
+    for stmt in node.body:
+        match stmt:
+            case ast.AnnAssign(target=ast.Name(id=name), annotation=annotation, simple=1) if not _is_classvar(
+                annotation
+            ):
+                if stmt.value is not None:
+                    if isinstance(stmt.value, _MUTABLE):
+                        raise ValueError(f"{ctx.file}:{stmt.lineno}: record! field `{name}` has a mutable default")
+
+                    defaults.append(stmt.value)
+
+                    # a slot and a class attribute can't share a name, the default lives in `__init__` instead
+                    if slots:
+                        stmt.value = None
+
+                elif defaults:
+                    raise ValueError(
+                        f"{ctx.file}:{stmt.lineno}: record! field `{name}` without a default follows one with a default"
+                    )
+
+                fields.append(name)
+
+            case ast.FunctionDef(name=name) | ast.AsyncFunctionDef(name=name):
+                defined.add(name)
+
+            case ast.Assign(targets=targets):
+                defined.update(target.id for target in targets if isinstance(target, ast.Name))
+
+    members: list[ast.stmt] = []
+
+    def add(name: str, source: str):
+        if name not in defined:
+            members.append(_member(source, node))
+
+    if slots:
+        add("__slots__", f"__slots__ = {tuple(fields)!r}")
+
+    if match_args:
+        add("__match_args__", f"__match_args__ = {tuple(fields)!r}")
+
+    if frozen:
+        assign = [f"object.__setattr__(self, {field!r}, {field})" for field in fields]
+
+    else:
+        assign = [f"self.{field} = {field}" for field in fields]
+
+    if "__init__" not in defined:
+        init = cast(ast.FunctionDef, _member(f"def __init__(self, {', '.join(fields)}):\n    pass", node))
+        init.body = [_member(line, node) for line in assign] or init.body
+        init.args.defaults = defaults
+        members.append(init)
+
+    if use_repr:
+        shown = ", ".join(f"{field}={{self.{field}!r}}" for field in fields)
+        add("__repr__", f'def __repr__(self):\n    return f"{{type(self).__qualname__}}({shown})"')
+
+    if eq:
+        add(
+            "__eq__",
+            "def __eq__(self, other):\n"
+            "    if other.__class__ is self.__class__:\n"
+            f"        return {_fields_tuple('self', fields)} == {_fields_tuple('other', fields)}\n"
+            "    return NotImplemented",
+        )
+
+        # like dataclasses: equal records must hash alike, which only holds if they can't change
+        if frozen:
+            add("__hash__", f"def __hash__(self):\n    return hash({_fields_tuple('self', fields)})")
+
+        else:
+            add("__hash__", "__hash__ = None")
+
+    if frozen:
+        add("__setattr__", "def __setattr__(self, name, value):\n    raise AttributeError(f'cannot assign {name!r}')")
+        add("__delattr__", "def __delattr__(self, name):\n    raise AttributeError(f'cannot delete {name!r}')")
+
+        # the default pickling restores slots with setattr
+        add("__reduce__", f"def __reduce__(self):\n    return type(self), {_fields_tuple('self', fields)}")
+
+    # `...` placeholders go, everything else is kept ahead of the generated members
+    body = [
+        stmt for stmt in node.body if not (isinstance(stmt, ast.Expr) and getattr(stmt.value, "value", None) is ...)
+    ]
+    node.body = body + members
+
+    log.debug(f"Generated {len(members)} members for record {'.'.join(ctx.path)}.{node.name}")
+
+    return node
+
+
+SymbolTree.register_proc_macro("micro macros advanced", "record", record)
+
+
+# The cache is a dict per key parameter, nested in order, so a hit is one subscript per parameter and never builds a
+# key tuple. Misses (which call the original anyway) do the bookkeeping in a dict of key tuples kept in insertion
+# order. CLOCK approximates LRU: a hit only flags its `[value, used]` entry, and eviction moves flagged entries to the
+# back (clearing the flag) instead of dropping them. Exact LRU builds the key and moves it to the back on every hit,
+# which costs about as much as the call it saves. Names are double-underscored so parameters can't shadow them.
+_MEMO_HELPERS = """
+def __memo_store(key, value):
+    level = __memo_cache
+    for part in key[:-1]:
+        level = level.setdefault(part, {})
+    level[key[-1]] = value
+
+def __memo_forget(key):
+    levels = [__memo_cache]
+    for part in key[:-1]:
+        levels.append(levels[-1][part])
+    del levels[-1][key[-1]]
+    for level, part in zip(levels[-2::-1], key[-2::-1]):
+        if level[part]:
+            break
+        del level[part]
+"""
+
+_MEMO_POLICIES = {
+    None: (
+        "",
+        """
+def {name}():
+    try:
+        return __memo_cache{lookup}
+    except KeyError:
+        pass
+    __memo_value = __memo_impl({call})
+    __memo_store({key}, __memo_value)
+    return __memo_value
+""",
+        """
+def __memo_clear():
+    __memo_cache.clear()
+""",
+    ),
+    "fifo": (
+        """
+__memo_order = {{}}
+""",
+        """
+def {name}():
+    try:
+        return __memo_cache{lookup}
+    except KeyError:
+        pass
+    __memo_value = __memo_impl({call})
+    __memo_key = {key}
+    if __memo_key not in __memo_order:
+        if len(__memo_order) >= {maxsize}:
+            __memo_oldest = next(iter(__memo_order))
+            del __memo_order[__memo_oldest]
+            __memo_forget(__memo_oldest)
+        __memo_order[__memo_key] = None
+    __memo_store(__memo_key, __memo_value)
+    return __memo_value
+""",
+        """
+def __memo_clear():
+    __memo_cache.clear()
+    __memo_order.clear()
+""",
+    ),
+    "lru": (
+        """
+__memo_order = {{}}
+""",
+        """
+def {name}():
+    try:
+        __memo_value = __memo_cache{lookup}
+    except KeyError:
+        pass
+    else:
+        __memo_key = {key}
+        __memo_order[__memo_key] = __memo_order.pop(__memo_key)
+        return __memo_value
+    __memo_value = __memo_impl({call})
+    __memo_key = {key}
+    if __memo_key in __memo_order:
+        del __memo_order[__memo_key]
+    elif len(__memo_order) >= {maxsize}:
+        __memo_oldest = next(iter(__memo_order))
+        del __memo_order[__memo_oldest]
+        __memo_forget(__memo_oldest)
+    __memo_order[__memo_key] = None
+    __memo_store(__memo_key, __memo_value)
+    return __memo_value
+""",
+        """
+def __memo_clear():
+    __memo_cache.clear()
+    __memo_order.clear()
+""",
+    ),
+    "clock": (
+        """
+__memo_order = {{}}
+""",
+        """
+def {name}():
+    try:
+        __memo_entry = __memo_cache{lookup}
+    except KeyError:
+        pass
+    else:
+        __memo_entry[1] = True
+        return __memo_entry[0]
+    __memo_value = __memo_impl({call})
+    __memo_key = {key}
+    if __memo_key not in __memo_order:
+        while len(__memo_order) >= {maxsize}:
+            __memo_oldest = next(iter(__memo_order))
+            __memo_entry = __memo_order.pop(__memo_oldest)
+            if __memo_entry[1]:
+                __memo_entry[1] = False
+                __memo_order[__memo_oldest] = __memo_entry
+            else:
+                __memo_forget(__memo_oldest)
+        __memo_order[__memo_key] = __memo_entry = [__memo_value, False]
+        __memo_store(__memo_key, __memo_entry)
+    return __memo_value
+""",
+        """
+def __memo_clear():
+    __memo_cache.clear()
+    __memo_order.clear()
+""",
+    ),
+}
+
+
+# what `functools.wraps` copies, plus the defaults the wrapper is generated without
+_MEMO_WRAPPED = ("__module__", "__qualname__", "__doc__", "__annotations__", "__defaults__", "__kwdefaults__")
+
+
+def _yields(nodes: list[ast.AST]) -> bool:
+    for node in nodes:
+        if isinstance(node, (ast.Yield, ast.YieldFrom)):
+            return True
+
+        if not isinstance(node, _SCOPES) and _yields(list(ast.iter_child_nodes(node))):
+            return True
+
+    return False
+
+
+def _assigns(stmt: ast.Assign, name: str) -> bool:
+    return any(isinstance(target, ast.Name) and target.id == name for target in stmt.targets)
+
+
+def _is_maxsize(value: Any) -> bool:
+    return value is None or _is_positive_int(value)
+
+
+def _is_policy(value: Any) -> bool:
+    return value in _MEMO_POLICIES and value is not None
+
+
+def _is_key(value: Any) -> bool:
+    return type(value) is str or type(value) is tuple and all(type(item) is str for item in value)
+
+
+# @memo! / @memo!(maxsize=128, key=("a", "b"), policy="clock"|"lru"|"fifo"), `maxsize=None` for an unbounded cache
+def memo(ctx: MacroContext, node: ast.FunctionDef):
+    where = f"{ctx.file}:{node.lineno}: memo! on `{node.name}`"
+
+    maxsize = _option(ctx, "memo", "maxsize", 0, 128, _is_maxsize, "a positive int or None")
+    policy = _option(ctx, "memo", "policy", None, "clock", _is_policy, "'clock', 'lru' or 'fifo'")
+    key = _option(ctx, "memo", "key", None, None, _is_key, "a parameter name or a tuple of them")
+
+    args = node.args
+    if args.vararg or args.kwarg:
+        raise ValueError(f"{where}: *args and **kwargs can't be part of a key")
+
+    if _yields(node.body):
+        raise ValueError(f"{where}: a generator can't be memoized")
+
+    positional = [arg.arg for arg in args.posonlyargs + args.args]
+    keywords = [arg.arg for arg in args.kwonlyargs]
+
+    names = [key] if isinstance(key, str) else list(key or positional + keywords)
+    if unknown := [name for name in names if name not in positional + keywords]:
+        raise ValueError(f"{where}: key names unknown parameters {', '.join(unknown)}")
+
+    # a function without parameters still needs one level, under a constant key
+    parts = names or ["()"]
+    state, template, clear = _MEMO_POLICIES[None if maxsize is None else policy]
+
+    source = template.format(
+        name=node.name,
+        lookup="".join(f"[{part}]" for part in parts),
+        key=f"({', '.join(parts)},)",
+        call=", ".join([*positional, *(f"{name}={name}" for name in keywords)]),
+        maxsize=maxsize,
+    )
+
+    # defaults and annotations are evaluated once, for the original, and shared with the wrapper below
+    wrapper = cast(ast.FunctionDef, _member(source, node))
+    wrapper.args = deepcopy(args)
+    wrapper.args.defaults = []
+    wrapper.args.kw_defaults = [None] * len(args.kwonlyargs)
+
+    for arg in wrapper.args.posonlyargs + wrapper.args.args + wrapper.args.kwonlyargs:
+        arg.annotation = None
+
+    # the cache and the original live in a closure, which is faster to reach than a global or an attribute
+    factory = f"__memo_{node.name}"
+    module = ast.parse(
+        f"def {factory}():\n"
+        "    __memo_cache = {}\n"
+        f"{textwrap.indent(state.format() + _MEMO_HELPERS + clear, '    ')}\n"
+        f"    __memo_impl = {node.name}\n"
+        f"    __memo_impl.__qualname__ = __memo_impl.__qualname__.rpartition('{factory}.<locals>.')[0] + '{node.name}'\n"
+        f"    for __memo_attribute in {_MEMO_WRAPPED}:\n"
+        f"        setattr({node.name}, __memo_attribute, getattr(__memo_impl, __memo_attribute))\n"
+        f"    {node.name}.cache_clear = __memo_clear\n"
+        f"    {node.name}.__wrapped__ = __memo_impl\n"
+        f"    return {node.name}\n"
+        f"{node.name} = {factory}()\n"
+        f"del {factory}"
+    )
+
+    for child in ast.walk(module):
+        if "lineno" in child._attributes:
+            ast.copy_location(child, node)
+
+    define, bind, delete = module.body
+
+    # whatever decorators are left apply to the memoized function, in the same order
+    decorated: ast.expr = cast(ast.Assign, bind).value
+    for decorator in reversed(node.decorator_list):
+        decorated = ast.copy_location(ast.Call(func=decorator, args=[decorated], keywords=[]), decorator)
+
+    cast(ast.Assign, bind).value = decorated
+    node.decorator_list = []
+
+    # the original goes ahead of the line binding it, the memoized version right after
+    body = cast(ast.FunctionDef, define).body
+    idx = next(idx for idx, stmt in enumerate(body) if isinstance(stmt, ast.Assign) and _assigns(stmt, "__memo_impl"))
+    body[idx : idx + 1] = [node, body[idx], wrapper]
+
+    log.debug(f"Memoized {'.'.join(ctx.path)}.{node.name} ({policy if maxsize else 'unbounded'}, key {names})")
+
+    return [define, bind, delete]
+
+
+SymbolTree.register_proc_macro("micro macros advanced", "memo", memo)
+
+
+# NumPy is only needed where a vectorized function runs, it's imported inside it under `_NUMPY`
+_VECTORIZE = "__vectorize_"
+_NUMPY = _VECTORIZE + "np"
+
+_ARITHMETIC = (
+    ast.Add,
+    ast.Sub,
+    ast.Mult,
+    ast.Div,
+    ast.FloorDiv,
+    ast.Mod,
+    ast.Pow,
+    ast.BitAnd,
+    ast.BitOr,
+    ast.BitXor,
+    ast.LShift,
+    ast.RShift,
+)
+_ORDERING = (ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+
+# `math` functions with a ufunc that computes the same thing; `floor`/`ceil` aren't here since theirs return floats
+_MATH_UFUNCS = {
+    "sqrt": "sqrt",
+    "exp": "exp",
+    "log2": "log2",
+    "log10": "log10",
+    "sin": "sin",
+    "cos": "cos",
+    "tan": "tan",
+    "asin": "arcsin",
+    "acos": "arccos",
+    "atan": "arctan",
+    "sinh": "sinh",
+    "cosh": "cosh",
+    "tanh": "tanh",
+    "fabs": "fabs",
+    "hypot": "hypot",
+    "atan2": "arctan2",
+    "copysign": "copysign",
+}
+_BUILTIN_UFUNCS = {("abs", 1): "abs", ("min", 2): "minimum", ("max", 2): "maximum"}
+
+
+class _Unsupported(Exception):
+    pass
+
+
+def _numpy(attr: str) -> ast.Attribute:
+    return ast.Attribute(value=ast.Name(id=_NUMPY, ctx=ast.Load()), attr=attr, ctx=ast.Load())
+
+
+def _call(func: ast.expr, *args: ast.expr) -> ast.Call:
+    return ast.Call(func=func, args=list(args), keywords=[])
+
+
+def _is_len(node: Optional[ast.expr], name: str) -> bool:
+    match node:
+        case ast.Call(func=ast.Name(id="len"), args=[ast.Name(id=array)], keywords=[]):
+            return array == name
+
+    return False
+
+
+def _length(node: ast.expr) -> bool:
+    # stops that can be repeated freely: names, constants and `len(name)`
+    match node:
+        case ast.Name() | ast.Constant():
+            return True
+
+        case ast.Call(func=ast.Name(id="len"), args=[ast.Name()], keywords=[]):
+            return True
+
+    return False
+
+
+class _Lowering:
+    # Turns an expression over one element into the same expression over whole arrays. `elements` maps a name to what
+    # it stands for (an array or the index range), `arrays` decides what `name[index]` becomes.
+
+    def __init__(self, bound: set[str], index: Optional[str], elements: dict[str, ast.expr], stop: Optional[ast.expr]):
+        self.bound = bound
+        self.index = index
+        self.elements = elements
+        self.stop = stop
+
+        # names the loop assigns elements of, they can only be read one element at a time
+        self.written: set[str] = set()
+        self.vectorized = False
+
+        # names read as `name[index]`, each has to be at least as long as the range
+        self.read: set[str] = set()
+
+        # in statement position every array is converted once, into a temporary bound ahead of the statement
+        self.prelude: Optional[dict[str, ast.expr]] = None
+
+    def array(self, name: str) -> ast.expr:
+        self.vectorized = True
+        self.read.add(name)
+
+        array = _call(_numpy("asarray"), ast.Name(id=name, ctx=ast.Load()))
+        array = ast.Subscript(value=array, slice=ast.Slice(upper=deepcopy(self.stop)), ctx=ast.Load())
+
+        if self.prelude is None:
+            return array
+
+        temp = f"{_VECTORIZE}a_{name}"
+        self.prelude.setdefault(temp, array)
+
+        return ast.Name(id=temp, ctx=ast.Load())
+
+    def lower(self, node: ast.expr) -> ast.expr:
+        match node:
+            case ast.Subscript(value=ast.Name(id=name), slice=ast.Name(id=index)) if index == self.index:
+                return self.array(name)
+
+            case ast.Name(id=name) if name in self.elements:
+                self.vectorized = True
+                return deepcopy(self.elements[name])
+
+            case ast.Name(id=name) if name in self.written:
+                raise _Unsupported(f"`{name}` is read whole while the loop writes it")
+
+            case ast.Name() | ast.Constant():
+                return node
+
+            case ast.Attribute(value=ast.Name(id=name)) if name not in self.elements and name != self.index:
+                return node
+
+            case ast.BinOp(left=left, op=op, right=right) if isinstance(op, _ARITHMETIC):
+                return ast.BinOp(left=self.lower(left), op=op, right=self.lower(right))
+
+            case ast.UnaryOp(op=ast.USub() | ast.UAdd() | ast.Invert() as op, operand=operand):
+                return ast.UnaryOp(op=op, operand=self.lower(operand))
+
+            case ast.Compare(left=left, ops=[op], comparators=[right]) if isinstance(op, _ORDERING):
+                return ast.Compare(left=self.lower(left), ops=[op], comparators=[self.lower(right)])
+
+            # both branches are computed, one is picked per element
+            case ast.IfExp(test=test, body=body, orelse=orelse):
+                return _call(_numpy("where"), self.lower(test), self.lower(body), self.lower(orelse))
+
+            case ast.Call(func=ast.Attribute(value=ast.Name(id="math"), attr=attr), args=args, keywords=[]) if (
+                attr in _MATH_UFUNCS and "math" not in self.bound
+            ):
+                return _call(_numpy(_MATH_UFUNCS[attr]), *map(self.lower, args))
+
+            case ast.Call(func=ast.Name(id=name), args=args, keywords=[]) if (
+                (name, len(args)) in _BUILTIN_UFUNCS and name not in self.bound
+            ):
+                return _call(_numpy(_BUILTIN_UFUNCS[name, len(args)]), *map(self.lower, args))
+
+        raise _Unsupported(f"`{ast.unparse(node)}` isn't elementwise")
+
+
+class Vectorizer(ast.NodeTransformer):
+    def __init__(self, file: str, bound: set[str], used: Counter[str]):
+        self.file = file
+        self.bound = bound
+        self.used = used
+
+        # (line, what) of every rewrite
+        self.rewritten: list[tuple[int, str]] = []
+
+    def skip(self, node: ast.AST, reason: str):
+        log.debug(f"vectorize! left the {node.__class__.__name__} at {self.file}:{node.lineno} as is: {reason}")
+
+    def visit_For(self, node: ast.For):
+        self.generic_visit(node)
+
+        match node:
+            case ast.For(
+                target=ast.Name(id=index),
+                iter=ast.Call(func=ast.Name(id="range"), args=[stop], keywords=[]),
+                orelse=[],
+            ) if "range" not in self.bound:
+                pass
+
+            case _:
+                return node
+
+        # the loop leaves its variable bound, a vectorized one doesn't
+        if self.used[index] > _loads(node.body)[index]:
+            self.skip(node, f"`{index}` is used outside of the loop")
+            return node
+
+        # the stop is evaluated once, like `range` does
+        stop_name = f"{_VECTORIZE}n"
+        length = ast.Name(id=stop_name, ctx=ast.Load())
+
+        lowering = _Lowering(self.bound, index, {index: _call(_numpy("arange"), length)}, length)
+        lowering.written = {
+            target.value.id
+            for stmt in node.body
+            for target in (stmt.targets if isinstance(stmt, ast.Assign) else [getattr(stmt, "target", None)])
+            if isinstance(target, ast.Subscript) and isinstance(target.value, ast.Name)
+        }
+
+        body: list[ast.stmt] = [ast.Assign(targets=[ast.Name(id=stop_name, ctx=ast.Store())], value=stop)]
+
+        # checked before anything is written, filled in once every statement is lowered
+        guards = len(body)
+
+        try:
+            for stmt in node.body:
+                match stmt:
+                    case ast.Assign(
+                        targets=[ast.Subscript(value=ast.Name(id=name), slice=ast.Name(id=at))], value=value
+                    ):
+                        pass
+
+                    case ast.AugAssign(
+                        target=ast.Subscript(value=ast.Name(id=name), slice=ast.Name(id=at)), op=op, value=value
+                    ) if isinstance(op, _ARITHMETIC):
+                        value = ast.BinOp(left=deepcopy(stmt.target), op=op, right=value)
+
+                    case _:
+                        raise _Unsupported(f"`{ast.unparse(stmt)}` isn't an elementwise assignment")
+
+                if at != index:
+                    raise _Unsupported(f"`{ast.unparse(stmt)}` isn't indexed by `{index}`")
+
+                lowering.vectorized = False
+                lowering.prelude = {}
+                result = lowering.lower(value)
+
+                body.extend(
+                    ast.Assign(targets=[ast.Name(id=temp, ctx=ast.Store())], value=array)
+                    for temp, array in lowering.prelude.items()
+                )
+
+                # a value that doesn't depend on the index still has to fill the whole range
+                if not lowering.vectorized:
+                    result = _call(_numpy("full"), deepcopy(length), result)
+
+                # anything but an array gets plain Python numbers, like the loop would have stored
+                values = ast.Name(id=f"{_VECTORIZE}v", ctx=ast.Load())
+                written = ast.Name(id=name, ctx=ast.Load())
+                is_array = _call(ast.Name(id="isinstance", ctx=ast.Load()), written, _numpy("ndarray"))
+                converted = ast.IfExp(
+                    test=is_array,
+                    body=values,
+                    orelse=_call(ast.Attribute(value=deepcopy(values), attr="tolist", ctx=ast.Load())),
+                )
+
+                target = ast.Subscript(
+                    value=ast.Name(id=name, ctx=ast.Load()), slice=ast.Slice(upper=deepcopy(length)), ctx=ast.Store()
+                )
+                body.append(ast.Assign(targets=[ast.Name(id=values.id, ctx=ast.Store())], value=result))
+                body.append(ast.Assign(targets=[target], value=converted))
+
+        except _Unsupported as e:
+            self.skip(node, str(e))
+            return node
+
+        # the loop would fail on the first index past the end of any array, slicing would quietly cut a read array
+        # short (or broadcast one of length 1) and grow a written list
+        body[guards:guards] = [
+            ast.parse(f"if {stop_name} > len({name}):\n    raise IndexError('{name} is shorter than the loop')").body[0]
+            for name in sorted(lowering.written | lowering.read)
+            if not _is_len(stop, name)
+        ]
+
+        self.rewritten.append((node.lineno, "loop"))
+
+        return [ast.copy_location(stmt, node) for stmt in body]
+
+    def visit_ListComp(self, node: ast.ListComp):
+        self.generic_visit(node)
+
+        match node.generators:
+            case [ast.comprehension(target=target, iter=iterable, ifs=[], is_async=0)]:
+                pass
+
+            case _:
+                return node
+
+        try:
+            lowering = self._comprehension(target, iterable)
+            result = lowering.lower(node.elt)
+
+        except _Unsupported as e:
+            self.skip(node, str(e))
+            return node
+
+        if not lowering.vectorized:
+            self.skip(node, "the element doesn't depend on the items")
+            return node
+
+        # an expression has nowhere to check lengths, so only the array the range is the length of can be read
+        if shorter := sorted(name for name in lowering.read if not _is_len(lowering.stop, name)):
+            self.skip(node, f"{', '.join(shorter)} may be shorter than the range")
+            return node
+
+        self.rewritten.append((node.lineno, "comprehension"))
+
+        # still a list, of plain Python numbers
+        tolist = ast.Attribute(value=result, attr="tolist", ctx=ast.Load())
+        return ast.copy_location(_call(tolist), node)
+
+    def _comprehension(self, target: ast.expr, iterable: ast.expr) -> _Lowering:
+        match target, iterable:
+            # [... a[i] ... for i in range(len(a))]
+            case ast.Name(id=index), ast.Call(func=ast.Name(id="range"), args=[stop], keywords=[]) if (
+                "range" not in self.bound and _length(stop)
+            ):
+                return _Lowering(self.bound, index, {index: _call(_numpy("arange"), stop)}, stop)
+
+        # iterating anything else directly could be a string, a set or an iterator, which aren't arrays
+        raise _Unsupported("only `range(...)` can be iterated")
+
+
+# @vectorize!
+def vectorize(ctx: MacroContext, node: ast.FunctionDef):
+    vectorizer = Vectorizer(ctx.file, bound_names(node) | ctx.shadowed, _loads(node.body))
+    vectorizer.generic_visit(node)
+
+    where = f"{'.'.join(ctx.path)}.{node.name}"
+
+    if not vectorizer.rewritten:
+        log.info(f"vectorize! rewrote nothing in {where}")
+        return node
+
+    lines = ", ".join(f"{kind} at line {line}" for line, kind in vectorizer.rewritten)
+    log.info(f"vectorize! rewrote {len(vectorizer.rewritten)} in {where}: {lines}")
+
+    # after the docstring, if there is one
+    start = int(bool(node.body) and isinstance(node.body[0], ast.Expr) and isinstance(node.body[0].value, ast.Constant))
+    numpy = ast.copy_location(ast.Import(names=[ast.alias(name="numpy", asname=_NUMPY)]), node.body[0])
+    node.body.insert(start, numpy)
+
+    return node
+
+
+SymbolTree.register_proc_macro("micro macros advanced", "vectorize", vectorize)
@@ -5,125 +5,243 @@
 __all__ = ()
 
 import ast
-import tokenize
-from io import BytesIO
+import re
+from bisect import bisect_left
+from importlib.util import decode_source
 from pathlib import Path
-from typing import Callable, Iterator, Union
+from typing import Iterable, Iterator, Optional, Union
 
-from micro import consts, logger
+from micro import consts, logger, timing
 
 log = logger.get_logger(__name__)
 
+# anything that could be macro syntax; `!=` is the only other place `!` shows up outside of strings
+MACRO_MARKERS = re.compile(
+    re.escape(consts.MACRO_CALL.encode()) + rb"(?!=)|" + re.escape(consts.MACRO_SUBST.encode())
+)
 
-def as_line_iter(src: Union[str, bytes, Path]) -> Callable[..., bytes]:
-    if isinstance(src, Path):
-        return BytesIO(src.read_bytes()).readline
 
-    elif isinstance(src, str):
-        return BytesIO(src.encode("utf-8")).readline
+def has_macro_syntax(data: bytes) -> bool:
+    # false positives (markers in strings or comments) just take the slow path
+    return MACRO_MARKERS.search(data) is not None
 
-    return BytesIO(src).readline
 
+# `from module import ...` and `import module, other as name` at the start of a line
+IMPORT_LINES = re.compile(
+    rb"^[ \t]*(?:from[ \t]+(?P<module>\.*[\w.]*)[ \t]+import(?!\w)"
+    rb"|import[ \t]+(?P<names>[\w.]+(?:[ \t]+as[ \t]+\w+)?(?:[ \t]*,[ \t]*[\w.]+(?:[ \t]+as[ \t]+\w+)?)*))",
+    re.MULTILINE,
+)
 
-def fix_tokens(src: Callable[..., bytes]) -> Iterator[tuple[int, str]]:
-    prev_ident = None
-    in_substitute = False
 
-    for token, text, _, _, _ in tokenize.tokenize(src):
-        match (token, text):
-            case (tokenize.NAME, _):
-                # handle `ident !`
-                #         ^^^^^
-                if prev_ident is not None:
-                    yield tokenize.NAME, prev_ident
+def imported_modules(data: bytes) -> Iterator[str]:
+    # like has_macro_syntax, a line in a string only costs a lookup
+    for match in IMPORT_LINES.finditer(data):
+        if (module := match.group("module")) is not None:
+            yield module.decode()
 
-                # handle `? ident`
-                #           ^^^^
-                elif in_substitute:
-                    yield tokenize.NAME, consts.MACRO_SAFE_SUBST + text
-                    in_substitute = False
-                    continue
+        else:
+            for name in match.group("names").split(b","):
+                yield name.split()[0].decode()
 
-                    # continuing here prevents us from accepting something like `? ident !`
 
-                prev_ident = text
+# strings and comments are matched (and skipped) so markers inside them are left alone
+SCAN_PATTERN = re.compile(
+    r"""
+        (?P<skip>
+            \#[^\r\n]*
+          | (?:(?<!\w)[rRbBuUfF]{1,2})?
+            (?: '''(?:\\.|[^\\])*?''' | \"\"\"(?:\\.|[^\\])*?\"\"\" | '(?:\\.|[^\\'\r\n])*' | "(?:\\.|[^\\"\r\n])*" )
+        )
+      | (?<!\w)(?P<call>[^\W\d]\w*)[ \t]*"""
+    + re.escape(consts.MACRO_CALL)
+    + r"""(?!=)
+      | """
+    + re.escape(consts.MACRO_SUBST)
+    + r"""[ \t]*(?P<subst>[^\W\d]\w*)
+      | (?<!\w)(?P<import>import|from)(?!\w)
+    """,
+    re.VERBOSE,
+)
 
-            # handle `ident !`
-            #               ^
-            case (tokenize.ERRORTOKEN, consts.MACRO_CALL):
-                if prev_ident is not None:
-                    yield tokenize.NAME, (prev_ident + consts.MACRO_SAFE_CALL)
-                    prev_ident = None
-                    continue
+# (line, utf-8 column) of the macro name -> marker, matching the AST node positions
+Markers = dict[tuple[int, int], tuple[str, str]]
 
-                yield token, text
+# import statements have to be seen by the expander even without macro syntax, so their lines are marked too
+IMPORT_MARKER = "import"
 
-            # handle `? ident`
-            #         ^
-            case (tokenize.ERRORTOKEN, consts.MACRO_SUBST):
-                if not in_substitute:
-                    in_substitute = True
 
-                # otherwise just propagate the inevitable syntax error
+def scan_markers(text: str) -> tuple[str, Markers]:
+    # blank out `!` and move `$name` over the `$`, so every line keeps its length and every column stays put
+    markers: Markers = {}
+    pieces: list[str] = []
 
-            case _:
-                if prev_ident is not None:
-                    yield tokenize.NAME, prev_ident
-                    prev_ident = None
+    last = 0
+    seen = 0
+    line = 1
+    line_start = 0
 
-                yield token, text
+    for match in SCAN_PATTERN.finditer(text):
+        if match.lastgroup == "skip":
+            continue
 
+        pos = match.start()
+        if (newlines := text.count("\n", seen, pos)) > 0:
+            line += newlines
+            line_start = text.rfind("\n", seen, pos) + 1
 
-def parse_rename_safe(source: Union[str, Path]) -> ast.AST:
+        seen = pos
+
+        prefix = text[line_start:pos]
+        col = len(prefix) if prefix.isascii() else len(prefix.encode())
+
+        if match.lastgroup == "import":
+            markers[line, col] = (IMPORT_MARKER, match.group("import"))
+            continue
+
+        if (name := match.group("call")) is not None:
+            markers[line, col] = (consts.MACRO_CALL, name)
+            pieces.append(text[last : match.end() - consts.MACRO_CALL_LEN])
+            pieces.append(" " * consts.MACRO_CALL_LEN)
+
+        else:
+            name = match.group("subst")
+            markers[line, col] = (consts.MACRO_SUBST, name)
+            pieces.append(text[last:pos])
+            pieces.append(name.ljust(match.end() - pos))
+
+        last = match.end()
+
+    if not pieces:
+        return text, markers
+
+    pieces.append(text[last:])
+
+    return "".join(pieces), markers
+
+
+def parse_source(text: str, filename: str = "<unknown>", *, rename: bool = True) -> tuple[ast.Module, Markers]:
+    with timing.phase("tokens"):
+        clean_source, markers = scan_markers(text)
+
+    # log.debug(f"::: Source {filename}\n{clean_source}\n:::")
+    with timing.phase("parse"):
+        tree = ast.parse(clean_source, filename, "exec", **consts.AST_OPTS)
+
+        # without `rename`, the caller runs MacroRewriter itself (as part of a FusedTransformer)
+        if markers and rename:
+            tree = MacroRewriter(markers).visit(tree)
+
+    return tree, markers
+
+
+def parse_rename_safe(source: Union[str, Path], data: Optional[bytes] = None) -> ast.AST:
     file = Path(source)
-    new_source = tokenize.untokenize(fix_tokens(as_line_iter(file))).decode()
-    # log.debug(f"::: Source {file.name}\n{new_source}\n:::")
-    tree = ast.parse(new_source, file.name, "exec", **consts.AST_OPTS)
 
-    renamed = ast.fix_missing_locations(MacroRewriter().visit(tree))
+    if data is None:
+        data = file.read_bytes()
+
+    return parse_source(decode_source(data), file.name)[0]
+
+
+class LineIndex:
+    # sorted set of line numbers, answering "does a node's span contain any of them" with one bisect
+    def __init__(self, lines: Iterable[int]):
+        self.lines = sorted(set(lines))
+
+    def __bool__(self) -> bool:
+        return bool(self.lines)
+
+    def __contains__(self, line: int) -> bool:
+        idx = bisect_left(self.lines, line)
+        return idx < len(self.lines) and self.lines[idx] == line
 
-    return renamed
+    def overlaps(self, start: int, end: int) -> bool:
+        idx = bisect_left(self.lines, start)
+        return idx < len(self.lines) and self.lines[idx] <= end
+
+    def covers(self, node: ast.AST) -> bool:
+        # nodes without a position (modules, contexts, operators) can't be ruled out
+        if (start := getattr(node, "lineno", None)) is None:
+            return True
+
+        # decorators sit above the definition's own line
+        if decorators := getattr(node, "decorator_list", None):
+            start = min(start, decorators[0].lineno)
+
+        return self.overlaps(start, node.end_lineno or start)  # type: ignore
+
+
+def macro_lines(markers: Markers) -> LineIndex:
+    return LineIndex(line for (line, _), (kind, _) in markers.items() if kind != IMPORT_MARKER)
 
 
 class MacroRewriter(ast.NodeTransformer):
-    def visit_Name(self, node: ast.Name):
-        if node.id.endswith(consts.MACRO_SAFE_CALL):
-            node.id = node.id[: -consts.MACRO_SAFE_CALL_LEN] + consts.MACRO_CALL
+    def __init__(self, markers: Markers):
+        self.markers = markers
+        self.lines = macro_lines(markers)
+
+        self.substs: dict[int, list[tuple[int, str]]] = {}
+        for (line, col), (kind, name) in sorted(markers.items()):
+            if kind == consts.MACRO_SUBST:
+                self.substs.setdefault(line, []).append((col, name))
 
-        elif node.id.startswith(consts.MACRO_SAFE_SUBST):
-            node.id = consts.MACRO_SUBST + node.id[consts.MACRO_SAFE_SUBST_LEN :]
+        super().__init__()
 
-        # elif node.id == consts.MACRO_SAFE_QUOTE:
-        #     node.id = consts.MACRO_QUOTE
+    def generic_visit(self, node: ast.AST):
+        # names are only ever renamed in place, so subtrees without a marker line can be skipped outright
+        for child in ast.iter_child_nodes(node):
+            if self.lines.covers(child):
+                self.visit(child)
+
+        return node
+
+    def _rename(self, key: tuple[int, int], name: str) -> str:
+        match self.markers.get(key):
+            case (consts.MACRO_CALL, marked) if marked == name:
+                return name + consts.MACRO_CALL
+
+            case (consts.MACRO_SUBST, marked) if marked == name:
+                return consts.MACRO_SUBST + name
+
+        return name
+
+    def _rename_def(self, node: Union[ast.FunctionDef, ast.ClassDef]):
+        # definitions don't record where their name is, take the first marker after the keyword
+        for col, name in self.substs.get(node.lineno, ()):
+            if col > node.col_offset and name == node.name:
+                node.name = consts.MACRO_SUBST + name
+                break
+
+    def visit_Name(self, node: ast.Name):
+        node.id = self._rename((node.lineno, node.col_offset), node.id)
 
         return node
 
     def visit_Attribute(self, node: ast.Attribute):
         self.generic_visit(node)
 
-        if node.attr.startswith(consts.MACRO_SAFE_SUBST):
-            node.attr = consts.MACRO_SUBST + node.attr[consts.MACRO_SAFE_SUBST_LEN :]
+        end = node.end_col_offset - len(node.attr.encode())  # type: ignore
+        node.attr = self._rename((node.end_lineno, end), node.attr)  # type: ignore
 
         return node
 
     def visit_keyword(self, node: ast.keyword):
-        if node.arg.startswith(consts.MACRO_SAFE_SUBST):
-            node.arg = consts.MACRO_SUBST + node.arg[consts.MACRO_SAFE_SUBST_LEN :]
+        self.generic_visit(node)
+
+        if node.arg is not None:
+            node.arg = self._rename((node.lineno, node.col_offset), node.arg)
 
         return node
 
     def visit_ClassDef(self, node: ast.ClassDef):
         self.generic_visit(node)
-
-        if node.name.startswith(consts.MACRO_SAFE_SUBST):
-            node.name = consts.MACRO_SUBST + node.name[consts.MACRO_SAFE_SUBST_LEN :]
+        self._rename_def(node)
 
         return node
 
     def visit_FunctionDef(self, node: ast.FunctionDef):
         self.generic_visit(node)
-
-        if node.name.startswith(consts.MACRO_SAFE_SUBST):
-            node.name = consts.MACRO_SUBST + node.name[consts.MACRO_SAFE_SUBST_LEN :]
+        self._rename_def(node)
 
         return node
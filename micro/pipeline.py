@@ -0,0 +1,124 @@
+# The MIT License (MIT)
+
+# Copyright (c) 2022 AnonymousDapper
+
+__all__ = ("parse", "expand_tree", "expand_source", "compile_source", "cache_info", "cache_clear")
+
+import ast
+import time
+from collections import OrderedDict
+from copy import deepcopy
+from importlib.util import decode_source, source_hash
+from types import CodeType
+from typing import Optional, Union
+
+from micro import config, fused, incremental, logger, parsing, timing, tracing
+from micro.parsing import Markers
+from micro.symbol import SymbolTree
+
+log = logger.get_logger(__name__)
+trace = tracing.get("expand")
+cache_trace = tracing.get("cache")
+
+CACHE_SIZE = 256
+
+# (source hash, module, filename, registry generation after expanding, build configuration) -> [expanded tree, code]
+_source_cache: OrderedDict[tuple, list] = OrderedDict()
+_hits = 0
+_misses = 0
+
+
+def parse(text: str, filename: str) -> tuple[ast.Module, Markers]:
+    # macro names are restored during expansion, see FusedTransformer
+    return parsing.parse_source(text, filename, rename=False)
+
+
+def expand_tree(
+    source_tree: ast.Module, markers: Markers, text: str, filename: str, module: str
+) -> tuple[ast.Module, set[str]]:
+    timing.count_nodes("nodes_before", source_tree)
+    start = time.perf_counter() if trace.info else 0.0
+
+    if incremental.ENABLED:
+        with timing.phase("expand"):
+            cleaned_tree, dependencies = incremental.expand(source_tree, markers, text, filename, module)
+
+    else:
+        transformer = fused.FusedTransformer(filename, module, markers)
+
+        with timing.phase("expand"):
+            cleaned_tree = transformer.visit(source_tree)
+
+        dependencies = transformer.dependencies
+
+    timing.count_nodes("nodes_after", cleaned_tree)
+
+    if trace.info:
+        elapsed = time.perf_counter() - start
+        trace.emit(
+            tracing.INFO, "module", module=module, file=filename, dependencies=sorted(dependencies), seconds=elapsed
+        )
+
+    return cleaned_tree, dependencies
+
+
+def _lookup(src: Union[str, bytes], filename: str, module: str) -> list:
+    global _hits, _misses
+
+    data = src.encode() if isinstance(src, str) else src
+    key = (source_hash(data), module, filename, SymbolTree.generation, config.fingerprint())
+
+    if (entry := _source_cache.get(key)) is not None:
+        _hits += 1
+        _source_cache.move_to_end(key)
+
+        if cache_trace.debug:
+            cache_trace.emit(tracing.DEBUG, "source hit", module=module, file=filename)
+
+        return entry
+
+    _misses += 1
+
+    if cache_trace.debug:
+        cache_trace.emit(tracing.DEBUG, "source miss", module=module, file=filename)
+
+    text = src if isinstance(src, str) else decode_source(src)
+    source_tree, markers = parse(text, filename)
+    entry = [expand_tree(source_tree, markers, text, filename, module)[0], None]
+
+    # whatever the source registers is part of the state it expanded into, the next lookup of it starts from there
+    key = (*key[:3], SymbolTree.generation, key[4])
+
+    _source_cache[key] = entry
+    if len(_source_cache) > CACHE_SIZE:
+        _source_cache.popitem(last=False)
+
+    return entry
+
+
+def expand_source(src: Union[str, bytes], filename: str = "<string>", module: str = "__main__") -> ast.Module:
+    # callers are free to mutate the result
+    return deepcopy(_lookup(src, filename, module)[0])
+
+
+def compile_source(src: Union[str, bytes], filename: str = "<string>", module: str = "__main__") -> CodeType:
+    entry = _lookup(src, filename, module)
+
+    if entry[1] is None:
+        entry[1] = compile(entry[0], filename, "exec")
+
+    return entry[1]
+
+
+def cache_info() -> dict[str, int]:
+    return {"hits": _hits, "misses": _misses, "size": len(_source_cache), "maxsize": CACHE_SIZE}
+
+
+def cache_clear(maxsize: Optional[int] = None):
+    global CACHE_SIZE, _hits, _misses
+
+    _source_cache.clear()
+    _hits = _misses = 0
+
+    if maxsize is not None:
+        CACHE_SIZE = maxsize
@@ -6,7 +6,7 @@ from __future__ import annotations
 
 __all__ = ("Symbol", "SymbolRef", "Namespace", "SymbolTree", "MacroContext")
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from importlib._bootstrap import _gcd_import
 from typing import TYPE_CHECKING, Any, Callable, Iterator, Optional, Union, cast
 
@@ -15,12 +15,14 @@ import prettyformatter
 from micro import logger
 
 if TYPE_CHECKING:
-    from ast import FunctionDef
+    from ast import ClassDef, FunctionDef
     from types import ModuleType
 
+    from micro.walker import MacroTemplate
+
 log = logger.get_logger(__name__)
 
-ProcMacro = Callable[["MacroContext", "FunctionDef"], Any]
+ProcMacro = Callable[["MacroContext", Union["FunctionDef", "ClassDef"]], Any]
 NamedItem = Union["Namespace", "SymbolRef"]
 
 
@@ -28,14 +30,36 @@ NamedItem = Union["Namespace", "SymbolRef"]
 class MacroContext:
     file: str
     path: list[str]
+    module: Optional[str] = None
 
+    # arguments of a `@name!(...)` decorator
+    args: list[Any] = field(default_factory=list)
+    kwargs: dict[str, Any] = field(default_factory=dict)
 
-@dataclass
+    # names the module binds at the top level, a builtin among them isn't the builtin
+    shadowed: set[str] = field(default_factory=set)
+
+
+# name -> its one Symbol, so symbols compare by identity and hash with a stored value
+_symbols: dict[str, "Symbol"] = {}
+
+
+@dataclass(eq=False)
 class Symbol:
     name: str
 
+    def __new__(cls, name: str):
+        if (symbol := _symbols.get(name)) is None:
+            symbol = _symbols[name] = super().__new__(cls)
+            symbol.hash = hash(name)
+
+        return symbol
+
     def __hash__(self):
-        return hash(self.name)
+        return self.hash
+
+    def __reduce__(self):
+        return Symbol, (self.name,)
 
     def __repr__(self):
         return f"<{self.name}>"
@@ -46,6 +70,9 @@ class SymbolRef:
         self.path = parents
         self.symbol = symbol
 
+        # a tuple hash depends on the order of its items, so `a.b.c` and `b.a.c` don't collide
+        self.hash = hash((*parents, symbol))
+
     @classmethod
     def from_str(cls, path: str):
         parent, _, sym = path.rpartition(".")
@@ -64,11 +91,13 @@ class SymbolRef:
         return self.__class__(parts, new)
 
     def __hash__(self):
-        return sum(hash(p) for p in self.path) + hash(self.symbol)
+        return self.hash
 
     def __eq__(self, other):
         if isinstance(other, SymbolRef):
-            return self.path == other.path and self.symbol == other.symbol
+            return self.hash == other.hash and self.symbol is other.symbol and self.path == other.path
+
+        return NotImplemented
 
     def __str__(self):
         return f"{'.'.join(symbol.name for symbol in self.path)}{'.' if len(self.path) else ''}{self.symbol.name}"
@@ -95,12 +124,16 @@ class Namespace:
 
         return namespace
 
-    def ensure_exists(self, ref: SymbolRef):
+    def ensure_exists(self, ref: SymbolRef) -> bool:
+        # whether anything had to be added
+        created = False
+
         namespace = self
         for symbol in ref.path:
             # log.debug(f"Ensure:: {namespace.name} -> {symbol} [{namespace!r}]")
             if symbol not in namespace:
                 namespace = namespace.add_namespace(Namespace(symbol))
+                created = True
             else:
                 if isinstance(namespace[symbol], Namespace):
                     namespace = cast(Namespace, namespace[symbol])
@@ -108,6 +141,9 @@ class Namespace:
         if ref.symbol not in namespace:
             # log.debug(f"Ensure:: {namespace.name} -> {ref.symbol} [{namespace!r}] !")
             namespace.add_namespace(Namespace(ref.symbol))
+            created = True
+
+        return created
 
     def resolve_ref(self, ref: SymbolRef) -> "Namespace":
         namespace = self
@@ -138,12 +174,16 @@ class Namespace:
 
     def lookup_ref(self, ref: SymbolRef) -> Optional[SymbolRef]:
         namespace = self
+
+        # scopes that aren't namespaces (function bodies) are skipped, their names resolve in the enclosing one
+        parents = []
         for part in ref.path:
             if part in namespace:
                 item = namespace[part]
 
                 if isinstance(item, Namespace):
                     namespace = item
+                    parents.append(part)
 
                 else:
                     break
@@ -155,7 +195,7 @@ class Namespace:
                 return item
 
             elif isinstance(item, Namespace):
-                return ref
+                return SymbolRef(parents, ref.symbol)
 
     def __iter__(self) -> Iterator[tuple[Symbol, NamedItem]]:
         for k, v in self.namespace.items():
@@ -188,12 +228,57 @@ class SymbolTreeBuilder:
         self.namespace = Namespace(Symbol(""))
 
         self.module_cache: dict[SymbolRef, "ModuleType"] = {}
-        self.macro_cache: dict[SymbolRef, "FunctionDef"] = {}
+        self.macro_cache: dict[SymbolRef, "MacroTemplate"] = {}
         self.proc_macro_cache: dict[SymbolRef, ProcMacro] = {}
 
+        self.module_macros: dict[str, list[SymbolRef]] = {}
+
+        # module -> add_import arguments of its imports that name macros, to replay when its expansion is skipped
+        self.module_imports: dict[str, list[tuple]] = {}
+        self.macro_origins: dict[SymbolRef, str] = {}
+
+        # bumped on every registration, so anything derived from a macro can tell when it was redefined
+        self.generation = 0
+        self.macro_versions: dict[SymbolRef, int] = {}
+
+        # (*path, name) -> interned ref
+        self.refs: dict[tuple[str, ...], SymbolRef] = {}
+
+        # fully qualified dotted path -> the macro it names, for registered macros and for imports of them
+        self.index: dict[str, SymbolRef] = {}
+
+        # (*scope, name) -> what the name resolves to there, cleared whenever the namespaces change
+        self.resolved: dict[tuple[str, ...], Optional[SymbolRef]] = {}
+
     def _get_ref(self, path: list[str], item: str) -> SymbolRef:
-        parts = [Symbol(p) for p in path]
-        return SymbolRef(parts, Symbol(item))
+        key = (*path, item)
+
+        if (ref := self.refs.get(key)) is None:
+            ref = self.refs[key] = SymbolRef([Symbol(p) for p in path], Symbol(item))
+
+        return ref
+
+    def _resolve(self, path: list[str], name: str) -> Optional[SymbolRef]:
+        # the namespaces are only walked the first time a name is looked up from a scope
+        key = (*path, name)
+
+        try:
+            return self.resolved[key]
+
+        except KeyError:
+            pass
+
+        if (result := self.namespace.lookup_ref(self._get_ref(path, name))) is not None:
+            # an import of an import resolves to the macro itself
+            result = self.index.get(str(result), result)
+
+        self.resolved[key] = result
+
+        return result
+
+    def _index(self, path: str, ref: SymbolRef):
+        self.index[path] = ref
+        self.resolved.clear()
 
     def add_item(self, ref: SymbolRef, item: NamedItem, **kwargs):
         if parent := ref.parent():
@@ -211,21 +296,42 @@ class SymbolTreeBuilder:
     #     else:
     #         self.namespace.remove_item(ref.symbol, item)
 
-    def register_macro(self, path: list[str], name: str, node: "FunctionDef"):
+    def register_macro(self, path: list[str], name: str, node: "MacroTemplate", *, module: Optional[str] = None):
         ref = self._get_ref(path, name)
         self.namespace.ensure_exists(ref)
         self.add_item(ref, Namespace(ref.symbol), warn_on_overwrite=False)
+        self._index(str(ref), ref)
 
-        if ref in self.macro_cache:
+        # the same module registering again is a reload or a cache replay
+        if ref in self.macro_cache and (module is None or self.macro_origins.get(ref) != module):
             log.warn(f"Macro {ref} already exists")
 
         self.macro_cache[ref] = node
 
+        self.generation += 1
+        self.macro_versions[ref] = self.generation
+
+        if module is not None:
+            if ref not in (refs := self.module_macros.setdefault(module, [])):
+                refs.append(ref)
+
+            self.macro_origins[ref] = module
+
+    def get_module_macros(self, module: str) -> list[tuple[list[str], str, "MacroTemplate"]]:
+        return [
+            ([p.name for p in ref.path], ref.symbol.name, self.macro_cache[ref])
+            for ref in self.module_macros.get(module, [])
+        ]
+
+    def get_module_imports(self, module: str) -> list[tuple]:
+        return list(self.module_imports.get(module, []))
+
     def register_proc_macro(self, path: str, name: str, fn: ProcMacro):
         ref = self._get_ref(path.split(), name)
         self.namespace.ensure_exists(ref)
 
         self.add_item(ref, Namespace(ref.symbol), warn_on_overwrite=False)
+        self._index(str(ref), ref)
 
         # log.debug(f"Ref: {ref!r}")
 
@@ -233,38 +339,42 @@ class SymbolTreeBuilder:
             log.warn(f"Macro {ref} already exists")
 
         self.proc_macro_cache[ref] = fn
+        self.macro_origins[ref] = fn.__module__
+
+        self.generation += 1
+        self.macro_versions[ref] = self.generation
 
     def check_macro(self, path: list[str], name: str):
-        ref = self._get_ref(path, name)
+        if (result := self._resolve(path, name)) is not None:
+            if (macro := self.macro_cache.get(result)) is not None:
+                return not macro.runtime
 
-        if (result := self.namespace.lookup_ref(ref)) is not None:
-            if result in self.macro_cache.keys() or result in self.proc_macro_cache.keys():
+            if result in self.proc_macro_cache:
                 return True
 
         return False
 
-    def lookup_macro(self, path: list[str], name: str):
-        ref = self._get_ref(path, name)
+    def lookup_origin(self, path: list[str], name: str) -> Optional[str]:
+        if (result := self._resolve(path, name)) is not None:
+            return self.macro_origins.get(result)
 
-        # log.debug(f"Ref: {ref!r}")
+    def lookup_version(self, path: list[str], name: str) -> Optional[int]:
+        if (result := self._resolve(path, name)) is not None:
+            return self.macro_versions.get(result)
+
+    def lookup_macro(self, path: list[str], name: str):
         # log.debug(f"Namespace: {self.namespace!r}")
 
-        if (result := self.namespace.lookup_ref(ref)) is None:
-            raise NameError(f"{ref} does not exist")
+        if (result := self._resolve(path, name)) is None:
+            raise NameError(f"{self._get_ref(path, name)} does not exist")
 
-        if result in self.macro_cache.keys():
-            return self.macro_cache[result]
+        return self.macro_cache.get(result)
 
     def lookup_proc_macro(self, path: list[str], name: str):
-        ref = self._get_ref(path, name)
-
-        if (result := self.namespace.lookup_ref(ref)) is None:
-            raise NameError(f"{ref} does not exist")
+        if (result := self._resolve(path, name)) is None:
+            raise NameError(f"{self._get_ref(path, name)} does not exist")
 
-        if result in self.proc_macro_cache.keys():
-            return self.proc_macro_cache[result]
-
-        # raise NameError(f"{result} not registered")
+        return self.proc_macro_cache.get(result)
 
     def add_import(
         self,
@@ -275,6 +385,7 @@ class SymbolTreeBuilder:
         asname: Optional[str] = None,
         package: Optional[str] = None,
         level: int = 0,
+        importer: Optional[str] = None,
     ):
         name = asname or import_from or module
         # log.debug(f":: Import {f'{import_from} from {module}' if import_from else module}{f' as {name}' if asname else ''} ({package}) | {path}")
@@ -294,12 +405,27 @@ class SymbolTreeBuilder:
         parts = [Symbol(p) for p in path]
         ref = SymbolRef(parts[:-1], parts[-1])
 
-        self.namespace.ensure_exists(ref)
+        if self.namespace.ensure_exists(ref):
+            self.resolved.clear()
+
         namespace = self.namespace.resolve_ref(ref)
 
         import_ref = module_ref.chain(Symbol(import_from or module))
 
-        namespace.add_item(Symbol(name), import_ref)
+        # re-importing the same thing changes nothing
+        if namespace.namespace.get(Symbol(name)) != import_ref:
+            namespace.add_item(Symbol(name), import_ref)
+            self.generation += 1
+
+            self._index(f"{ref}.{name}", self.index.get(str(import_ref), import_ref))
+
+        # a re-export other modules may import the macro through
+        if importer is not None and (target := self.index.get(f"{ref}.{name}")) is not None:
+            if target in self.macro_cache or target in self.proc_macro_cache:
+                record = (list(path), module, import_from, asname, package, level)
+
+                if record not in (imports := self.module_imports.setdefault(importer, [])):
+                    imports.append(record)
 
         # log.debug(f"++ Setting up {ref.chain(Symbol(name)).tostring()} to provide {import_ref.tostring()}")
         # log.debug(f"Module: {module_ref}")
@@ -0,0 +1,133 @@
+# The MIT License (MIT)
+
+# Copyright (c) 2022 AnonymousDapper
+
+__all__ = ("ModuleTiming", "enable", "module", "phase", "add_phase", "count_nodes", "records", "report")
+
+import ast
+import atexit
+import sys
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import Optional, TextIO
+
+from micro import config
+
+ENABLED = config.env_flag("MICRO_IMPORTTIME")
+
+# renaming and cleanup run in the same walk as expansion, so they're part of `expand`
+PHASES = ("read", "cache", "tokens", "parse", "expand", "compile", "exec")
+
+
+@dataclass
+class ModuleTiming:
+    name: str
+    phases: dict[str, float] = field(default_factory=dict)
+    nodes_before: int = 0
+    nodes_after: int = 0
+
+    # wall time including nested imports
+    total: float = 0.0
+    children: list["ModuleTiming"] = field(default_factory=list)
+
+    @property
+    def self_time(self) -> float:
+        return self.total - self.nested_time
+
+    @property
+    def nested_time(self) -> float:
+        return sum(child.total for child in self.children)
+
+
+_roots: list[ModuleTiming] = []
+_stack: list[ModuleTiming] = []
+
+_NULL = nullcontext()
+
+
+class _ModuleTimer:
+    def __init__(self, name: str):
+        self.record = ModuleTiming(name)
+
+    def __enter__(self) -> ModuleTiming:
+        (_stack[-1].children if _stack else _roots).append(self.record)
+        _stack.append(self.record)
+
+        self.start = time.perf_counter()
+
+        return self.record
+
+    def __exit__(self, *_):
+        self.record.total = time.perf_counter() - self.start
+        _stack.pop()
+
+
+class _PhaseTimer:
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.record = _stack[-1] if _stack else None
+        self.nested = self.record.nested_time if self.record else 0.0
+        self.start = time.perf_counter()
+
+    def __exit__(self, *_):
+        if self.record is not None:
+            # imports triggered inside a phase are reported on their own line, not charged to this one
+            elapsed = time.perf_counter() - self.start - (self.record.nested_time - self.nested)
+            self.record.phases[self.name] = self.record.phases.get(self.name, 0.0) + elapsed
+
+
+def enable():
+    global ENABLED
+
+    ENABLED = True
+
+
+def module(name: str):
+    return _ModuleTimer(name) if ENABLED else _NULL
+
+
+def phase(name: str):
+    return _PhaseTimer(name) if ENABLED else _NULL
+
+
+def add_phase(name: str, elapsed: float):
+    if ENABLED and _stack:
+        _stack[-1].phases[name] = _stack[-1].phases.get(name, 0.0) + elapsed
+
+
+def count_nodes(attr: str, tree: ast.AST):
+    if ENABLED and _stack:
+        setattr(_stack[-1], attr, sum(1 for _ in ast.walk(tree)))
+
+
+def records() -> list[ModuleTiming]:
+    return list(_roots)
+
+
+def report(file: Optional[TextIO] = None):
+    file = file or sys.stderr
+
+    header = " | ".join(f"{name:>7}" for name in PHASES)
+    print(f"micro import time: self [us] | cumulative | {header} |     nodes     | module", file=file)
+
+    def show(record: ModuleTiming, depth: int):
+        phases = " | ".join(
+            f"{int(record.phases[name] * 1e6):>7}" if name in record.phases else " " * 7 for name in PHASES
+        )
+        nodes = f"{record.nodes_before:>6} {record.nodes_after:>6}" if record.nodes_before else " " * 13
+        times = f"{int(record.self_time * 1e6):>9} | {int(record.total * 1e6):>10}"
+
+        print(f"micro import time: {times} | {phases} | {nodes} | {'  ' * depth}{record.name}", file=file)
+
+        for child in record.children:
+            show(child, depth + 1)
+
+    for record in _roots:
+        show(record, 0)
+
+
+if ENABLED:
+    atexit.register(report)
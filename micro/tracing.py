@@ -0,0 +1,153 @@
+# The MIT License (MIT)
+
+# Copyright (c) 2022 AnonymousDapper
+
+__all__ = ("Tracer", "RingBuffer", "JsonLines", "LogSink", "get", "configure", "records")
+
+import json
+import os
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Callable, Iterable, Optional, TextIO, Union
+
+from micro import logger
+
+log = logger.get_logger(__name__)
+
+DEBUG = 10
+INFO = 20
+OFF = 100
+
+LEVELS = {"debug": DEBUG, "info": INFO, "off": OFF}
+LEVEL_NAMES = {DEBUG: "debug", INFO: "info"}
+
+# how many records the default sink keeps
+BUFFER_SIZE = 4096
+
+Record = dict[str, Any]
+Sink = Callable[[Record], None]
+
+
+class RingBuffer:
+    # the last `maxlen` records, for looking at what an expansion did after the fact
+    def __init__(self, maxlen: int = BUFFER_SIZE):
+        self.buffer: deque[Record] = deque(maxlen=maxlen)
+
+    def __call__(self, record: Record):
+        self.buffer.append(record)
+
+    def records(self) -> list[Record]:
+        return list(self.buffer)
+
+    def clear(self):
+        self.buffer.clear()
+
+    def dump(self, file: Union[str, Path, TextIO]):
+        JsonLines(file).write(self.buffer)
+
+
+class JsonLines:
+    # one JSON object per line, appended as records come in
+    def __init__(self, file: Union[str, Path, TextIO]):
+        self.file = open(file, "a", buffering=1, encoding="utf-8") if isinstance(file, (str, Path)) else file
+
+    def __call__(self, record: Record):
+        self.file.write(json.dumps(record, default=str) + "\n")
+
+    def write(self, records: Iterable[Record]):
+        for record in records:
+            self(record)
+
+        self.file.flush()
+
+
+class LogSink:
+    # back into the regular log, with the fields after the event
+    def __call__(self, record: Record):
+        fields = " ".join(f"{k}={v!r}" for k, v in record.items() if k not in ("time", "subsystem", "level", "event"))
+        log.log(LEVELS[record["level"]], f"[{record['subsystem']}] {record['event']} {fields}")
+
+
+class Tracer:
+    # Callers check the level flag before building anything, `if trace.debug: trace.emit(...)`, so a subsystem that
+    # isn't traced costs a single attribute test.
+    __slots__ = ("subsystem", "level", "debug", "info")
+
+    def __init__(self, subsystem: str):
+        self.subsystem = subsystem
+        self.set_level(OFF)
+
+    def set_level(self, level: int):
+        self.level = level
+        self.debug = level <= DEBUG
+        self.info = level <= INFO
+
+    def emit(self, level: int, event: str, **fields: Any):
+        if level >= self.level and _sink is not None:
+            record = {"time": time.time(), "subsystem": self.subsystem, "level": LEVEL_NAMES[level], "event": event}
+            _sink({**record, **fields})
+
+
+# subsystem -> tracer, and the levels they're configured to, `*` for any subsystem not named
+_tracers: dict[str, Tracer] = {}
+_levels: dict[str, int] = {}
+_sink: Optional[Sink] = None
+
+
+def _level(subsystem: str) -> int:
+    return _levels.get(subsystem, _levels.get("*", OFF))
+
+
+def get(subsystem: str) -> Tracer:
+    if (tracer := _tracers.get(subsystem)) is None:
+        tracer = _tracers[subsystem] = Tracer(subsystem)
+        tracer.set_level(_level(subsystem))
+
+    return tracer
+
+
+def _parse(spec: str) -> dict[str, int]:
+    # `expand=debug,cache`, a subsystem without a level is traced at info, `*` stands for all of them
+    levels = {}
+
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        subsystem, _, name = item.partition("=")
+
+        if (level := LEVELS.get(name.strip().lower() or "info")) is None:
+            raise ValueError(f"unknown trace level `{name}` for `{subsystem}`, expected one of {', '.join(LEVELS)}")
+
+        levels[subsystem.strip()] = level
+
+    return levels
+
+
+def configure(levels: Union[str, dict[str, Union[int, str]], None] = None, sink: Optional[Sink] = None):
+    # replaces the levels, and the sink if one is given; tracing anything without a sink keeps records in memory
+    global _sink
+
+    _levels.clear()
+
+    if isinstance(levels, str):
+        _levels.update(_parse(levels))
+
+    elif levels is not None:
+        _levels.update({name: LEVELS[level] if isinstance(level, str) else level for name, level in levels.items()})
+
+    if sink is not None:
+        _sink = sink
+
+    elif _sink is None and any(level < OFF for level in _levels.values()):
+        _sink = RingBuffer()
+
+    for subsystem, tracer in _tracers.items():
+        tracer.set_level(_level(subsystem))
+
+
+def records() -> list[Record]:
+    return _sink.records() if isinstance(_sink, RingBuffer) else []
+
+
+# `MICRO_TRACE=expand=debug,cache`, to MICRO_TRACE_FILE as JSON lines or into the in-memory buffer
+if os.environ.get("MICRO_TRACE"):
+    configure(os.environ["MICRO_TRACE"], JsonLines(path) if (path := os.environ.get("MICRO_TRACE_FILE")) else None)
@@ -2,32 +2,208 @@
 
 # Copyright (c) 2022 AnonymousDapper
 
-__all__ = ("MacroTransformer",)
+__all__ = ("MacroTransformer", "ExpansionLimitError", "insert_prelude")
 
 import ast
+from copy import deepcopy
+from typing import Any, Optional, Union
 
-from micro import consts, logger, walker
+from micro import config, consts, folding, logger, tracing, walker
 from micro.symbol import MacroContext, SymbolTree
 
 log = logger.get_logger(__name__)
+trace = tracing.get("expand")
+
+# limits for the macros an expansion invokes in turn, counted from each invocation in the source
+MAX_DEPTH = 64
+MAX_GROWTH = 100_000
+
+
+class ExpansionLimitError(RecursionError):
+    pass
+
+
+def _invocation_name(node: Any) -> Optional[str]:
+    match node:
+        case ast.Call(func=ast.Name(id=name)) if name.endswith(consts.MACRO_CALL) and name not in consts.BUILTIN_CALLS:
+            return name[: -consts.MACRO_CALL_LEN]
+
+        case ast.Subscript(value=ast.Name(id=name)) if name.endswith(consts.MACRO_CALL):
+            return name[: -consts.MACRO_CALL_LEN]
+
+    return None
+
+
+def _log_level(node: ast.expr) -> Optional[int]:
+    # `INFO`, `logging.INFO`, `"info"` or `20`
+    match node:
+        case ast.Constant(value=value):
+            return config.level(value)
+
+        case ast.Name(id=name) | ast.Attribute(attr=name):
+            return config.level(name)
+
+    return None
+
+
+def _body_start(body: list[ast.stmt]) -> int:
+    # past the docstring and `from __future__` imports, which have to come first
+    idx = 0
+
+    if body and isinstance(body[0], ast.Expr) and isinstance(getattr(body[0].value, "value", None), str):
+        idx = 1
+
+    while idx < len(body) and isinstance(stmt := body[idx], ast.ImportFrom) and stmt.module == "__future__":
+        idx += 1
+
+    return idx
+
+
+# the default logger of `log!` and `trace!`
+LOG_PRELUDE = (
+    f"import logging as {consts.MACRO_LOGGER}\n{consts.MACRO_LOGGER} = {consts.MACRO_LOGGER}.getLogger(__name__)"
+)
+
+
+def insert_prelude(module: ast.Module, prelude: dict[str, str]):
+    # the names expansions rely on the module binding, once per module
+    statements = ast.parse("\n".join(prelude[name] for name in sorted(prelude)), **consts.AST_OPTS).body
+
+    idx = _body_start(module.body)
+    module.body[idx:idx] = statements
+
+
+_COMPREHENSIONS = (ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)
+
+
+def _format_chain(chain: tuple[str, ...]) -> str:
+    if len(chain) > 8:
+        chain = (*chain[:4], "...", *chain[-4:])
+
+    return " -> ".join(chain)
+
+
+class _Scan:
+    # Finds the invocations in freshly expanded nodes, in post-order so arguments come before their callers.
+    # Sites are (holder, key, node, top, chain, scope, named_exprs): statements are keyed by the statement itself,
+    # since splicing shifts indices, expressions by field name or list index.
+
+    def __init__(self, named_exprs: bool = True, class_body: bool = False):
+        self.sites: list[tuple] = []
+        self.grown = 0
+
+        # where the output goes, and how many of the nodes being scanned rule out `:=` below them
+        self.class_body = class_body
+        self.blocked = 0 if named_exprs else 1
+
+    def statements(self, items: list, *, top: bool, chain: tuple[str, ...], scope: list[str]):
+        for item in items:
+            if not isinstance(item, ast.AST) or walker.is_template(item):
+                continue
+
+            self.grown += 1
+            target = item.value if isinstance(item, ast.Expr) else item
+
+            if target is not item:
+                self.grown += 1
+
+            self.children(target, chain, scope)
+
+            if _invocation_name(target) is not None:
+                self.sites.append((items, item, target, top, chain, scope, not self.blocked))
+
+    def expression(
+        self, holder: Any, key: Union[str, int], node: ast.AST, *, top: bool, chain: tuple[str, ...], scope: list[str]
+    ):
+        if walker.is_template(node):
+            return
+
+        self.grown += 1
+        self.children(node, chain, scope)
+
+        if _invocation_name(node) is not None:
+            self.sites.append((holder, key, node, top, chain, scope, not self.blocked))
+
+    def children(self, node: ast.AST, chain: tuple[str, ...], scope: list[str]):
+        comprehension = self.class_body and isinstance(node, _COMPREHENSIONS)
+        self.blocked += comprehension
+
+        for field, value in ast.iter_fields(node):
+            iterable = field == "iter" and isinstance(node, ast.comprehension)
+            self.blocked += iterable
+
+            if isinstance(value, list):
+                if value and isinstance(value[0], ast.stmt):
+                    self.statements(value, top=False, chain=chain, scope=scope)
+
+                else:
+                    for idx, item in enumerate(value):
+                        if isinstance(item, ast.AST):
+                            self.expression(value, idx, item, top=False, chain=chain, scope=scope)
+
+            elif isinstance(value, ast.AST):
+                self.expression(node, field, value, top=False, chain=chain, scope=scope)
+
+            self.blocked -= iterable
+
+        self.blocked -= comprehension
 
 
 class MacroTransformer(ast.NodeTransformer):
     def __init__(self, file: str, module: str):
         self.filename = file
+        self.module = module
         self.path = module.split(".")
 
         self.found_macro = False
 
+        # modules whose macros were expanded into this one
+        self.dependencies: set[str] = set()
+
+        # (scope, name) -> registry version of every macro invoked, nested ones included
+        self.invoked: dict[tuple[tuple[str, ...], str], Optional[int]] = {}
+
+        # inside `@macro!` definitions, whose invocations are expanded when the macro is
+        self.templates = 0
+
+        # the `@name!(...)` decorator being visited, it's a proc macro invocation rather than a call macro
+        self.decorator: Optional[ast.expr] = None
+
+        # the invocation that makes up the statement being visited, its output may be statements
+        self.statement: Optional[ast.expr] = None
+
+        # name -> the statements binding it at the top of the module, for names expansions rely on (the default
+        # logger of `log!`, modules inlined functions come from); whoever assembles a module from pieces adds them
+        self.prelude: dict[str, str] = {}
+        self.whole_module = True
+
+        # names bound at the top level of the module, found before anything in it is expanded; updated in place,
+        # since the cleanup stages share it
+        self.shadowed: set[str] = set()
+
+        # inside a class body, and inside anything `:=` can't be used in
+        self.class_body = False
+        self.no_named_exprs = 0
+
         super().__init__()
 
-    def __build_context(self) -> MacroContext:
-        return MacroContext(self.filename, self.path)
+    def __build_context(self, decorator: Optional[ast.expr] = None) -> MacroContext:
+        ctx = MacroContext(self.filename, self.path, self.module, shadowed=self.shadowed)
+
+        if isinstance(decorator, ast.Call):
+            ctx.args = decorator.args
+            ctx.kwargs = {keyword.arg: keyword.value for keyword in decorator.keywords if keyword.arg is not None}
+
+        return ctx
+
+    def __add_dependency(self, name: str, path: Optional[list[str]] = None):
+        if (origin := SymbolTree.lookup_origin(path or self.path, name)) is not None:
+            self.dependencies.add(origin)
 
     def visit_Import(self, node: ast.Import):
         # log.debug(f":: Import: {astpretty.pformat(node, show_offsets=False)}")
         for name in node.names:
-            SymbolTree.add_import(self.path, name.name, asname=name.asname)
+            SymbolTree.add_import(self.path, name.name, asname=name.asname, importer=self.module)
 
         return node
 
@@ -41,98 +217,400 @@ class MacroTransformer(ast.NodeTransformer):
                 asname=name.asname,
                 package=".".join(self.path),
                 level=node.level,
+                importer=self.module,
             )
 
         return node
 
+    def __invoke(
+        self, node: Union[ast.Call, ast.Subscript], name: str, path: list[str], named_exprs: bool
+    ) -> Optional[tuple[list, walker.MacroTemplate]]:
+        kind = "call" if isinstance(node, ast.Call) else "subscript"
+
+        if trace.debug:
+            trace.emit(tracing.DEBUG, "invoke", kind=kind, name=name, path=".".join(path))
+
+        if not (macro := SymbolTree.lookup_macro(path, name)):
+            log.error(f"Error on {kind} invoke `{name}`: macro not found")
+            return None
+
+        self.__add_dependency(name, path)
+        self.invoked[tuple(path), name] = SymbolTree.lookup_version(path, name)
+
+        # inlined functions are bound differently depending on where they end up
+        options = None
+
+        if isinstance(macro, walker.InlineTemplate):
+            options = {"module": self.module, "named_exprs": named_exprs}
+
+        if isinstance(node, ast.Call):
+            result = walker.call_invoke(node, macro, options)
+
+        else:
+            result = walker.subscript_invoke(node, macro, options)
+
+        if options is not None and macro.module is not None and macro.module != self.module:
+            alias = walker.module_alias(macro.module)
+
+            if any(isinstance(child, ast.Name) and child.id == alias for item in result for child in ast.walk(item)):
+                self.prelude[alias] = f"import {macro.module} as {alias}"
+
+        return [item.value if type(item) == ast.Expr else item for item in result], macro
+
+    def __expand(self, node: Union[ast.Call, ast.Subscript], name: str):
+        # Invocations in the output are expanded innermost first from an explicit stack, until none are left.
+        # Only nodes the expansion produced are scanned, whatever is shared with a template can't contain any.
+        # Those invocations come from the macro, so they resolve where it was defined rather than at the call site.
+        if (invoked := self.__invoke(node, name, self.path, not self.no_named_exprs)) is None:
+            return node
+
+        result, macro = invoked
+
+        scan = _Scan(not self.no_named_exprs, self.class_body)
+        scan.statements(result, top=True, chain=(name,), scope=macro.scope)
+        scan.sites.reverse()
+
+        while scan.sites:
+            holder, key, site, top, chain, scope, named_exprs = scan.sites.pop()
+            name = _invocation_name(site)  # type: ignore
+
+            if len(chain) >= MAX_DEPTH:
+                raise ExpansionLimitError(
+                    f"expanding `{chain[0]}` went more than {MAX_DEPTH} macros deep ({_format_chain(chain + (name,))})"
+                )
+
+            if (invoked := self.__invoke(site, name, scope, named_exprs)) is None:  # type: ignore
+                continue
+
+            expanded, macro = invoked
+            pending = len(scan.sites)
+
+            if isinstance(key, ast.AST):
+                # statement position, splice the output in where the statement was
+                idx = next(idx for idx, item in enumerate(holder) if item is key)  # type: ignore
+
+                if not top:
+                    expanded = [ast.Expr(value=item) if isinstance(item, ast.expr) else item for item in expanded]
+
+                holder[idx : idx + 1] = expanded  # type: ignore
+                scan.statements(expanded, top=top, chain=chain + (name,), scope=macro.scope)
+
+            else:
+                if len(expanded) != 1 or not isinstance(expanded[0], ast.expr):
+                    raise ValueError(f"macro `{name}` expands to statements, but is used as an expression")
+
+                if isinstance(key, int):
+                    holder[key] = expanded[0]  # type: ignore
+
+                else:
+                    setattr(holder, key, expanded[0])
+
+                scan.expression(holder, key, expanded[0], top=top, chain=chain + (name,), scope=macro.scope)
+
+            # innermost first: whatever this expansion produced runs before the sites that were already waiting
+            scan.sites[pending:] = scan.sites[pending:][::-1]
+
+            if scan.grown > MAX_GROWTH:
+                raise ExpansionLimitError(f"expanding `{chain[0]}` produced more than {MAX_GROWTH} nodes")
+
+        return result
+
+    def __place(self, node: Union[ast.Call, ast.Subscript], name: str, result: Any):
+        # anywhere but statement position the output takes the invocation's place in its field
+        if node is self.statement or not isinstance(result, list):
+            return result
+
+        if any(isinstance(item, ast.stmt) for item in result):
+            raise ValueError(f"macro `{name}` expands to statements, but is used as an expression")
+
+        return result[0] if len(result) == 1 else result
+
+    def __debug_assert(self, node: ast.Call) -> list[ast.stmt]:
+        # `debug_assert!(cond, msg)` raises like `assert`, but follows the `debug` flag rather than -O
+        if node is not self.statement:
+            raise ValueError(f"{self.filename}:{node.lineno}: debug_assert! can only be used as a statement")
+
+        if not 1 <= len(node.args) <= 2 or node.keywords:
+            raise ValueError(f"{self.filename}:{node.lineno}: debug_assert! takes a condition and an optional message")
+
+        self.found_macro = True
+
+        if not config.get(config.DEBUG):
+            return []
+
+        self.generic_visit(node)
+        error = ast.Call(func=ast.Name(id="AssertionError", ctx=ast.Load()), args=node.args[1:], keywords=[])
+
+        return [ast.If(test=ast.UnaryOp(op=ast.Not(), operand=node.args[0]), body=[ast.Raise(exc=error)], orelse=[])]
+
+    def __log(self, node: ast.Call, name: str) -> list[ast.stmt]:
+        # `log!(level, msg, *args, logger=..., **kwargs)` and `trace!(msg, ...)` check the level first, so the message
+        # and arguments are only evaluated for records that are emitted
+        if node is not self.statement:
+            raise ValueError(f"{self.filename}:{node.lineno}: {name} can only be used as a statement")
+
+        if name == consts.MACRO_TRACE:
+            level, message = config.TRACE, 0
+
+        elif len(node.args) < 2 or (level := _log_level(node.args[0])) is None:  # type: ignore
+            raise ValueError(f"{self.filename}:{node.lineno}: log! takes a constant level and a message")
+
+        else:
+            message = 1
+
+        if len(node.args) <= message:
+            raise ValueError(f"{self.filename}:{node.lineno}: {name} takes a message")
+
+        self.found_macro = True
+
+        # below the configured minimum the call is dropped along with its arguments
+        if level < config.min_level():
+            return []
+
+        self.generic_visit(node)
+
+        logger = next((keyword.value for keyword in node.keywords if keyword.arg == "logger"), None)
+        keywords = [keyword for keyword in node.keywords if keyword.arg != "logger"]
+
+        if logger is None:
+            self.prelude[consts.MACRO_LOGGER] = LOG_PRELUDE
+            logger = ast.Name(id=consts.MACRO_LOGGER, ctx=ast.Load())
+
+        elif not isinstance(logger, (ast.Name, ast.Attribute)):
+            raise ValueError(f"{self.filename}:{node.lineno}: {name} logger has to be a name or an attribute")
+
+        check = ast.Call(
+            func=ast.Attribute(value=logger, attr="isEnabledFor", ctx=ast.Load()),
+            args=[ast.Constant(level)],
+            keywords=[],
+        )
+        emit = ast.Call(
+            func=ast.Attribute(value=deepcopy(logger), attr="log", ctx=ast.Load()),
+            args=[ast.Constant(level), *node.args[message:]],
+            keywords=keywords,
+        )
+
+        return [ast.If(test=check, body=[ast.Expr(value=emit)], orelse=[])]
+
     def visit_Call(self, node: ast.Call):
+        if not self.templates and isinstance(node.func, ast.Name):
+            node.func = self.visit(node.func)
+
+            match node.func.id:
+                case consts.MACRO_DEBUG_ASSERT:
+                    return self.__debug_assert(node)
+
+                case consts.MACRO_LOG | consts.MACRO_TRACE:
+                    return self.__log(node, node.func.id)
+
         self.generic_visit(node)
 
+        if self.templates or node is self.decorator:
+            return node
+
         match node.func:
             case ast.Name(id=name) if name.endswith(consts.MACRO_CALL):
-                # handle quote in cleanup
+                # handle quote and const in cleanup
 
-                if name == consts.MACRO_QUOTE:
+                if name in consts.BUILTIN_CALLS:
                     return node
 
                 self.found_macro = True
                 name = name[: -consts.MACRO_CALL_LEN]
 
-                log.info(f"! Invoke [call] of `{name}` at {'.'.join(self.path)} ")
-
-                if macro := SymbolTree.lookup_macro(self.path, name):
-
-                    node = walker.call_invoke(node, macro)
-                    
-                    for i, n in enumerate(node):
-                        if type(n) == ast.Expr:
-                            node[i] = n.value
-
-                else:
-                    log.error(f"Error on call invoke `{name}`: macro not found")
+                return self.__place(node, name, self.__expand(node, name))
 
         return node
 
     def visit_Subscript(self, node: ast.Subscript):
         self.generic_visit(node)
 
+        if self.templates:
+            return node
+
         match node.value:
             case ast.Name(id=name) if name.endswith(consts.MACRO_CALL):
                 self.found_macro = True
                 name = name[: -consts.MACRO_CALL_LEN]
 
-                log.info(f"! Invoke [subscript] of `{name}` at {'.'.join(self.path)}")
+                return self.__place(node, name, self.__expand(node, name))
 
-                if macro := SymbolTree.lookup_macro(self.path, name):
-
-                    node = walker.subscript_invoke(node, macro)
+        return node
 
-                else:
-                    log.error(f"Error on subscript invoke `{name}`: macro not found")
+    def __defines_macro(self, decorator: ast.expr) -> bool:
+        match decorator:
+            case ast.Name(id=name) if name.endswith(consts.MACRO_CALL):
+                try:
+                    return SymbolTree.lookup_proc_macro(self.path, name[: -consts.MACRO_CALL_LEN]) is walker.build_macro
 
-        return node
+                except NameError:
+                    return False
 
-    def visit_FunctionDef(self, node: ast.FunctionDef):
-        self.path.append(node.name)
-        self.generic_visit(node)
-        self.path.pop()
+        return False
 
+    def __visit_decorators(self, node: Union[ast.FunctionDef, ast.ClassDef]) -> list[ast.expr]:
+        # decorators first, they decide how the rest is treated
+        decorators = []
         for decorator in node.decorator_list:
+            self.decorator = decorator
+            decorators.append(self.visit(decorator))
+
+        self.decorator = None
+        node.decorator_list = []
+
+        return decorators
+
+    def __apply_proc_macros(self, node: Union[ast.FunctionDef, ast.ClassDef], decorators: list[ast.expr]):
+        node.decorator_list = decorators
+        kind = node.__class__
+
+        for decorator in list(decorators):
             match decorator:
-                case ast.Name(id=name) if name.endswith(consts.MACRO_CALL):
+                case ast.Name(id=name) | ast.Call(func=ast.Name(id=name)) if name.endswith(consts.MACRO_CALL):
                     self.found_macro = True
                     name = name[: -consts.MACRO_CALL_LEN]
 
-                    log.info(f"! Invoke [decorator] of `{name}` at {'.'.join(self.path)}")
+                    if trace.debug:
+                        trace.emit(tracing.DEBUG, "invoke", kind="decorator", name=name, path=".".join(self.path))
 
                     if macro := SymbolTree.lookup_proc_macro(self.path, name):
+                        self.__add_dependency(name)
+
+                        # a proc macro gets the definition without its own decorator
+                        node.decorator_list.remove(decorator)
+                        node = macro(self.__build_context(decorator), node)
 
-                        node = macro(self.__build_context(), node)
+                        # replaced by something that isn't the same kind of definition, nothing left to decorate
+                        if not isinstance(node, kind):
+                            break
 
                     else:
                         log.error(f"Error on decorator invoke `{name}`: macro not found")
 
         return node
 
+    def __cfg_enabled(self, decorators: list[ast.expr]) -> bool:
+        # `@cfg!(...)` keeps the definition as if it wasn't decorated, or drops it before anything in it is expanded
+        enabled = True
+
+        for decorator in list(decorators):
+            match decorator:
+                case ast.Call(func=ast.Name(id=consts.MACRO_CFG)) if not self.templates:
+                    decorators.remove(decorator)
+                    enabled = enabled and config.check(decorator, self.filename)
+
+        return enabled
+
+    def __cfg_test(self, test: ast.expr) -> Optional[bool]:
+        # whether `if cfg!(...):` or `if not cfg!(...):` takes its body, None for any other condition
+        negated = False
+
+        if isinstance(test, ast.UnaryOp) and isinstance(test.op, ast.Not):
+            test, negated = test.operand, True
+
+        if self.templates or not isinstance(test, ast.Call) or not isinstance(test.func, ast.Name):
+            return None
+
+        # names are restored on the way down, so the callee has to be visited before it can be told apart
+        test.func = self.visit(test.func)
+
+        if test.func.id != consts.MACRO_CFG:
+            return None
+
+        return config.check(test, self.filename) != negated
+
+    def visit_If(self, node: ast.If):
+        # only the branch the configuration selects is kept, `elif`s are nested `if`s in `orelse`
+        if (taken := self.__cfg_test(node.test)) is None:
+            return self.generic_visit(node)
+
+        block = ast.Module(body=node.body if taken else node.orelse, type_ignores=[])
+        self.generic_visit(block)
+
+        return block.body
+
+    def visit_FunctionDef(self, node: ast.FunctionDef):
+        decorators = self.__visit_decorators(node)
+
+        if not self.__cfg_enabled(decorators):
+            return None
+
+        template = any(self.__defines_macro(decorator) for decorator in decorators)
+
+        class_body, self.class_body = self.class_body, False
+
+        self.path.append(node.name)
+        self.templates += template
+        self.generic_visit(node)
+        self.templates -= template
+        self.path.pop()
+
+        self.class_body = class_body
+
+        return self.__apply_proc_macros(node, decorators)
+
+    def visit_ClassDef(self, node: ast.ClassDef):
+        decorators = self.__visit_decorators(node)
+
+        if not self.__cfg_enabled(decorators):
+            return None
+
+        class_body, self.class_body = self.class_body, True
+        self.generic_visit(node)
+        self.class_body = class_body
+
+        return self.__apply_proc_macros(node, decorators)
+
+    def visit_comprehension(self, node: ast.comprehension):
+        # `:=` is a syntax error in the iterable
+        self.no_named_exprs += 1
+        node.iter = self.visit(node.iter)
+        self.no_named_exprs -= 1
+
+        node.target = self.visit(node.target)
+        node.ifs = [self.visit(test) for test in node.ifs]
+
+        return node
+
+    def visit_ListComp(self, node: Union[ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp]):
+        # and anywhere in a comprehension in a class body
+        self.no_named_exprs += self.class_body
+        self.generic_visit(node)
+        self.no_named_exprs -= self.class_body
+
+        return node
+
+    visit_SetComp = visit_DictComp = visit_GeneratorExp = visit_ListComp  # type: ignore
+
+    def visit_Module(self, node: ast.Module):
+        self.prelude = {}
+
+        if self.whole_module:
+            self.shadowed.clear()
+            self.shadowed.update(folding.module_bindings(node))
+        self.generic_visit(node)
+
+        if self.prelude and self.whole_module:
+            insert_prelude(node, self.prelude)
+
+        return node
+
     def visit_Expr(self, node: ast.Expr):
         match node.value:
-            case ast.Call():
-                tree = self.visit_Call(node.value)
-                if self.found_macro:
-                    self.found_macro = False
-                    return tree
+            case ast.Call() | ast.Subscript():
+                self.found_macro = False
+                self.statement = node.value
+                tree = self.visit(node.value)
 
-            case ast.Subscript():
-                tree = self.visit_Subscript(node.value)
-                if self.found_macro:
+                # an invocation in statement position expands in place, expressions in its output become statements
+                if self.found_macro and isinstance(tree, list):
                     self.found_macro = False
-                    return tree
+                    return [ast.Expr(value=item) if isinstance(item, ast.expr) else item for item in tree]
 
-            case ast.FunctionDef():
-                tree = self.visit_FunctionDef(node.value)
-                if self.found_macro:
-                    self.found_macro = False
-                    return tree
+                self.found_macro = False
+
+                if isinstance(tree, ast.AST):
+                    node.value = tree  # type: ignore
 
             case _:
                 self.generic_visit(node)
@@ -2,15 +2,29 @@
 
 # Copyright (c) 2022 AnonymousDapper
 
-__all__ = ("MacroInterpreter", "subscript_invoke", "call_invoke", "EXPR_NODES")
+__all__ = (
+    "MacroTemplate",
+    "InlineTemplate",
+    "subscript_invoke",
+    "call_invoke",
+    "is_template",
+    "fingerprint",
+    "module_alias",
+    "cache_info",
+    "cache_clear",
+    "EXPR_NODES",
+)
 
 import ast
-from collections import deque
+import builtins
+import importlib
+import sys
+from collections import OrderedDict, deque
 from copy import deepcopy
-
-import astpretty
+from typing import Any, Iterable, Iterator, Optional, Union
 
 from micro import consts
+from micro.folding import bound_names
 from micro.symbol import MacroContext, SymbolTree
 
 EXPR_NODES = [
@@ -71,11 +85,23 @@ EXPR_NODES = [
 # @macro!
 def build_macro(ctx: MacroContext, node: ast.FunctionDef):
     # SymbolTree.remove_item(ctx.path, node.name)
-    SymbolTree.register_macro(ctx.path, node.name, node)
+    SymbolTree.register_macro(ctx.path, node.name, MacroTemplate(node, list(ctx.path)), module=ctx.module)
 
 
 SymbolTree.register_proc_macro("micro", "macro", build_macro)
 
+
+# @inline!
+def build_inline(ctx: MacroContext, node: ast.FunctionDef):
+    template = InlineTemplate(node, list(ctx.path), ctx.module)
+    SymbolTree.register_macro(ctx.path, node.name, template, module=ctx.module)
+
+    # still a regular function for everything that calls it without `!`
+    return node
+
+
+SymbolTree.register_proc_macro("micro", "inline", build_inline)
+
 # def build_proc_macro(ctx: MacroContext, node: ast.FunctionDef):
 #     SymbolTree.register_proc_macro(ctx.path, node.name)
 
@@ -101,7 +127,7 @@ class TupleContainer(ast.Tuple):
     def __iter__(self):
         return iter(self.elts)
 
-    def __init__(self, elts):
+    def __init__(self, elts=()):
         self.elts = list(elts)
         self.ctx = ast.Load()
 
@@ -118,7 +144,8 @@ class DictContainer(ast.Dict):
     def __iter__(self):
         return iter(self.keys)
 
-    def __init__(self, items):
+    def __init__(self, items=None):
+        items = items or {}
         self.keys = list(items.keys())
         self.values = list(items.values())
         self.ctx = ast.Load()
@@ -128,137 +155,666 @@ class DictContainer(ast.Dict):
         super().__init__()
 
 
-class MacroInterpreter(ast.NodeTransformer):
-    def __init__(self, params: ast.arguments, cargs: list[ast.expr], call_kwargs: dict):
-        vararg = params.vararg and params.vararg.arg or None
+def bind_args(params: ast.arguments, cargs: list[ast.expr], call_kwargs: dict) -> dict[str, ast.AST]:
+    vararg = params.vararg and params.vararg.arg or None
 
-        kwarg = params.kwarg and params.kwarg.arg or None
+    kwarg = params.kwarg and params.kwarg.arg or None
 
-        kw_defaults = deque(params.kw_defaults)
-        defaults = deque(params.defaults)
-        args = deque(cargs)
+    kw_defaults = deque(params.kw_defaults)
+    defaults = deque(params.defaults)
+    args = deque(cargs)
 
-        # log.debug("posonlyargs", list(map(arg_name, params.posonlyargs)))
-        # log.debug("args", list(map(arg_name, params.args)))
-        # log.debug("kwonlyargs", list(map(arg_name, params.kwonlyargs)))
+    call_args = {}
 
-        # log.debug("\ndefaults", list(map(arg_name, defaults)))
-        # log.debug("kw_defaults", list(map(arg_name, kw_defaults)))
+    for arg in get_arg_names(params.posonlyargs + params.args):
+        if args:
+            call_args[arg] = args.popleft()
+            if defaults:
+                defaults.popleft()
 
-        # log.debug("\nargs", list(map(arg_name, cargs)))
-        # log.debug("kwargs", list(map(arg_name, call_kwargs)))
+        elif defaults:
+            call_args[arg] = defaults.popleft()
 
-        call_args = {}
+        else:
+            raise ValueError(f"positional {arg} has no passed value")
 
-        for arg in get_arg_names(params.posonlyargs + params.args):
-            if args:
-                call_args[arg] = args.popleft()
-                if defaults:
-                    defaults.popleft()
+    if vararg:
+        call_args[vararg] = TupleContainer(args)
 
-            elif defaults:
-                call_args[arg] = defaults.popleft()
+    for karg in get_arg_names(params.kwonlyargs):
+        if karg in call_kwargs:
+            call_args[karg] = call_kwargs.pop(karg)
 
-            else:
-                raise ValueError(f"positional {arg} has no passed value")
+            if kw_defaults:
+                kw_defaults.popleft()
 
-        if vararg:
-            call_args[vararg] = TupleContainer(args)
+        elif kw_defaults:
+            call_args[karg] = kw_defaults.popleft()
 
-        for karg in get_arg_names(params.kwonlyargs):
-            if karg in call_kwargs:
-                call_args[karg] = call_kwargs.pop(karg)
+        else:
+            raise ValueError(f"keyword {karg} has no passed value")
 
-                if kw_defaults:
-                    kw_defaults.popleft()
+    if kwarg:
+        call_args[kwarg] = DictContainer(call_kwargs)
 
-            elif kw_defaults:
-                call_args[karg] = kw_defaults.popleft()
+    return call_args
 
-            else:
-                raise ValueError(f"keyword {karg} has no passed value")
 
-        if kwarg:
-            call_args[kwarg] = DictContainer(call_kwargs)
+# set on every node owned by a template; those are shared between instances and must never be modified
+TEMPLATE_FLAG = "_micro_template"
 
-        self.vars = call_args
-        # print(self.vars)
+# what instantiating a node has to do besides copying it
+COPY, NAME, ATTR, FUNCTION, CLASS, LOOP = range(6)
 
-        super().__init__()
+# (kind, slot, children): children maps a field to the plan of the node in it, or for list fields to a dict of
+# index -> plan. Nodes without a plan contain no slot and are used as-is.
+Plan = tuple[int, Any, dict[str, Any]]
 
-    def _get_arg(self, name: str):
-        # print(self.vars, name)
-        return self.vars.get(name[consts.MACRO_SUBST_LEN :], None)
 
-    def visit_Attribute(self, node: ast.Attribute):
-        self.generic_visit(node)
+def is_template(node: ast.AST) -> bool:
+    return TEMPLATE_FLAG in node.__dict__
 
-        if node.attr.startswith(consts.MACRO_SUBST):
-            if v := self._get_arg(node.attr):
-                node.attr = ast.unparse(v)
 
-        return node
+def _is_subst(name: str) -> bool:
+    return name.startswith(consts.MACRO_SUBST)
+
+
+def _is_macro(node: ast.AST) -> bool:
+    return isinstance(node, ast.Name) and node.id.endswith(consts.MACRO_CALL)
+
+
+def _loop_target(target: ast.expr) -> Union[str, tuple[str, ...], None]:
+    # `for $x in ...` binds each item, `for $k, $v in ...` unpacks it
+    match target:
+        case ast.Name(id=name) if _is_subst(name):
+            return name[consts.MACRO_SUBST_LEN :]
+
+        case ast.Tuple(elts=elts) if elts and all(isinstance(elt, ast.Name) and _is_subst(elt.id) for elt in elts):
+            return tuple(elt.id[consts.MACRO_SUBST_LEN :] for elt in elts)  # type: ignore
+
+    return None
+
+
+def _compile(node: ast.AST) -> Optional[Plan]:
+    children: dict[str, Any] = {}
+
+    for field, value in ast.iter_fields(node):
+        if isinstance(value, list):
+            if items := {
+                idx: plan
+                for idx, item in enumerate(value)
+                if isinstance(item, ast.AST) and (plan := _compile(item)) is not None
+            }:
+                children[field] = items
+
+        elif isinstance(value, ast.AST) and (plan := _compile(value)) is not None:
+            children[field] = plan
+
+    slot: Any = None
+
+    match node:
+        case ast.Name(id=name) if _is_subst(name):
+            kind, slot = NAME, name[consts.MACRO_SUBST_LEN :]
+
+        case ast.Attribute(attr=name) if _is_subst(name):
+            kind, slot = ATTR, name[consts.MACRO_SUBST_LEN :]
+
+        case ast.FunctionDef(name=name) if _is_subst(name):
+            kind, slot = FUNCTION, name[consts.MACRO_SUBST_LEN :]
+
+        case ast.ClassDef(name=name) if _is_subst(name):
+            kind, slot = CLASS, name[consts.MACRO_SUBST_LEN :]
+
+        case ast.For(target=target) if (names := _loop_target(target)) is not None:
+            kind, slot = LOOP, names
+
+        # rewritten in place by later passes (quote lowering, nested invocations, macro import stripping)
+        case ast.Call(func=func) | ast.Subscript(value=func) if _is_macro(func):
+            kind = COPY
+
+        case ast.Import() | ast.ImportFrom():
+            kind = COPY
+
+        case _ if children:
+            kind = COPY
+
+        case _:
+            return None
+
+    return kind, slot, children
+
+
+def _copy(node: ast.AST) -> ast.AST:
+    new = node.__class__.__new__(node.__class__)
+
+    for key, value in node.__dict__.items():
+        if key != TEMPLATE_FLAG:
+            new.__dict__[key] = value[:] if type(value) is list else value
+
+    return new
+
+
+def _instantiate_items(items: list, plans: dict[int, Plan], env: dict[str, ast.AST]) -> Iterator[ast.AST]:
+    for idx, item in enumerate(items):
+        if (plan := plans.get(idx)) is None:
+            yield item
+
+        elif isinstance(new := _instantiate(item, plan, env), ast.AST):
+            yield new
+
+        elif new is not None:
+            yield from new
+
+
+def _instantiate_list(items: list, plans: dict[int, Plan], env: dict[str, ast.AST]) -> list:
+    return list(_instantiate_items(items, plans, env))
+
+
+class _Keyword(tuple):
+    # (name, value) of an argument collected by `**kwargs`, the name being the keyword rather than an expression
+    pass
+
+
+def _repetition_items(value: ast.AST) -> Optional[Iterable]:
+    match value:
+        case DictContainer(keys=keys, values=values):
+            return [_Keyword(item) for item in zip(keys, values)]
+
+        case ast.Dict(keys=keys, values=values) if None not in keys:
+            return zip(keys, values)
+
+        case ast.Tuple(elts=elts) | ast.List(elts=elts) | ast.Set(elts=elts):
+            return elts
+
+    return None
+
+
+def _bind_item(target: Union[str, tuple[str, ...]], item: Any) -> dict[str, ast.AST]:
+    # a single name over a dict gets (key, value) tuples like `dict.items()`, keywords as strings
+    match target, item:
+        case str(), _Keyword((key, value)):
+            name = key if isinstance(key, str) else arg_name(key)
+            return {target: ast.Tuple(elts=[ast.Constant(value=name), value], ctx=ast.Load())}
+
+        case str(), (key, value):
+            return {target: ast.Tuple(elts=[key, value], ctx=ast.Load())}
+
+        case str(), _:
+            return {target: item}
+
+    match item:
+        case (key, value):
+            parts = [key, value]
+
+        case ast.Tuple(elts=parts) | ast.List(elts=parts):
+            pass
+
+        case _:
+            parts = [item]
+
+    if len(parts) != len(target):
+        names = ", ".join(consts.MACRO_SUBST + name for name in target)
+        shown = ast.unparse(item) if isinstance(item, ast.AST) else item
+        raise ValueError(f"repetition item {shown} doesn't unpack into {names}")
+
+    return dict(zip(target, parts))
+
+
+def _repeat(node: ast.For, items: Iterable, plan: Plan, env: dict[str, ast.AST]) -> Iterator[ast.AST]:
+    # one copy of the whole body per item, produced as it's consumed; nested repetitions see the outer bindings
+    _, target, children = plan
+    body_plans = children.get("body", {})
+
+    for item in items:
+        yield from _instantiate_items(node.body, body_plans, {**env, **_bind_item(target, item)})
+
+    # nothing can `break` out of an unrolled loop
+    yield from _instantiate_items(node.orelse, children.get("orelse", {}), env)
+
+
+def _instantiate(node: ast.AST, plan: Plan, env: dict[str, ast.AST]):
+    kind, slot, children = plan
+
+    if kind == NAME:
+        if (value := env.get(slot)) is None:
+            return node
+
+        # a passed name can land in a store (or del) position
+        if "ctx" in value._fields and value.ctx.__class__ is not node.ctx.__class__:  # type: ignore
+            value = _copy(value)
+            value.ctx = node.ctx  # type: ignore
+
+        return value
+
+    if kind == LOOP:
+        iter_plan = children.get("iter")
+        value = _instantiate(node.iter, iter_plan, env) if iter_plan is not None else node.iter  # type: ignore
+
+        if (items := _repetition_items(value)) is not None:
+            return _repeat(node, items, plan, env)  # type: ignore
+
+        # anything else stays a regular loop, over plain names
+        names = (slot,) if isinstance(slot, str) else slot
+        env = {**env, **{name: ast.Name(id=name, ctx=ast.Load()) for name in names}}
+
+    new = _copy(node)
+
+    for field, child in children.items():
+        if isinstance(child, dict):
+            setattr(new, field, _instantiate_list(getattr(node, field), child, env))
+
+        else:
+            setattr(new, field, _instantiate(getattr(node, field), child, env))
+
+    if kind == ATTR:
+        if value := env.get(slot):
+            new.attr = ast.unparse(value)  # type: ignore
+
+    elif kind == FUNCTION:
+        new.name = arg_name(env.get(slot))  # type: ignore
+
+    elif kind == CLASS:
+        if value := env.get(slot):
+            new.name = value.id  # type: ignore
+
+    return new
+
+
+class MacroTemplate:
+    # A `@macro!` definition compiled once, when it's registered. The definition itself is frozen; every node an
+    # invocation changes is reachable through a plan, and instantiating copies only the nodes along those paths
+    # while everything else is shared by all instances.
+
+    def __init__(self, node: ast.FunctionDef, scope: list[str]):
+        self.node = node
+        self.name = node.name
+        self.args = node.args
+
+        # where the definition lives, invocations in its output are resolved from here
+        self.scope = scope
+
+        for child in ast.walk(node):
+            child.__dict__[TEMPLATE_FLAG] = True
+
+        self.plans = {idx: plan for idx, stmt in enumerate(node.body) if (plan := _compile(stmt)) is not None}
+
+    # also exists at runtime, so imports of it are kept
+    runtime = False
+
+    def instantiate(self, args: list[ast.expr], kwargs: dict) -> list:
+        return _instantiate_list(self.node.body, self.plans, bind_args(self.args, args, kwargs))
+
+    def __repr__(self):
+        return f"<MacroTemplate {self.name} ({sum(map(_count_slots, self.plans.values()))} slots)>"
+
+
+_SCOPES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)
+
+
+def _own_nodes(nodes: list[ast.AST]) -> Iterator[ast.AST]:
+    # everything in a function body that runs in its own scope, nested definitions are yielded but not entered
+    pending = list(reversed(nodes))
+
+    while pending:
+        node = pending.pop()
+        yield node
+
+        if not isinstance(node, _SCOPES):
+            pending.extend(reversed(list(ast.iter_child_nodes(node))))
+
+
+class _Rename(ast.NodeTransformer):
+    def __init__(self, names: dict[str, str], values: dict[str, ast.expr]):
+        self.names = names
+        self.values = values
 
     def visit_Name(self, node: ast.Name):
-        if node.id.startswith(consts.MACRO_SUBST):
-            ctx = node.ctx
-            node = self._get_arg(node.id) or node
-            node.ctx = ctx
+        if node.id in self.values:
+            return deepcopy(self.values[node.id])
+
+        if node.id in self.names:
+            node.id = self.names[node.id]
 
         return node
 
-    def visit_ClassDef(self, node: ast.ClassDef):
-        self.generic_visit(node)
-        if node.name.startswith(consts.MACRO_SUBST):
-            if name := self._get_arg(node.name):
-                node.name = name.id
+    def visit_arg(self, node: ast.arg):
+        node.arg = self.names.get(node.arg, node.arg)
+        return self.generic_visit(node)
+
+    def visit_alias(self, node: ast.alias):
+        if node.asname is not None:
+            node.asname = self.names.get(node.asname, node.asname)
+
+        elif node.name in self.names:
+            node.asname = self.names[node.name]
 
         return node
 
     def visit_FunctionDef(self, node: ast.FunctionDef):
-        self.generic_visit(node)
+        node.name = self.names.get(node.name, node.name)
+        return self.generic_visit(node)
 
-        if node.name.startswith(consts.MACRO_SUBST):
-            node.name = arg_name(self._get_arg(node.name))
+    visit_AsyncFunctionDef = visit_FunctionDef  # type: ignore
+    visit_ClassDef = visit_FunctionDef  # type: ignore
 
-        return node
 
-    def visit_For(self, node: ast.For):
-        self.generic_visit(node)
+def module_alias(module: str) -> str:
+    # what a module an inlined body refers to is imported as at the call site
+    return consts.MACRO_MODULE + module.replace(".", "__")
 
-        match node.iter:
-            case TupleContainer():
-                ...
 
-            case DictContainer():
-                body = []
-                match node.target:
-                    case ast.Tuple(elts=[ast.Name(id=k), ast.Name(id=v)]) if k.startswith(
-                        consts.MACRO_SUBST
-                    ) and v.startswith(consts.MACRO_SUBST):
-                        clean_k = k[consts.MACRO_SUBST_LEN :]
-                        clean_v = v[consts.MACRO_SUBST_LEN :]
+class InlineTemplate(MacroTemplate):
+    # An `@inline!` function. Each invocation gets a copy of the body, with every parameter and local renamed to a
+    # temporary of its own; arguments that are plain names or constants are substituted instead. A body that's a
+    # single `return` becomes that expression, anything else can only be invoked as a statement. Inlined into another
+    # module, the body's free names are qualified with the module that defined it.
 
-                        for key, value in zip(node.iter.keys, node.iter.values):  # type: ignore
-                            self.vars[clean_k] = key
-                            self.vars[clean_v] = value
+    runtime = True
 
-                            body.append(self.visit(deepcopy(node.body[0])))
+    def __init__(self, node: ast.FunctionDef, scope: list[str], module: Optional[str] = None):
+        self.node = node = deepcopy(node)
+        self.name = node.name
+        self.args = node.args
+        self.scope = scope
+        self.module = module
+        self.plans = {}
 
-                        del self.vars[clean_k]
-                        del self.vars[clean_v]
-                        return body
+        # bumped for every distinct instantiation, so nested invocations never share temporaries
+        self.uses = 0
 
+        body = node.body
+        if body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant):
+            body = body[1:]
 
-        # for idx, stmt in enumerate(node.body):
-        #     if type(stmt) in EXPR_NODES:
-        #         node.body[idx] = ast.Expr(value=stmt)
+        self.body = body
 
-        return node
+        match body:
+            case [ast.Return(value=ast.expr() as value)]:
+                self.expression: Optional[ast.expr] = value
+
+            case _:
+                self.expression = None
+
+        params = node.args.posonlyargs + node.args.args + node.args.kwonlyargs
+        self.params = [param.arg for param in params]
+        self.locals = set(self.params)
+
+        if node.args.vararg or node.args.kwarg:
+            self.fail("*args and **kwargs can't be bound")
+
+        if not all(default is None or _is_simple(default) for default in node.args.defaults + node.args.kw_defaults):
+            self.fail("defaults have to be constants")
+
+        for child in _own_nodes(body):
+            match child:
+                case ast.Return() if self.expression is None and child is not body[-1]:
+                    self.fail("only the last statement can `return`")
+
+                case ast.Yield() | ast.YieldFrom() | ast.Await():
+                    self.fail("generators and coroutines can't be inlined")
+
+                case ast.Global() | ast.Nonlocal():
+                    self.fail("`global` and `nonlocal` can't be inlined")
+
+                case ast.Name(id=name, ctx=ast.Store() | ast.Del()):
+                    self.locals.add(name)
+
+                case ast.FunctionDef(name=name) | ast.AsyncFunctionDef(name=name) | ast.ClassDef(name=name):
+                    self.locals.add(name)
+
+                case ast.alias(name=name, asname=asname):
+                    if asname is None and "." in name:
+                        self.fail(f"`import {name}` needs an `as` name")
+
+                    self.locals.add(asname or name)
+
+        # parameters the body assigns to (or a nested scope rebinds) can't be substituted
+        self.assigned = {
+            child.id if isinstance(child, ast.Name) else child.arg
+            for stmt in body
+            for child in ast.walk(stmt)
+            if isinstance(child, ast.arg) or isinstance(child, ast.Name) and not isinstance(child.ctx, ast.Load)
+        }
+
+        # names the body (defaults included) reads without binding them anywhere
+        bound = bound_names(node) | {
+            name
+            for child in ast.walk(node)
+            for name in (getattr(child, "name", None), getattr(child, "rest", None))
+            if isinstance(child, (ast.ExceptHandler, ast.MatchAs, ast.MatchStar, ast.MatchMapping)) and name
+        }
+
+        self.free = {
+            child.id
+            for part in [*body, *node.args.defaults, *node.args.kw_defaults]
+            if part is not None
+            for child in ast.walk(part)
+            if isinstance(child, ast.Name) and child.id not in bound
+        }
+
+    def fail(self, reason: str):
+        raise ValueError(f"can't inline `{self.name}`: {reason}")
+
+    def qualify(self, module: Optional[str]) -> dict[str, ast.expr]:
+        # free name -> how `module` refers to it, builtins are the same everywhere
+        if module is None or self.module is None or module == self.module or not self.free:
+            return {}
+
+        try:
+            namespace = vars(sys.modules.get(self.module) or importlib.import_module(self.module))
+
+        except ImportError:
+            namespace = None
+
+        alias = module_alias(self.module)
+        qualified: dict[str, ast.expr] = {}
+
+        for name in sorted(self.free):
+            if namespace is not None and name in namespace:
+                qualified[name] = ast.Attribute(value=ast.Name(id=alias, ctx=ast.Load()), attr=name, ctx=ast.Load())
+
+            elif hasattr(builtins, name):
+                continue
+
+            elif namespace is None:
+                self.fail(f"`{name}` can't be resolved in `{module}`, `{self.module}` can't be imported")
+
+            else:
+                self.fail(f"`{name}` can't be resolved in `{module}`, it isn't a global of `{self.module}`")
+
+        return qualified
+
+    def call(self, args: list[ast.expr], kwargs: dict, module: Optional[str]) -> ast.Call:
+        # a plain call of the function, where the arguments can't be bound inline
+        if self.scope != (self.module or "").split("."):
+            self.fail("only module level functions can be called where `:=` isn't allowed")
+
+        func: ast.expr = ast.Name(id=self.name, ctx=ast.Load())
+
+        if module is not None and module != self.module:
+            alias = ast.Name(id=module_alias(self.module), ctx=ast.Load())  # type: ignore
+            func = ast.Attribute(value=alias, attr=self.name, ctx=ast.Load())
+
+        keywords = [ast.keyword(arg=arg_name(key), value=value) for key, value in kwargs.items()]
+
+        return ast.Call(func=func, args=list(args), keywords=keywords)
+
+    def bind(
+        self, args: list[ast.expr], kwargs: dict[str, ast.expr], qualified: Optional[dict[str, ast.expr]] = None
+    ) -> list[tuple[str, ast.expr]]:
+        # (parameter, value) in the order the call evaluates them, defaults last
+        positional = [param.arg for param in self.args.posonlyargs + self.args.args]
+
+        if len(args) > len(positional):
+            self.fail(f"takes {len(positional)} positional arguments but {len(args)} were given")
+
+        bound = list(zip(positional, args))
+
+        for name, value in kwargs.items():
+            if name not in self.params or name in dict(bound) or name in (p.arg for p in self.args.posonlyargs):
+                self.fail(f"unexpected keyword argument `{name}`")
+
+            bound.append((name, value))
+
+        defaults = dict(zip(reversed(positional), reversed(self.args.defaults)))
+        defaults.update((p.arg, d) for p, d in zip(self.args.kwonlyargs, self.args.kw_defaults) if d is not None)
+
+        given = dict(bound)
+        for name in self.params:
+            if name not in given:
+                if name not in defaults:
+                    self.fail(f"missing argument `{name}`")
+
+                default = defaults[name]
+
+                if qualified and isinstance(default, ast.Name) and default.id in qualified:
+                    default = qualified[default.id]
+
+                bound.append((name, deepcopy(default)))
+
+        return bound
+
+    def instantiate(self, args: list[ast.expr], kwargs: dict, module: Optional[str] = None, named_exprs=True) -> list:
+        # `module` is where the body ends up, `named_exprs` whether `:=` can be used there
+        self.uses += 1
+
+        qualified = self.qualify(module)
+
+        bound = self.bind(args, {arg_name(key): value for key, value in kwargs.items()}, qualified)
+        names = {name: f"{consts.MACRO_INLINE}{self.name}_{self.uses}_{name}" for name in self.locals}
 
+        values = {name: value for name, value in bound if name not in self.assigned and _is_simple(value)}
+        temps = [(names[name], value) for name, value in bound if name not in values]
 
+        rename = _Rename(names, {**qualified, **values})
 
-def subscript_invoke(node: ast.Subscript, macro: ast.FunctionDef):
+        if self.expression is not None:
+            value = rename.visit(deepcopy(self.expression))
+
+            if not temps:
+                return [value]
+
+            # comprehension iterables and comprehensions in a class body can't bind anything
+            if not named_exprs:
+                return [self.call(args, kwargs, module)]
+
+            # arguments are evaluated first and in order, the tuple only exists to sequence them
+            steps = [ast.NamedExpr(target=ast.Name(id=temp, ctx=ast.Store()), value=arg) for temp, arg in temps]
+            sequence = ast.Tuple(elts=[*steps, value], ctx=ast.Load())
+
+            return [ast.Subscript(value=sequence, slice=ast.Constant(value=-1), ctx=ast.Load())]
+
+        body = [ast.Assign(targets=[ast.Name(id=temp, ctx=ast.Store())], value=arg) for temp, arg in temps]
+        body.extend(rename.visit(stmt) for stmt in deepcopy(self.body))
+
+        match body:
+            case [*_, ast.Return(value=value)]:
+                body[-1:] = [] if value is None else [ast.Expr(value=value)]
+
+        return body or [ast.Pass()]
+
+    def __repr__(self):
+        return f"<InlineTemplate {self.name} ({', '.join(self.params)})>"
+
+
+def _is_simple(node: ast.AST) -> bool:
+    return isinstance(node, (ast.Constant, ast.Name))
+
+
+def _count_slots(plan: Plan) -> int:
+    kind, _, children = plan
+    count = kind != COPY
+
+    for child in children.values():
+        if isinstance(child, dict):
+            count += sum(map(_count_slots, child.values()))
+
+        else:
+            count += _count_slots(child)
+
+    return count
+
+
+def fingerprint(value: Any) -> Any:
+    # structural key for a subtree, positions left out; types are kept so `1`, `1.0` and `True` stay apart
+    if isinstance(value, ast.AST):
+        return (value.__class__, *(fingerprint(getattr(value, field, None)) for field in value._fields))
+
+    if isinstance(value, list):
+        return tuple(fingerprint(item) for item in value)
+
+    return (value.__class__, value)
+
+
+def _fresh(value: Any) -> Any:
+    # copies everything an expansion owns, without positions so each use is located at its own call site
+    if isinstance(value, ast.AST):
+        if TEMPLATE_FLAG in value.__dict__:
+            return value
+
+        new = value.__class__.__new__(value.__class__)
+        for key, item in value.__dict__.items():
+            if key not in value._attributes:
+                new.__dict__[key] = _fresh(item)
+
+        return new
+
+    if type(value) is list:
+        return [_fresh(item) for item in value]
+
+    return value
+
+
+CACHE_SIZE = 1024
+
+# (template, argument fingerprints, keyword fingerprints) -> instantiated body, never handed out directly
+_expansions: OrderedDict[tuple, list] = OrderedDict()
+_hits = 0
+_misses = 0
+
+
+def _expand(macro: MacroTemplate, args: list, kwargs: dict, options: Optional[dict] = None) -> list:
+    # `options` describe the call site, for templates whose output depends on it
+    global _hits, _misses
+
+    options = options or {}
+
+    key = (
+        macro,
+        tuple(fingerprint(arg) for arg in args),
+        tuple((fingerprint(k), fingerprint(v)) for k, v in kwargs.items()),
+        tuple(options.items()),
+    )
+
+    if (body := _expansions.get(key)) is not None:
+        _hits += 1
+        _expansions.move_to_end(key)
+
+    else:
+        _misses += 1
+
+        body = _expansions[key] = macro.instantiate(args, kwargs, **options)
+        if len(_expansions) > CACHE_SIZE:
+            _expansions.popitem(last=False)
+
+    return _fresh(body)
+
+
+def cache_info() -> dict[str, int]:
+    return {"hits": _hits, "misses": _misses, "size": len(_expansions), "maxsize": CACHE_SIZE}
+
+
+def cache_clear(maxsize: Optional[int] = None):
+    global CACHE_SIZE, _hits, _misses
+
+    _expansions.clear()
+    _hits = _misses = 0
+
+    if maxsize is not None:
+        CACHE_SIZE = maxsize
+
+
+def subscript_invoke(node: ast.Subscript, macro: MacroTemplate, options: Optional[dict] = None):
     args = []
     kwargs = {}
     if isinstance(node.slice, ast.Tuple):
@@ -277,19 +833,11 @@ def subscript_invoke(node: ast.Subscript, macro: ast.FunctionDef):
     else:
         args.append(node.slice)
 
-    interpreter = MacroInterpreter(macro.args, args, kwargs)
-    tree = interpreter.visit(macro)
+    return _expand(macro, args, kwargs, options)
 
-    return tree.body
 
-
-def call_invoke(node: ast.Call, macro: ast.FunctionDef):
+def call_invoke(node: ast.Call, macro: MacroTemplate, options: Optional[dict] = None):
     args = node.args
     kwargs = {ast.Name(id=k.arg, ctx=ast.Load()): k.value for k in node.keywords}
 
-    interpreter = MacroInterpreter(macro.args, args, kwargs)
-    tree = interpreter.visit(macro)
-
-    # astpretty.pprint(tree, show_offsets=False)
-
-    return tree.body
+    return _expand(macro, args, kwargs, options)
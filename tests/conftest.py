@@ -0,0 +1,102 @@
+# The MIT License (MIT)
+
+# Copyright (c) 2022 AnonymousDapper
+
+import ast
+import itertools
+import os
+import re
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+import pytest
+
+import micro.importer  # noqa: F401, installs the import hook
+from micro import config, pipeline
+
+_ids = itertools.count()
+
+
+def _unique(request) -> str:
+    # expansion results are cached per module, so every snippet gets a fresh one
+    test = re.sub(r"\W", "_", request.node.name)
+    return f"t_{test}_{next(_ids)}"
+
+
+@pytest.fixture
+def module_name(request) -> str:
+    return _unique(request)
+
+
+@pytest.fixture
+def expand(request):
+    def expand(src: str) -> str:
+        name = _unique(request)
+        return ast.unparse(pipeline.expand_source(textwrap.dedent(src), module=name))
+
+    return expand
+
+
+@pytest.fixture
+def run(request):
+    def run(src: str) -> dict:
+        name = _unique(request)
+        namespace = {"__name__": name}
+        exec(pipeline.compile_source(textwrap.dedent(src), module=name), namespace)
+
+        return namespace
+
+    return run
+
+
+@pytest.fixture
+def package(tmp_path: Path, monkeypatch):
+    # writes {"pkg/mod.py": source} under a fresh sys.path entry, importing is up to the test
+    monkeypatch.syspath_prepend(str(tmp_path))
+    created: set[str] = set()
+
+    def write(files: dict[str, str]) -> Path:
+        for name, source in files.items():
+            path = tmp_path / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(textwrap.dedent(source))
+            created.add(name.partition("/")[0].removesuffix(".py"))
+
+        return tmp_path
+
+    yield write
+
+    for name in list(sys.modules):
+        if name.partition(".")[0] in created:
+            del sys.modules[name]
+
+
+@pytest.fixture
+def python(tmp_path: Path):
+    # a fresh interpreter with the disk cache on, for anything that depends on what a previous process left behind
+    root = Path(__file__).resolve().parent.parent
+
+    def python(code: str, **env: str) -> subprocess.CompletedProcess:
+        environ = {k: v for k, v in os.environ.items() if not k.startswith(("MICRO_", "PYTHONDONTWRITEBYTECODE"))}
+        environ["PYTHONPATH"] = os.pathsep.join((str(root), str(tmp_path)))
+        environ.update(env)
+
+        return subprocess.run(
+            [sys.executable, "-c", textwrap.dedent(code)],
+            cwd=tmp_path,
+            env=environ,
+            capture_output=True,
+            text=True,
+        )
+
+    return python
+
+
+@pytest.fixture
+def configure():
+    # build configuration flags for the test, back to the defaults afterwards
+    yield lambda **flags: config.configure(flags)
+
+    config.reset()
@@ -0,0 +1,77 @@
+# The MIT License (MIT)
+
+# Copyright (c) 2022 AnonymousDapper
+
+import os
+import stat
+
+from micro import cache
+
+RUN = """
+import micro.importer
+import pk.c
+"""
+
+PACKAGE = {
+    "pk/__init__.py": "",
+    "pk/a.py": """
+        from micro import macro
+
+        @macro!
+        def twice(x):
+            $x * 2
+        """,
+    "pk/b.py": """
+        from pk.a import twice
+        """,
+    "pk/c.py": """
+        from pk.b import twice
+
+        print(twice!(21))
+        """,
+}
+
+
+def test_cold_and_warm_cache_agree(package, python):
+    root = package(PACKAGE)
+
+    cold = python(RUN)
+    assert cold.returncode == 0, cold.stderr
+    assert cold.stdout == "42\n"
+
+    assert list((root / "pk" / "__pycache__").glob(f"*{cache.CACHE_SUFFIX}"))
+
+    warm = python(RUN)
+    assert warm.returncode == 0, warm.stderr
+    assert warm.stdout == "42\n"
+
+
+def test_reexported_macro_from_a_warm_cache(package, python):
+    # only the importing module is expanded again, the re-export comes from the cache
+    root = package(PACKAGE)
+    assert python(RUN).stdout == "42\n"
+
+    (root / "pk" / "c.py").write_text("from pk.b import twice\n\nprint(twice!(20) + 1)\n")
+
+    result = python(RUN)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == "41\n"
+
+
+def test_cache_follows_dependency_edits(package, python):
+    root = package(PACKAGE)
+    assert python(RUN).stdout == "42\n"
+
+    (root / "pk" / "a.py").write_text("from micro import macro\n\n@macro!\ndef twice(x):\n    $x * 3\n")
+
+    assert python(RUN).stdout == "63\n"
+
+
+def test_cache_file_mode_follows_the_source(package, python):
+    root = package(PACKAGE)
+    os.chmod(root / "pk" / "c.py", 0o644)
+
+    assert python("import os\nos.umask(0o022)\n" + RUN).stdout == "42\n"
+
+    (cached,) = (root / "pk" / "__pycache__").glob(f"c.*{cache.CACHE_SUFFIX}")
+    assert stat.S_IMODE(cached.stat().st_mode) == 0o644
@@ -0,0 +1,142 @@
+# The MIT License (MIT)
+
+# Copyright (c) 2022 AnonymousDapper
+
+import pytest
+
+from micro.config import ConfigError
+
+FINALLY = """
+def f(calls):
+    try:
+        calls.append("body")
+    finally:
+        debug_assert!(calls, "empty")
+    return calls
+"""
+
+
+def test_if_cfg_keeps_the_selected_branch(expand, configure):
+    configure(feature=True)
+
+    out = expand(
+        """
+        if cfg!(feature):
+            x = 1
+        else:
+            x = 2
+        """
+    )
+
+    assert out == "x = 1"
+
+
+def test_cfg_decorator_drops_the_definition(expand, configure):
+    configure(feature=False)
+
+    out = expand(
+        """
+        @cfg!(feature)
+        def f():
+            pass
+
+        @cfg!(not feature)
+        def g():
+            pass
+        """
+    )
+
+    assert "def f" not in out
+    assert "def g" in out
+
+
+def test_cfg_elsewhere_is_a_constant(expand, configure):
+    configure(platform="linux")
+
+    assert expand('x = cfg!(platform="linux")') == "x = True"
+
+
+def test_cfg_rejects_what_it_cant_evaluate(expand):
+    with pytest.raises(ConfigError, match="not a configuration predicate"):
+        expand("x = cfg!(a < b)")
+
+
+def test_debug_assert_raises_when_debug_is_on(run, configure):
+    configure(debug=True)
+
+    namespace = run(
+        """
+        def f(x):
+            debug_assert!(x > 0, "x must be positive")
+            return x
+        """
+    )
+
+    assert namespace["f"](1) == 1
+
+    with pytest.raises(AssertionError, match="x must be positive"):
+        namespace["f"](-1)
+
+
+def test_debug_assert_is_removed_when_debug_is_off(expand, configure):
+    configure(debug=False)
+
+    assert "debug_assert" not in expand("debug_assert!(False)\nx = 1")
+
+
+def test_emptied_blocks_stay_valid(run, configure):
+    configure(debug=False)
+
+    namespace = run(
+        FINALLY
+        + """
+def g():
+    if True:
+        debug_assert!(False)
+    try:
+        pass
+    except ValueError:
+        debug_assert!(False)
+    else:
+        debug_assert!(False)
+    return "ok"
+"""
+    )
+
+    assert namespace["f"]([]) == ["body"]
+    assert namespace["g"]() == "ok"
+
+
+def test_emptied_finally_keeps_the_handlers(expand, configure):
+    configure(debug=False)
+
+    out = expand(
+        """
+        try:
+            x = 1
+        except ValueError:
+            x = 2
+        finally:
+            debug_assert!(x)
+        """
+    )
+
+    assert "finally" not in out
+    assert "except ValueError" in out
+
+
+@pytest.mark.parametrize(
+    "value, enabled", [("", False), ("0", False), ("false", False), (" Off ", False), ("1", True), ("yes", True)]
+)
+def test_env_flags(python, value, enabled):
+    result = python(
+        """
+        from micro import incremental, timing
+        print(incremental.ENABLED, timing.ENABLED)
+        """,
+        MICRO_INCREMENTAL=value,
+        MICRO_IMPORTTIME=value,
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split()[:2] == [str(enabled)] * 2
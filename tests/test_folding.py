@@ -0,0 +1,101 @@
+# The MIT License (MIT)
+
+# Copyright (c) 2022 AnonymousDapper
+
+import pytest
+
+from micro.folding import ConstError
+
+
+def test_const_evaluates_at_expansion(expand):
+    assert "SQUARES = (0, 1, 4, 9)" in expand("SQUARES = const!(tuple(i * i for i in range(4)))")
+
+
+def test_const_fold_folds_literal_expressions(expand):
+    out = expand(
+        """
+        from micro import const_fold
+
+        @const_fold!
+        def f(x):
+            return x * (60 * 60 * 24) + len("abc")
+        """
+    )
+
+    assert "return x * 86400 + 3" in out
+
+
+def test_const_fold_readme_example(expand):
+    source = """
+        from micro import const_fold
+
+        @const_fold!
+        def timeout(days):
+            return days * {}
+        """
+
+    assert "return days * 86400" in expand(source.format("(60 * 60 * 24)"))
+
+    # left associative, nothing in it is constant
+    assert "return days * 60 * 60 * 24" in expand(source.format("60 * 60 * 24"))
+
+
+def test_const_fold_leaves_builtins_the_module_rebinds(run):
+    namespace = run(
+        """
+        from math import pow
+        from micro import const_fold
+
+        def max(*args):
+            return "mine"
+
+        @const_fold!
+        def f():
+            return pow(2, 3), max(1, 2), min(1, 2)
+        """
+    )
+
+    assert namespace["f"]() == (8.0, "mine", 1)
+
+
+def test_const_fold_leaves_builtins_rebound_through_global(run):
+    namespace = run(
+        """
+        from micro import const_fold
+
+        def setup():
+            global abs
+            abs = lambda x: "mine"
+
+        setup()
+
+        @const_fold!
+        def f():
+            return abs(-1)
+        """
+    )
+
+    assert namespace["f"]() == "mine"
+
+
+def test_const_refuses_builtins_the_module_rebinds(expand):
+    with pytest.raises(ConstError, match="`pow` is rebound"):
+        expand(
+            """
+            from math import pow
+            X = const!(pow(2, 3))
+            """
+        )
+
+
+def test_const_size_is_checked_before_the_call(expand):
+    with pytest.raises(ConstError, match="about 300000000 items"):
+        expand('X = const!("a".ljust(300_000_000))')
+
+    with pytest.raises(ConstError, match="wide"):
+        expand('X = const!(f"{1:300000000}")')
+
+
+def test_const_errors_name_the_expression(expand):
+    with pytest.raises(ConstError, match=r"const!\(open\('x'\)\) `open` is not an allowed function"):
+        expand("X = const!(open('x'))")
@@ -0,0 +1,47 @@
+# The MIT License (MIT)
+
+# Copyright (c) 2022 AnonymousDapper
+
+import importlib
+import sys
+from importlib.machinery import SourceFileLoader
+
+from micro.importer import MacroImporter
+
+
+def files(pkg: str, reexport: str) -> dict[str, str]:
+    return {
+        f"{pkg}/__init__.py": "",
+        f"{pkg}/a.py": """
+            from micro import macro
+
+            @macro!
+            def twice(x):
+                $x * 2
+            """,
+        f"{pkg}/b.py": reexport,
+        f"{pkg}/c.py": f"""
+            from {pkg}.b import twice
+
+            value = twice!(21)
+            """,
+        f"{pkg}/plain.py": """
+            import os
+
+            value = 1
+            """,
+    }
+
+
+def test_reexport_without_macro_syntax(package, module_name):
+    package(files(module_name, f"from {module_name}.a import twice\n"))
+
+    assert importlib.import_module(f"{module_name}.c").value == 42
+    assert isinstance(sys.modules[f"{module_name}.b"].__loader__, MacroImporter)
+
+
+def test_plain_module_keeps_the_regular_loader(package, module_name):
+    package(files(module_name, ""))
+
+    assert importlib.import_module(f"{module_name}.plain").value == 1
+    assert type(sys.modules[f"{module_name}.plain"].__loader__) is SourceFileLoader
@@ -0,0 +1,84 @@
+# The MIT License (MIT)
+
+# Copyright (c) 2022 AnonymousDapper
+
+LERP = """
+from micro import inline
+
+@inline!
+def lerp(a, b, t):
+    return a + (b - a) * t
+"""
+
+
+def test_single_return_is_an_expression(expand):
+    out = expand(LERP + "\ny = lerp!(x0, x1, 0.5)\n")
+
+    assert "y = x0 + (x1 - x0) * 0.5" in out
+
+
+def test_arguments_are_evaluated_once_in_order(run):
+    ns = run(
+        LERP
+        + """
+calls = []
+
+def arg(value):
+    calls.append(value)
+    return value
+
+y = lerp!(arg(0), arg(10), arg(0.5))
+"""
+    )
+
+    assert ns["y"] == 5
+    assert ns["calls"] == [0, 10, 0.5]
+
+
+def test_statement_body_keeps_its_locals_apart(run):
+    ns = run(
+        """
+        from micro import inline
+
+        @inline!
+        def bump(items):
+            total = len(items)
+            items.append(total)
+
+        total = "caller's"
+        items = []
+        bump!(items)
+        bump!(items)
+        """
+    )
+
+    assert ns["items"] == [0, 1]
+    assert ns["total"] == "caller's"
+
+
+def test_inlined_function_is_still_callable(run):
+    assert run(LERP)["lerp"](0, 10, 0.5) == 5
+
+
+def test_inline_across_modules(package, module_name):
+    package(
+        {
+            f"{module_name}/__init__.py": "",
+            f"{module_name}/a.py": """
+                from micro import inline
+
+                SCALE = 3
+
+                @inline!
+                def scaled(x):
+                    return x * SCALE
+                """,
+            f"{module_name}/b.py": f"""
+                from {module_name}.a import scaled
+
+                value = scaled!(2)
+                """,
+        }
+    )
+
+    assert __import__(f"{module_name}.b", fromlist=["value"]).value == 6
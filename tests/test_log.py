@@ -0,0 +1,81 @@
+# The MIT License (MIT)
+
+# Copyright (c) 2022 AnonymousDapper
+
+import logging
+
+import pytest
+
+from micro import consts
+
+
+def test_log_checks_the_level_before_formatting(run, module_name, caplog):
+    namespace = run(
+        """
+        calls = []
+
+        def expensive():
+            calls.append(1)
+            return "x"
+
+        def f():
+            log!(DEBUG, "value %s", expensive())
+            log!("info", "done")
+        """
+    )
+
+    with caplog.at_level(logging.INFO):
+        namespace["f"]()
+
+    assert namespace["calls"] == []
+    assert [record.getMessage() for record in caplog.records] == ["done"]
+
+
+def test_log_in_a_method_uses_the_module_logger(expand):
+    out = expand(
+        """
+        class C:
+            def f(self):
+                log!(INFO, "in a method")
+                trace!("traced")
+        """
+    )
+
+    # bound once, at the top, under a name that isn't mangled in the class
+    assert out.count(f"import logging as {consts.MACRO_LOGGER}") == 1
+    assert not consts.MACRO_LOGGER.startswith("__")
+
+
+def test_log_below_the_minimum_is_removed(expand, configure):
+    configure(log_level="warning")
+
+    out = expand(
+        """
+        log!(INFO, "gone %s", expensive())
+        log!(ERROR, "kept")
+        """
+    )
+
+    assert "gone" not in out
+    assert "kept" in out
+
+
+def test_removed_log_in_finally_keeps_the_try_valid(run, configure):
+    configure(log_level="error")
+
+    namespace = run(
+        """
+        def f():
+            try:
+                return "ok"
+            finally:
+                log!(INFO, "cleaning up")
+        """
+    )
+
+    assert namespace["f"]() == "ok"
+
+
+def test_log_has_to_be_a_statement(expand):
+    with pytest.raises(ValueError, match="log! can only be used as a statement"):
+        expand('x = log!(INFO, "no")')
@@ -0,0 +1,169 @@
+# The MIT License (MIT)
+
+# Copyright (c) 2022 AnonymousDapper
+
+import pickle
+import sys
+
+import pytest
+
+
+def test_memo_caches_calls(run):
+    ns = run(
+        """
+        from micro.macros.advanced import memo
+
+        calls = []
+
+        @memo!
+        def sq(x):
+            calls.append(x)
+            return x * x
+
+        values = [sq(2), sq(2), sq(x=3), sq(3)]
+        """
+    )
+
+    assert ns["values"] == [4, 4, 9, 9]
+    assert ns["calls"] == [2, 3]
+
+    ns["sq"].cache_clear()
+    ns["sq"](2)
+    assert ns["calls"] == [2, 3, 2]
+
+
+def test_memo_looks_like_the_original(run):
+    ns = run(
+        '''
+        from micro.macros.advanced import memo
+
+        @memo!
+        def sq(x: int) -> int:
+            "squares"
+            return x * x
+
+        class Shape:
+            @memo!
+            def area(self, side):
+                return side * side
+        '''
+    )
+
+    sq = ns["sq"]
+    assert sq.__qualname__ == sq.__wrapped__.__qualname__ == "sq"
+    assert sq.__module__ == ns["__name__"]
+    assert sq.__doc__ == "squares"
+    assert sq.__annotations__ == {"x": int, "return": int}
+    assert ns["Shape"].area.__qualname__ == "Shape.area"
+
+
+def test_memo_pickles_by_reference(package, module_name):
+    package(
+        {
+            f"{module_name}.py": """
+                from micro.macros.advanced import memo
+
+                @memo!
+                def sq(x):
+                    return x * x
+                """
+        }
+    )
+
+    __import__(module_name)
+    sq = sys.modules[module_name].sq
+
+    assert pickle.loads(pickle.dumps(sq)) is sq
+
+
+def test_memo_evaluates_defaults_once(run):
+    ns = run(
+        """
+        from micro.macros.advanced import memo
+
+        made = []
+
+        def default(value):
+            made.append(value)
+            return value
+
+        @memo!
+        def add(x, y=default(1), *, z=default(2)):
+            return x + y + z
+
+        values = [add(1), add(1, 2), add(1, z=0)]
+        """
+    )
+
+    assert ns["made"] == [1, 2]
+    assert ns["values"] == [4, 5, 2]
+
+
+@pytest.mark.parametrize(
+    "policy, kept, evicted",
+    [
+        # `a` was used most recently, `b` goes
+        ("lru", "a", "b"),
+        # oldest in, first out, whatever was used since
+        ("fifo", "b", "a"),
+        # `a` was used since its last chance, `b` goes
+        ("clock", "a", "b"),
+    ],
+)
+def test_memo_eviction_order(run, policy, kept, evicted):
+    ns = run(
+        f"""
+        from micro.macros.advanced import memo
+
+        calls = []
+
+        @memo!(maxsize=2, policy="{policy}")
+        def f(x):
+            calls.append(x)
+            return x
+
+        f("a"); f("b"); f("a"); f("c")
+        del calls[:]
+        f("c"); f("{kept}"); f("{evicted}")
+        """
+    )
+
+    assert ns["calls"] == [evicted]
+
+
+def test_memo_lru_tracks_every_hit(run):
+    ns = run(
+        """
+        from micro.macros.advanced import memo
+
+        calls = []
+
+        @memo!(maxsize=3, policy="lru")
+        def f(x):
+            calls.append(x)
+            return x
+
+        for x in "abcbacd":
+            f(x)
+        """
+    )
+
+    # `b` was the least recently used when `d` came in
+    assert ns["calls"] == list("abcd")
+    ns["calls"].clear()
+
+    ns["f"]("b")
+    assert ns["calls"] == ["b"]
+
+
+def test_memo_rejects_unknown_policy(expand):
+    with pytest.raises(Exception, match="'clock', 'lru' or 'fifo'"):
+        expand(
+            """
+            from micro.macros.advanced import memo
+
+            @memo!(policy="mru")
+            def f(x):
+                return x
+            """
+        )
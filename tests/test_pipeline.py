@@ -0,0 +1,88 @@
+# The MIT License (MIT)
+
+# Copyright (c) 2022 AnonymousDapper
+
+import ast
+
+import pytest
+
+from micro import pipeline
+
+SOURCE = """
+from micro import const_fold
+
+@const_fold!
+def f():
+    return 2 * 3
+"""
+
+
+@pytest.fixture
+def source_cache():
+    maxsize = pipeline.cache_info()["maxsize"]
+    pipeline.cache_clear()
+
+    yield
+
+    pipeline.cache_clear(maxsize)
+
+
+def test_same_source_is_expanded_once(source_cache, module_name):
+    first = pipeline.compile_source(SOURCE, module=module_name)
+    second = pipeline.compile_source(SOURCE, module=module_name)
+
+    assert first is second
+    assert pipeline.cache_info()["hits"] == 1
+    assert pipeline.cache_info()["misses"] == 1
+
+
+def test_expand_source_returns_a_copy(source_cache, module_name):
+    tree = pipeline.expand_source(SOURCE, module=module_name)
+    tree.body.clear()
+
+    assert pipeline.expand_source(SOURCE, module=module_name).body
+
+
+def test_configuration_is_part_of_the_key(source_cache, module_name, configure):
+    src = "x = cfg!(feature)\n"
+
+    configure(feature=True)
+    on = pipeline.compile_source(src, module=module_name)
+    assert ast.unparse(pipeline.expand_source(src, module=module_name)) == "x = True"
+
+    configure(feature=False)
+    off = pipeline.compile_source(src, module=module_name)
+    assert ast.unparse(pipeline.expand_source(src, module=module_name)) == "x = False"
+
+    assert on is not off
+    assert pipeline.cache_info()["misses"] == 2
+
+
+def test_registering_a_macro_invalidates(source_cache, module_name, run):
+    src = "y = 1\n"
+    before = pipeline.compile_source(src, module=module_name)
+
+    run(
+        """
+        from micro import macro
+
+        @macro!
+        def registered(x):
+            $x
+        """
+    )
+
+    assert pipeline.compile_source(src, module=module_name) is not before
+
+
+def test_oldest_entry_is_evicted(source_cache, module_name):
+    pipeline.cache_clear(2)
+
+    for value in range(3):
+        pipeline.compile_source(f"x = {value}\n", module=module_name)
+
+    assert pipeline.cache_info()["size"] == 2
+
+    pipeline.compile_source("x = 2\n", module=module_name)
+    pipeline.compile_source("x = 0\n", module=module_name)
+    assert pipeline.cache_info()["hits"] == 1
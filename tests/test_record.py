@@ -0,0 +1,71 @@
+# The MIT License (MIT)
+
+# Copyright (c) 2022 AnonymousDapper
+
+import pytest
+
+POINT = """
+from micro.macros.advanced import record
+
+@record!{options}
+class Point:
+    x: int
+    y: int = 0
+
+    def norm(self):
+        return self.x + self.y
+"""
+
+
+def test_record_generates_members(run):
+    Point = run(POINT.format(options=""))["Point"]
+
+    p = Point(1, y=2)
+    assert (p.x, p.y, p.norm()) == (1, 2, 3)
+    assert Point(1) == Point(1, 0)
+    assert Point(1) != Point(2)
+    assert repr(p) == "Point(x=1, y=2)"
+    assert Point.__match_args__ == ("x", "y")
+    assert Point.__hash__ is None
+
+    with pytest.raises(AttributeError):
+        p.z = 3
+
+
+def test_record_members_are_generated_at_expansion(expand):
+    out = expand(POINT.format(options=""))
+
+    assert "def __init__(self, x, y=0):" in out
+    assert "__slots__" in out
+    assert "exec" not in out
+
+
+def test_frozen_record(run):
+    ns = run(POINT.format(options="(frozen=True)") + "\nPOINT = Point(1, 2)\n")
+    p = ns["POINT"]
+
+    assert hash(p) == hash(ns["Point"](1, 2))
+
+    with pytest.raises(AttributeError, match="cannot assign 'x'"):
+        p.x = 3
+
+    # pickling restores through __reduce__, not setattr
+    assert p.__reduce__() == (ns["Point"], (1, 2))
+
+
+def test_record_keeps_members_the_class_defines(run):
+    Point = run(
+        """
+        from micro.macros.advanced import record
+
+        @record!(eq=False)
+        class Point:
+            x: int
+
+            def __repr__(self):
+                return "custom"
+        """
+    )["Point"]
+
+    assert repr(Point(1)) == "custom"
+    assert Point(1) != Point(1)
@@ -0,0 +1,225 @@
+# The MIT License (MIT)
+
+# Copyright (c) 2022 AnonymousDapper
+
+import pytest
+
+from micro import tree, walker
+from micro.tree import ExpansionLimitError
+
+
+def test_substitution_and_quote(run, capsys):
+    run(
+        """
+        from micro import macro
+
+        @macro!
+        def show(x):
+            print(quote!($x), "=", $x)
+
+        show!(5 + 3 / 2)
+        """
+    )
+
+    assert capsys.readouterr().out == "5 + 3 / 2 = 6.5\n"
+
+
+def test_repetition_over_args(run, capsys):
+    run(
+        """
+        from micro import macro
+
+        @macro!
+        def each(*args):
+            for $a in $args:
+                print("item", $a)
+            else:
+                print("done")
+
+        each!(1, 2 + 1)
+        """
+    )
+
+    assert capsys.readouterr().out == "item 1\nitem 3\ndone\n"
+
+
+def test_repetition_unpacks_pairs(run, capsys):
+    run(
+        """
+        from micro import macro
+
+        @macro!
+        def pairs(*ps):
+            for $a, $b in $ps:
+                print($a + $b)
+
+        pairs!((1, 2), [3, 4])
+        """
+    )
+
+    assert capsys.readouterr().out == "3\n7\n"
+
+
+def test_repetition_over_kwargs_by_name_and_value(run, capsys):
+    run(
+        """
+        from micro import macro
+
+        @macro!
+        def table(*rows, **cols):
+            for $r in $rows:
+                for $k, $v in $cols:
+                    print($r, quote!($k), $v)
+
+        table!(10, a=1, b=2)
+        """
+    )
+
+    assert capsys.readouterr().out == "10 a 1\n10 b 2\n"
+
+
+def test_repetition_over_kwargs_with_one_name(run, capsys):
+    run(
+        """
+        from micro import macro
+
+        @macro!
+        def show(**k):
+            for $a in $k:
+                print($a)
+
+        show!(x=1, y=2)
+        """
+    )
+
+    assert capsys.readouterr().out == "('x', 1)\n('y', 2)\n"
+
+
+def test_repetition_over_a_literal_dict_with_one_name(run, capsys):
+    run(
+        """
+        from micro import macro
+
+        @macro!
+        def items(d):
+            for $a in $d:
+                print($a)
+
+        key = "k"
+        items!({key: 1, "b": 2})
+        """
+    )
+
+    assert capsys.readouterr().out == "('k', 1)\n('b', 2)\n"
+
+
+def test_repetition_item_that_doesnt_unpack(expand):
+    with pytest.raises(ValueError, match=r"doesn't unpack into \$a, \$b"):
+        expand(
+            """
+            from micro import macro
+
+            @macro!
+            def pairs(*ps):
+                for $a, $b in $ps:
+                    print($a, $b)
+
+            pairs!((1, 2, 3))
+            """
+        )
+
+
+def test_runtime_loops_stay_loops(run, capsys):
+    run(
+        """
+        from micro import macro
+
+        @macro!
+        def each(xs):
+            for $a in $xs:
+                print($a)
+
+        ys = [7, 8]
+        each!(ys)
+        """
+    )
+
+    assert capsys.readouterr().out == "7\n8\n"
+
+
+def test_expansions_are_memoized(run):
+    before = walker.cache_info()
+
+    run(
+        """
+        from micro import macro
+
+        @macro!
+        def twice(x):
+            $x * 2
+
+        a = twice!(3)
+        b = twice!(3)
+        """
+    )
+
+    after = walker.cache_info()
+    assert after["hits"] > before["hits"]
+
+
+def test_recursive_expansion_is_limited(expand):
+    with pytest.raises(ExpansionLimitError, match="more than 64 macros deep"):
+        expand(
+            """
+            from micro import macro
+
+            @macro!
+            def loop(x):
+                loop!($x)
+
+            loop!(1)
+            """
+        )
+
+
+def test_expansion_growth_is_limited(expand, monkeypatch):
+    monkeypatch.setattr(tree, "MAX_GROWTH", 50)
+
+    with pytest.raises(ExpansionLimitError, match="produced more than 50 nodes"):
+        expand(
+            """
+            from micro import macro
+
+            @macro!
+            def show(x):
+                print($x, $x, $x)
+
+            @macro!
+            def wide(*xs):
+                for $x in $xs:
+                    show!($x)
+
+            wide!(1, 2, 3, 4, 5, 6, 7, 8, 9, 10)
+            """
+        )
+
+
+def test_nested_expansion_within_the_limits(run, capsys):
+    run(
+        """
+        from micro import macro
+
+        @macro!
+        def one(x):
+            print($x)
+
+        @macro!
+        def two(x):
+            one!($x)
+            one!($x + 1)
+
+        two!(1)
+        """
+    )
+
+    assert capsys.readouterr().out == "1\n2\n"
@@ -0,0 +1,53 @@
+# The MIT License (MIT)
+
+# Copyright (c) 2022 AnonymousDapper
+
+RUN = """
+from micro import timing
+import micro.importer
+import tm.b
+
+(root,) = [record for record in timing.records() if record.name == "tm.b"]
+(child,) = root.children
+
+print(root.name, child.name)
+print(set(root.phases) <= set(timing.PHASES), set(child.phases) <= set(timing.PHASES))
+print("expand" in child.phases, child.nodes_before > 0, root.total >= child.total)
+"""
+
+PACKAGE = {
+    "tm/__init__.py": "",
+    "tm/a.py": """
+        from micro import macro
+
+        @macro!
+        def twice(x):
+            $x * 2
+        """,
+    "tm/b.py": """
+        from tm.a import twice
+
+        value = twice!(2)
+        """,
+}
+
+
+def test_import_time_breakdown(package, python):
+    package(PACKAGE)
+
+    result = python(RUN, MICRO_IMPORTTIME="1")
+    assert result.returncode == 0, result.stderr
+
+    assert result.stdout.splitlines() == ["tm.b tm.a", "True True", "True True True"]
+    assert "micro import time: self [us] | cumulative | " in result.stderr
+    assert result.stderr.rstrip().endswith("tm.a")
+
+
+def test_import_time_is_off_by_default(package, python):
+    package(PACKAGE)
+
+    result = python("from micro import timing\nimport micro.importer\nimport tm.b\nprint(timing.records())")
+    assert result.returncode == 0, result.stderr
+
+    assert result.stdout == "[]\n"
+    assert "micro import time" not in result.stderr
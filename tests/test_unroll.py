@@ -0,0 +1,87 @@
+# The MIT License (MIT)
+
+# Copyright (c) 2022 AnonymousDapper
+
+
+def test_constant_range_is_unrolled(run, expand):
+    src = """
+        from micro.macros.advanced import unroll
+
+        @unroll!
+        def f():
+            total = 0
+            for i in range(3):
+                total += i * i
+            return total, i
+        """
+
+    assert "for i in" not in expand(src)
+    assert run(src)["f"]() == (5, 2)
+
+
+def test_literal_tuple_is_unrolled(expand):
+    out = expand(
+        """
+        from micro.macros.advanced import unroll
+
+        @unroll!
+        def f(out):
+            for x in (1, "a"):
+                out.append(x)
+        """
+    )
+
+    assert "out.append(1)" in out
+    assert "out.append('a')" in out
+
+
+def test_factor_keeps_a_loop(run, expand):
+    src = """
+        from micro.macros.advanced import unroll
+
+        @unroll!(2)
+        def f():
+            seen = []
+            for i in range(5):
+                seen.append(i)
+            return seen
+        """
+
+    assert "for " in expand(src)
+    assert run(src)["f"]() == [0, 1, 2, 3, 4]
+
+
+def test_range_rebound_by_the_module_is_left_alone(run, expand):
+    src = """
+        from micro.macros.advanced import unroll
+
+        def range(n):
+            return [n]
+
+        @unroll!
+        def f():
+            seen = []
+            for i in range(3):
+                seen.append(i)
+            return seen
+        """
+
+    assert "for i in range(3)" in expand(src)
+    assert run(src)["f"]() == [3]
+
+
+def test_len_rebound_by_the_module_is_left_alone(expand):
+    out = expand(
+        """
+        from micro.macros.advanced import unroll
+
+        len = lambda value: 1
+
+        @unroll!
+        def f(out):
+            for i in range(len((1, 2, 3))):
+                out.append(i)
+        """
+    )
+
+    assert "for i in range(len((1, 2, 3)))" in out
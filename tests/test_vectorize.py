@@ -0,0 +1,94 @@
+# The MIT License (MIT)
+
+# Copyright (c) 2022 AnonymousDapper
+
+import pytest
+
+HEADER = """
+from micro.macros.advanced import vectorize
+
+@vectorize!
+"""
+
+
+def test_loop_checks_every_array_it_reads_and_writes(expand):
+    out = expand(
+        HEADER
+        + """
+def f(a, b, out):
+    for i in range(len(a)):
+        out[i] = a[i] + b[i]
+"""
+    )
+
+    assert "raise IndexError('b is shorter than the loop')" in out
+    assert "raise IndexError('out is shorter than the loop')" in out
+    assert "'a is shorter" not in out
+    assert ".tolist()" in out
+
+
+def test_iterating_a_name_is_left_alone(expand):
+    out = expand(
+        HEADER
+        + """
+def f(a, b):
+    return [x * 2 for x in a], [x + y for x, y in zip(a, b)]
+"""
+    )
+
+    assert "[x * 2 for x in a]" in out
+    assert "[x + y for x, y in zip(a, b)]" in out
+
+
+def test_comprehension_only_reads_the_array_it_ranges_over(expand):
+    out = expand(
+        HEADER
+        + """
+def f(a, b):
+    return [a[i] * 2 for i in range(len(a))], [a[i] + b[i] for i in range(len(a))]
+"""
+    )
+
+    assert "[a[i] + b[i] for i in range(len(a))]" in out
+    assert "tolist()" in out
+
+
+def test_vectorized_results_match_the_loop(run):
+    pytest.importorskip("numpy")
+
+    namespace = run(
+        HEADER
+        + """
+def f(a, b, out):
+    for i in range(len(a)):
+        out[i] = a[i] * 2 + b[i]
+    return out
+"""
+    )
+
+    assert namespace["f"]([1, 2], [3, 4], [0, 0]) == [5, 8]
+    assert all(type(item) is int for item in namespace["f"]([1, 2], [3, 4], [0, 0]))
+
+    with pytest.raises(IndexError):
+        namespace["f"]([1, 2], [10], [0, 0])
+
+    with pytest.raises(IndexError):
+        namespace["f"]([1, 2], [3, 4], [0])
+
+
+def test_range_rebound_by_the_module_is_left_alone(expand):
+    out = expand(
+        """
+from micro.macros.advanced import vectorize
+
+range = lambda n: [n - 1]
+
+@vectorize!
+def f(a, out):
+    for i in range(len(a)):
+        out[i] = a[i] * 2
+"""
+    )
+
+    assert "for i in range(len(a))" in out
+    assert "shorter than the loop" not in out